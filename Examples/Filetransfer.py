@@ -7,6 +7,7 @@
 
 import os
 import sys
+import shutil
 import time
 import threading
 import argparse
@@ -85,6 +86,11 @@ def client_connected(link):
 
 		link.link_closed_callback(client_disconnected)
 
+		# Files are sent as resumable resources, so
+		# a client that reconnects after losing the
+		# link can continue an interrupted download
+		link.set_resource_resumable(True)
+
 		# We pack a list of files for sending in a packet
 		data = umsgpack.packb(list_files())
 
@@ -119,11 +125,14 @@ def client_request(message, packet):
 	if message in list_files():
 		try:
 			# If we have the requested file, we'll
-			# read it and pack it as a resource
+			# open it and pack it as a resource. The
+			# resource reads the file as it needs to,
+			# so we keep it open until it concludes.
 			RNS.log("Client requested \""+message+"\"")
-			file = open(os.path.join(serve_path, message), "r")
-			file_resource = RNS.Resource(file.read(), packet.link, callback=resource_sending_concluded)
+			file = open(os.path.join(serve_path, message), "rb")
+			file_resource = RNS.Resource(file, packet.link, callback=resource_sending_concluded)
 			file_resource.filename = message
+			file_resource.file = file
 		except:
 			# If somethign went wrong, we close
 			# the link
@@ -137,6 +146,7 @@ def client_request(message, packet):
 # This function is called on the server when a
 # resource transfer concludes.
 def resource_sending_concluded(resource):
+	resource.file.close()
 	if resource.status == RNS.Resource.COMPLETE:
 		RNS.log("Done sending \""+resource.filename+"\" to client")
 	elif resource.status == RNS.Resource.FAILED:
@@ -218,8 +228,17 @@ def client(destination_hexhash, configpath):
 	# downloading advertised resources
 	link.set_resource_strategy(RNS.Link.ACCEPT_ALL)
 	link.resource_started_callback(download_began)
+
+	# Completed downloads are spooled to disk, so
+	# we receive them as file objects instead of
+	# holding the entire file in memory
+	link.set_resource_spooling(True)
 	link.resource_concluded_callback(download_concluded)
 
+	# Interrupted downloads are saved, and resumed
+	# if the same file is requested again later
+	link.set_resource_resumable(True)
+
 	menu()
 
 # Requests the specified file from the server
@@ -431,9 +450,10 @@ def download_concluded(resource):
 			saved_filename = current_filename+"."+str(counter)
 
 		try:
-			file = open(saved_filename, "w")
-			file.write(resource.data)
+			file = open(saved_filename, "wb")
+			shutil.copyfileobj(resource.data, file)
 			file.close()
+			resource.data.close()
 			menu_mode = "download_concluded"
 		except:
 			menu_mode = "save_error"
@@ -4,6 +4,9 @@ import os
 import RNS
 import time
 import atexit
+import sqlite3
+import threading
+from collections import OrderedDict
 import vendor.umsgpack as umsgpack
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
@@ -13,6 +16,26 @@ from cryptography.hazmat.primitives.serialization import load_der_private_key
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric import padding
 
+# Verifies a signature made by the holder of the DER
+# encoded public key. This is a module-level function
+# so that it can be pickled, and announce validation
+# handed to worker processes by Transport.
+def verifySignature(public_key, signature, message):
+	try:
+		pub = load_der_public_key(public_key, backend=default_backend())
+		pub.verify(
+			signature,
+			message,
+			padding.PSS(
+				mgf=padding.MGF1(hashes.SHA256()),
+				salt_length=padding.PSS.MAX_LENGTH
+			),
+			hashes.SHA256()
+		)
+		return True
+	except Exception as e:
+		return False
+
 class Identity:
    #KEYSIZE     = 1536
 	KEYSIZE     = 1024
@@ -25,48 +48,339 @@ class Identity:
 
 	TRUNCATED_HASHLENGTH = 80 # In bits
 
-	# Storage
-	known_destinations = {}
+	# Storage. Known destinations are written to an
+	# sqlite database as they are remembered, and
+	# only loaded into memory when recalled. In
+	# memory, they are kept in least recently used
+	# order.
+	known_destinations      = OrderedDict()
+	known_destinations_lock = threading.Lock()
+	storage                 = None
+	storage_lock            = threading.Lock()
+	STORAGE_COMPACT_INTERVAL = 60*60
+
+	# Remembered destinations are committed to the
+	# database in batches, at most this many seconds
+	# after they were stored. Until then they are
+	# only visible on the same connection.
+	STORAGE_COMMIT_INTERVAL = 1.0
+	storage_commit_pending  = False
+
+	# Retention of known destinations. At most
+	# known_destinations_max entries are kept in
+	# memory, and entries that have not been used
+	# for known_destinations_max_age seconds are
+	# forgotten. Destinations with a link are
+	# evicted last, and destinations with a link
+	# or a path in use are never forgotten.
+	known_destinations_max     = 16384
+	known_destinations_max_age = 60*60*24*30
+	known_destinations_evicted = 0	# Evicted from memory
+	known_destinations_expired = 0	# Forgotten due to age
+	KNOWN_DESTINATIONS_CULL_INTERVAL = 5*60
+
+	verifySignature = staticmethod(verifySignature)
+
+	# Identities with parsed public keys, keyed by
+	# destination hash, in least recently used order
+	identity_cache        = OrderedDict()
+	identity_cache_size   = 1024
+	identity_cache_lock   = threading.Lock()
+	identity_cache_hits   = 0
+	identity_cache_misses = 0
 
 	@staticmethod
 	def remember(packet_hash, destination_hash, public_key, app_data = None):
 		RNS.log("Remembering "+RNS.prettyhexrep(destination_hash), RNS.LOG_VERBOSE)
-		Identity.known_destinations[destination_hash] = [time.time(), packet_hash, public_key, app_data]
-
+		now = time.time()
+		# Entry format is
+		identity_data = [now,			# 0: Timestamp
+						 packet_hash,	# 1: Announce packet hash
+						 public_key,	# 2: Public key
+						 app_data,		# 3: Application data
+						 now]			# 4: Last used
+		Identity.storeKnownDestination(destination_hash, identity_data)
+		Identity.holdKnownDestination(destination_hash, identity_data)
 
 	@staticmethod
 	def recall(destination_hash):
 		RNS.log("Searching for "+RNS.prettyhexrep(destination_hash)+"...", RNS.LOG_EXTREME)
-		if destination_hash in Identity.known_destinations:
-			identity_data = Identity.known_destinations[destination_hash]
-			identity = Identity(public_only=True)
-			identity.loadPublicKey(identity_data[2])
+		with Identity.known_destinations_lock:
+			identity_data = Identity.known_destinations.pop(destination_hash, None)
+			if identity_data != None:
+				identity_data[4] = time.time()
+				Identity.known_destinations[destination_hash] = identity_data
+
+		if identity_data == None:
+			identity_data = Identity.loadKnownDestination(destination_hash)
+
+		if identity_data != None:
+			identity = Identity.lookupIdentity(destination_hash, identity_data[2])
+			if identity == None:
+				identity = Identity(public_only=True)
+				identity.loadPublicKey(identity_data[2])
+				Identity.cacheIdentity(destination_hash, identity)
 			RNS.log("Found "+RNS.prettyhexrep(destination_hash)+" in known destinations", RNS.LOG_EXTREME)
 			return identity
 		else:
 			RNS.log("Could not find "+RNS.prettyhexrep(destination_hash)+" in known destinations", RNS.LOG_EXTREME)
 			return None
 
+	# Returns the cached identity for the destination
+	# hash, if its public key matches the one given
+	@staticmethod
+	def lookupIdentity(destination_hash, public_key):
+		with Identity.identity_cache_lock:
+			identity = Identity.identity_cache.pop(destination_hash, None)
+			if identity != None and identity.pub_bytes == public_key:
+				Identity.identity_cache[destination_hash] = identity
+				Identity.identity_cache_hits += 1
+				return identity
+			else:
+				Identity.identity_cache_misses += 1
+				return None
+
+	@staticmethod
+	def cacheIdentity(destination_hash, identity):
+		if identity.pub != None:
+			with Identity.identity_cache_lock:
+				Identity.identity_cache.pop(destination_hash, None)
+				Identity.identity_cache[destination_hash] = identity
+				while len(Identity.identity_cache) > Identity.identity_cache_size:
+					Identity.identity_cache.popitem(last=False)
+
+	@staticmethod
+	def storeKnownDestination(destination_hash, identity_data):
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					Identity.storage.execute(
+						"INSERT OR REPLACE INTO known_destinations VALUES (?, ?, ?, ?, ?, ?)",
+						Identity.storageRow(destination_hash, identity_data)
+					)
+					schedule_commit = not Identity.storage_commit_pending
+					Identity.storage_commit_pending = True
+
+				if schedule_commit:
+					RNS.Transport.schedule(Identity.STORAGE_COMMIT_INTERVAL, Identity.commitKnownDestinations)
+			except Exception as e:
+				RNS.log("Error while storing known destination "+RNS.prettyhexrep(destination_hash)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def commitKnownDestinations():
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					Identity.storage_commit_pending = False
+					Identity.storage.commit()
+			except Exception as e:
+				RNS.log("Error while committing known destinations, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def loadKnownDestination(destination_hash):
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					row = Identity.storage.execute(
+						"SELECT timestamp, packet_hash, public_key, app_data FROM known_destinations WHERE destination_hash = ?",
+						(buffer(destination_hash),)
+					).fetchone()
+			except Exception as e:
+				RNS.log("Error while loading known destination "+RNS.prettyhexrep(destination_hash)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+				return None
+
+			if row != None:
+				identity_data = [row[0], str(row[1]) if row[1] != None else None, str(row[2]), str(row[3]) if row[3] != None else None, time.time()]
+				Identity.holdKnownDestination(destination_hash, identity_data)
+				return identity_data
+
+		return None
+
+	@staticmethod
+	def storageRow(destination_hash, identity_data):
+		packet_hash = buffer(identity_data[1]) if identity_data[1] != None else None
+		app_data = buffer(identity_data[3]) if identity_data[3] != None else None
+		last_used = identity_data[4] if len(identity_data) > 4 else identity_data[0]
+		return (buffer(destination_hash), identity_data[0], packet_hash, buffer(identity_data[2]), app_data, last_used)
+
+	@staticmethod
+	def holdKnownDestination(destination_hash, identity_data):
+		with Identity.known_destinations_lock:
+			Identity.known_destinations.pop(destination_hash, None)
+			Identity.known_destinations[destination_hash] = identity_data
+			should_evict = len(Identity.known_destinations) > Identity.known_destinations_max
+
+		if should_evict:
+			Identity.evictKnownDestinations()
+
+	# Returns the hashes of destinations that have an
+	# active or pending link. These functions must not
+	# be called while holding the known destinations
+	# lock, since Transport may recall destinations
+	# while holding its own.
+	@staticmethod
+	def linkedDestinations():
+		linked = set()
+		with RNS.Transport.table_lock:
+			for link in list(RNS.Transport.active_links.values())+list(RNS.Transport.pending_links.values()):
+				if link.destination != None:
+					linked.add(link.destination.hash)
+
+		return linked
+
+	# Returns the hashes of destinations that should
+	# not be forgotten: those with a link, and those
+	# with a path that has been heard or used since
+	# the cutoff
+	@staticmethod
+	def protectedDestinations(cutoff):
+		protected = Identity.linkedDestinations()
+		with RNS.Transport.table_lock:
+			for destination_hash, destination_entry in RNS.Transport.destination_table.items():
+				if destination_entry[0] >= cutoff:
+					protected.add(destination_hash)
+
+		return protected
+
+	# Evicts the least recently used destinations
+	# from memory, down to seven eighths of the
+	# maximum, so that eviction runs in batches.
+	# Destinations with a link are passed over, but
+	# the maximum is enforced even if links hold
+	# more than that. Evicted entries stay in the
+	# database, with their last use written back,
+	# and are loaded again when recalled.
+	@staticmethod
+	def evictKnownDestinations():
+		linked = Identity.linkedDestinations()
+		target = Identity.known_destinations_max - Identity.known_destinations_max/8
+		evicted = []
+		with Identity.known_destinations_lock:
+			for destination_hash in Identity.known_destinations.keys():
+				if len(Identity.known_destinations) <= target:
+					break
+				if not destination_hash in linked:
+					evicted.append(Identity.storageRow(destination_hash, Identity.known_destinations.pop(destination_hash)))
+
+			for destination_hash in Identity.known_destinations.keys():
+				if len(Identity.known_destinations) <= Identity.known_destinations_max:
+					break
+				evicted.append(Identity.storageRow(destination_hash, Identity.known_destinations.pop(destination_hash)))
+
+			Identity.known_destinations_evicted += len(evicted)
+
+		if Identity.storage != None and len(evicted) > 0:
+			try:
+				with Identity.storage_lock:
+					Identity.storage.executemany("INSERT OR REPLACE INTO known_destinations VALUES (?, ?, ?, ?, ?, ?)", evicted)
+					Identity.storage.commit()
+			except Exception as e:
+				RNS.log("Error while storing evicted known destinations, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	# Forgets destinations that have not been used
+	# for longer than the maximum age, both in
+	# memory and in the database
+	@staticmethod
+	def cullKnownDestinations():
+		cutoff = time.time() - Identity.known_destinations_max_age
+		protected = Identity.protectedDestinations(cutoff)
+		expired = []
+		with Identity.known_destinations_lock:
+			for destination_hash in Identity.known_destinations.keys():
+				if Identity.known_destinations[destination_hash][4] < cutoff and not destination_hash in protected:
+					Identity.known_destinations.pop(destination_hash)
+					expired.append(destination_hash)
+			in_memory = set(Identity.known_destinations.keys())
+
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					rows = Identity.storage.execute("SELECT destination_hash FROM known_destinations WHERE last_used < ?", (cutoff,)).fetchall()
+					for row in rows:
+						destination_hash = str(row[0])
+						if not destination_hash in protected and not destination_hash in in_memory:
+							expired.append(destination_hash)
+
+					Identity.storage.executemany("DELETE FROM known_destinations WHERE destination_hash = ?", ((buffer(destination_hash),) for destination_hash in set(expired)))
+					Identity.storage.commit()
+			except Exception as e:
+				RNS.log("Error while culling known destinations storage, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+		expired = set(expired)
+		Identity.known_destinations_expired += len(expired)
+		if len(expired) > 0:
+			RNS.log("Forgot "+str(len(expired))+" known destinations not used for "+str(Identity.known_destinations_max_age)+" seconds", RNS.LOG_VERBOSE)
+
+		RNS.Transport.schedule(Identity.KNOWN_DESTINATIONS_CULL_INTERVAL, Identity.cullKnownDestinations)
+
+	# Known destinations are written as they are
+	# remembered, so all that is left to do on exit
+	# is to commit the last batch, and checkpoint
+	# and close the database
 	@staticmethod
 	def saveKnownDestinations():
-		RNS.log("Saving known destinations to storage...", RNS.LOG_VERBOSE)
-		file = open(RNS.Reticulum.storagepath+"/known_destinations","w")
-		umsgpack.dump(Identity.known_destinations, file)
-		file.close()
-		RNS.log("Done saving known destinations to storage", RNS.LOG_VERBOSE)
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					Identity.storage.commit()
+					Identity.storage.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+					Identity.storage.close()
+					Identity.storage = None
+			except Exception as e:
+				RNS.log("Error while closing known destinations storage, the contained exception was: "+str(e), RNS.LOG_ERROR)
 
 	@staticmethod
 	def loadKnownDestinations():
+		try:
+			storage = sqlite3.connect(RNS.Reticulum.storagepath+"/known_destinations.db", check_same_thread=False)
+			storage.execute("PRAGMA auto_vacuum = INCREMENTAL")
+			storage.execute("PRAGMA journal_mode = WAL").fetchall()
+			storage.execute("PRAGMA synchronous = NORMAL")
+			storage.execute("CREATE TABLE IF NOT EXISTS known_destinations (destination_hash BLOB PRIMARY KEY, timestamp REAL, packet_hash BLOB, public_key BLOB, app_data BLOB, last_used REAL)")
+			storage.execute("CREATE INDEX IF NOT EXISTS known_destinations_last_used ON known_destinations (last_used)")
+			storage.commit()
+			Identity.storage = storage
+		except Exception as e:
+			RNS.log("Could not open known destinations storage, the contained exception was: "+str(e), RNS.LOG_ERROR)
+			RNS.log("Known destinations will not be saved", RNS.LOG_ERROR)
+			return
+
+		# Migrate destinations saved in the old
+		# format of a single umsgpack file
 		if os.path.isfile(RNS.Reticulum.storagepath+"/known_destinations"):
 			try:
 				file = open(RNS.Reticulum.storagepath+"/known_destinations","r")
-				Identity.known_destinations = umsgpack.load(file)
+				known_destinations = umsgpack.load(file)
 				file.close()
-				RNS.log("Loaded "+str(len(Identity.known_destinations))+" known destinations from storage", RNS.LOG_VERBOSE)
-			except:
-				RNS.log("Error loading known destinations from disk, file will be recreated on exit", RNS.LOG_ERROR)
-		else:
-			RNS.log("Destinations file does not exist, so no known destinations loaded", RNS.LOG_VERBOSE)
+
+				with Identity.storage_lock:
+					Identity.storage.executemany(
+						"INSERT OR REPLACE INTO known_destinations VALUES (?, ?, ?, ?, ?, ?)",
+						(Identity.storageRow(destination_hash, known_destinations[destination_hash]) for destination_hash in known_destinations)
+					)
+					Identity.storage.commit()
+
+				os.unlink(RNS.Reticulum.storagepath+"/known_destinations")
+				RNS.log("Migrated "+str(len(known_destinations))+" known destinations to new storage", RNS.LOG_NOTICE)
+			except Exception as e:
+				RNS.log("Error while migrating known destinations from disk, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+		RNS.Transport.schedule(Identity.KNOWN_DESTINATIONS_CULL_INTERVAL, Identity.cullKnownDestinations)
+		RNS.Transport.schedule(Identity.STORAGE_COMPACT_INTERVAL, Identity.compactKnownDestinations)
+
+	# Reclaims free pages in the database, and
+	# moves the write-ahead log into it
+	@staticmethod
+	def compactKnownDestinations():
+		if Identity.storage != None:
+			try:
+				with Identity.storage_lock:
+					Identity.storage.execute("PRAGMA incremental_vacuum").fetchall()
+					Identity.storage.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+			except Exception as e:
+				RNS.log("Error while compacting known destinations storage, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+			RNS.Transport.schedule(Identity.STORAGE_COMPACT_INTERVAL, Identity.compactKnownDestinations)
 
 	@staticmethod
 	def fullHash(data):
@@ -86,32 +400,56 @@ class Identity:
 	def getRandomHash():
 		return Identity.truncatedHash(os.urandom(10))
 
+	@staticmethod
+	def unpackAnnounce(packet):
+		destination_hash = packet.destination_hash
+		public_key = packet.data[10:Identity.DERKEYSIZE/8+10]
+		random_hash = packet.data[Identity.DERKEYSIZE/8+10:Identity.DERKEYSIZE/8+20]
+		signature = packet.data[Identity.DERKEYSIZE/8+20:Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8]
+		app_data = ""
+		if len(packet.data) > Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:
+			app_data = packet.data[Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:]
+
+		signed_data = destination_hash+public_key+random_hash+app_data
+
+		return (public_key, signature, signed_data)
+
 	@staticmethod
 	def validateAnnounce(packet):
 		if packet.packet_type == RNS.Packet.ANNOUNCE:
 			RNS.log("Validating announce from "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
-			destination_hash = packet.destination_hash
-			public_key = packet.data[10:Identity.DERKEYSIZE/8+10]
-			random_hash = packet.data[Identity.DERKEYSIZE/8+10:Identity.DERKEYSIZE/8+20]
-			signature = packet.data[Identity.DERKEYSIZE/8+20:Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8]
-			app_data = ""
-			if len(packet.data) > Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:
-				app_data = packet.data[Identity.DERKEYSIZE/8+20+Identity.KEYSIZE/8:]
-
-			signed_data = destination_hash+public_key+random_hash+app_data
-
-			announced_identity = Identity(public_only=True)
-			announced_identity.loadPublicKey(public_key)
-
-			if announced_identity.pub != None and announced_identity.validate(signature, signed_data):
-				RNS.Identity.remember(packet.getHash(), destination_hash, public_key)
-				RNS.log("Stored valid announce from "+RNS.prettyhexrep(destination_hash), RNS.LOG_INFO)
-				del announced_identity
-				return True
-			else:
-				RNS.log("Received invalid announce", RNS.LOG_DEBUG)
-				del announced_identity
-				return False
+			return Identity.acceptAnnounce(packet, Identity.verifyAnnounce(packet))
+
+	# Verifies the signature of an announce, using the
+	# cached identity for the destination if there is
+	# one. Identities are only cached once verified.
+	@staticmethod
+	def verifyAnnounce(packet):
+		public_key, signature, signed_data = Identity.unpackAnnounce(packet)
+		identity = Identity.lookupIdentity(packet.destination_hash, public_key)
+		if identity != None:
+			return identity.validate(signature, signed_data)
+
+		identity = Identity(public_only=True)
+		identity.loadPublicKey(public_key)
+		if identity.pub != None and identity.validate(signature, signed_data):
+			Identity.cacheIdentity(packet.destination_hash, identity)
+			return True
+		else:
+			return False
+
+	# Completes validation of an announce, once its
+	# signature has been checked by verifySignature
+	@staticmethod
+	def acceptAnnounce(packet, signature_valid):
+		if signature_valid:
+			public_key = Identity.unpackAnnounce(packet)[0]
+			RNS.Identity.remember(packet.getHash(), packet.destination_hash, public_key)
+			RNS.log("Stored valid announce from "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_INFO)
+			return True
+		else:
+			RNS.log("Received invalid announce", RNS.LOG_DEBUG)
+			return False
 
 	@staticmethod
 	def exitHandler():
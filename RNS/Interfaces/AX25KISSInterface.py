@@ -1,5 +1,6 @@
 from __future__ import print_function
 from Interface import Interface
+from KISSCodec import KISSCodec
 from time import sleep
 import sys
 import serial
@@ -91,7 +92,7 @@ class AX25KISSInterface(Interface):
 				stopbits = self.stopbits,
 				xonxoff = False,
 				rtscts = False,
-				timeout = 0,
+				timeout = self.timeout/1000.0,
 				inter_byte_timeout = None,
 				write_timeout = None,
 				dsrdtr = False,
@@ -213,9 +214,7 @@ class AX25KISSInterface(Interface):
 
 				data = addr+AX25.CTRL_UI+AX25.PID_NOLAYER3+data
 
-				data = data.replace(chr(0xdb), chr(0xdb)+chr(0xdd))
-				data = data.replace(chr(0xc0), chr(0xdb)+chr(0xdc))
-				kiss_frame = chr(0xc0)+chr(0x00)+data+chr(0xc0)
+				kiss_frame = KISSCodec.frame(KISS.CMD_DATA, data)
 
 				if (self.txdelay > 0):
 					RNS.log(str(self.name)+" delaying TX for "+str(self.txdelay)+" seconds", RNS.LOG_EXTREME)
@@ -242,53 +241,27 @@ class AX25KISSInterface(Interface):
 
 	def readLoop(self):
 		try:
-			in_frame = False
-			escape = False
-			command = KISS.CMD_UNKNOWN
-			data_buffer = ""
+			# We only support one HDLC port for now, so
+			# strip off the port nibble
+			codec = KISSCodec(RNS.Reticulum.MTU+AX25.HEADER_SIZE, command_mask=0x0F)
 			last_read_ms = int(time.time()*1000)
 
 			while self.serial.is_open:
-				if self.serial.in_waiting:
-					byte = self.serial.read(1)
+				data = self.serial.read(max(self.serial.in_waiting, 1))
+				if len(data) > 0:
 					last_read_ms = int(time.time()*1000)
 
-					if (in_frame and byte == KISS.FEND and command == KISS.CMD_DATA):
-						in_frame = False
-						self.processIncoming(data_buffer)
-					elif (byte == KISS.FEND):
-						in_frame = True
-						command = KISS.CMD_UNKNOWN
-						data_buffer = ""
-					elif (in_frame and len(data_buffer) < RNS.Reticulum.MTU+AX25.HEADER_SIZE):
-						if (len(data_buffer) == 0 and command == KISS.CMD_UNKNOWN):
-							# We only support one HDLC port for now, so
-							# strip off the port nibble
-							byte = chr(ord(byte) & 0x0F)
-							command = byte
-						elif (command == KISS.CMD_DATA):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								data_buffer = data_buffer+byte
-						elif (command == KISS.CMD_READY):
+					for command, frame in codec.feed(data):
+						if (command == KISS.CMD_DATA):
+							self.processIncoming(frame)
+						elif (command == KISS.CMD_READY and len(frame) > 0):
 							# TODO: add timeout and reset if ready
 							# command never arrives
 							self.process_queue()
 				else:
 					time_since_last = int(time.time()*1000) - last_read_ms
-					if len(data_buffer) > 0 and time_since_last > self.timeout:
-			 			data_buffer = ""
-			 			in_frame = False
-			 			command = KISS.CMD_UNKNOWN
-			 			escape = False
-			 		sleep(0.08)
+					if codec.pending() and time_since_last > self.timeout:
+						codec.reset()
 
 		except Exception as e:
 			self.online = False
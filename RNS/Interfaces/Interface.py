@@ -5,5 +5,15 @@ class Interface:
     RPT = False
     name = None
 
+    # Upper bound for the request window of resources
+    # received over this interface, None for the
+    # Resource default
+    resource_window_max = None
+
+    # Repair parts per block for resources sent over
+    # this interface with forward error correction,
+    # None to send them without it
+    resource_fec = None
+
     def __init__(self):
         pass
\ No newline at end of file
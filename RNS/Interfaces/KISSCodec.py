@@ -0,0 +1,93 @@
+# Shared KISS framing for the serial interfaces. Frames
+# are split out of everything that has been read from
+# the port at once, and escaping is done on whole
+# frames, instead of passing every byte through a
+# state machine in the read loop.
+#
+# Framing follows the per-byte readers this replaced.
+# A FEND ends a data frame, and bytes after it are
+# dropped until the next FEND starts a new frame, so
+# two data frames can not share a FEND. A FEND after
+# any other command both ends that frame and starts
+# the next one.
+class KISSCodec():
+	FEND  = chr(0xC0)
+	FESC  = chr(0xDB)
+	TFEND = chr(0xDC)
+	TFESC = chr(0xDD)
+
+	CMD_DATA = chr(0x00)
+
+	# Any byte after FESC other than TFEND and TFESC
+	# stands for itself
+	UNESCAPED = { TFEND: FEND, TFESC: FESC }
+
+	# Commands are masked with command_mask before
+	# they are returned, so that interfaces can strip
+	# off the port nibble
+	def __init__(self, max_length, command_mask=0xFF):
+		self.max_length   = max_length
+		self.max_raw      = 2*max_length+1
+		self.command_mask = command_mask
+		self.buffer       = []
+		self.buffered     = 0
+		self.in_frame     = False
+
+	@staticmethod
+	def escape(data):
+		data = data.replace(KISSCodec.FESC, KISSCodec.FESC+KISSCodec.TFESC)
+		data = data.replace(KISSCodec.FEND, KISSCodec.FESC+KISSCodec.TFEND)
+		return data
+
+	@staticmethod
+	def unescape(data):
+		if not KISSCodec.FESC in data:
+			return data
+
+		chunks = data.split(KISSCodec.FESC)
+		unescaped = [chunks[0]]
+		for chunk in chunks[1:]:
+			if chunk != "":
+				unescaped.append(KISSCodec.UNESCAPED.get(chunk[0], chunk[0]))
+				unescaped.append(chunk[1:])
+		return "".join(unescaped)
+
+	@staticmethod
+	def frame(command, data):
+		return KISSCodec.FEND+command+KISSCodec.escape(data)+KISSCodec.FEND
+
+	# Takes the bytes read from the port, and returns
+	# the frames they complete as (command, data)
+	# tuples. Data beyond max_length is dropped.
+	def feed(self, data):
+		frames = []
+		chunks = data.split(KISSCodec.FEND)
+		self.append(chunks[0])
+		for chunk in chunks[1:]:
+			ended_data = False
+			if self.in_frame and self.buffered > 0:
+				raw = "".join(self.buffer)
+				command = chr(ord(raw[0]) & self.command_mask)
+				frames.append((command, KISSCodec.unescape(raw[1:])[:self.max_length]))
+				ended_data = command == KISSCodec.CMD_DATA
+			self.reset()
+			self.in_frame = not ended_data
+			self.append(chunk)
+
+		return frames
+
+	def append(self, chunk):
+		if self.in_frame and self.buffered < self.max_raw and chunk != "":
+			chunk = chunk[:self.max_raw-self.buffered]
+			self.buffer.append(chunk)
+			self.buffered += len(chunk)
+
+	# Returns whether a frame has been started but not
+	# completed
+	def pending(self):
+		return self.buffered > 0
+
+	def reset(self):
+		self.buffer   = []
+		self.buffered = 0
+		self.in_frame = False
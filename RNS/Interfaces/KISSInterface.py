@@ -1,5 +1,6 @@
 from __future__ import print_function
 from Interface import Interface
+from KISSCodec import KISSCodec
 from time import sleep
 import sys
 import serial
@@ -71,7 +72,7 @@ class KISSInterface(Interface):
 				stopbits = self.stopbits,
 				xonxoff = False,
 				rtscts = False,
-				timeout = 0,
+				timeout = self.timeout/1000.0,
 				inter_byte_timeout = None,
 				write_timeout = None,
 				dsrdtr = False,
@@ -171,9 +172,7 @@ class KISSInterface(Interface):
 				if self.flow_control:
 					self.interface_ready = False
 
-				data = data.replace(chr(0xdb), chr(0xdb)+chr(0xdd))
-				data = data.replace(chr(0xc0), chr(0xdb)+chr(0xdc))
-				frame = chr(0xc0)+chr(0x00)+data+chr(0xc0)
+				frame = KISSCodec.frame(KISS.CMD_DATA, data)
 				written = self.serial.write(frame)
 				if written != len(frame):
 					raise IOError("Serial interface only wrote "+str(written)+" bytes of "+str(len(data)))
@@ -194,53 +193,27 @@ class KISSInterface(Interface):
 
 	def readLoop(self):
 		try:
-			in_frame = False
-			escape = False
-			command = KISS.CMD_UNKNOWN
-			data_buffer = ""
+			# We only support one HDLC port for now, so
+			# strip off port nibble
+			codec = KISSCodec(RNS.Reticulum.MTU, command_mask=0x0F)
 			last_read_ms = int(time.time()*1000)
 
 			while self.serial.is_open:
-				if self.serial.in_waiting:
-					byte = self.serial.read(1)
+				data = self.serial.read(max(self.serial.in_waiting, 1))
+				if len(data) > 0:
 					last_read_ms = int(time.time()*1000)
 
-					if (in_frame and byte == KISS.FEND and command == KISS.CMD_DATA):
-						in_frame = False
-						self.processIncoming(data_buffer)
-					elif (byte == KISS.FEND):
-						in_frame = True
-						command = KISS.CMD_UNKNOWN
-						data_buffer = ""
-					elif (in_frame and len(data_buffer) < RNS.Reticulum.MTU):
-						if (len(data_buffer) == 0 and command == KISS.CMD_UNKNOWN):
-							# We only support one HDLC port for now, so
-							# strip off port nibble
-							byte = chr(ord(byte) & 0x0F)
-							command = byte
-						elif (command == KISS.CMD_DATA):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								data_buffer = data_buffer+byte
-						elif (command == KISS.CMD_READY):
+					for command, frame in codec.feed(data):
+						if (command == KISS.CMD_DATA):
+							self.processIncoming(frame)
+						elif (command == KISS.CMD_READY and len(frame) > 0):
 							# TODO: add timeout and reset if ready
 							# command never arrives
 							self.process_queue()
 				else:
 					time_since_last = int(time.time()*1000) - last_read_ms
-					if len(data_buffer) > 0 and time_since_last > self.timeout:
-			 			data_buffer = ""
-			 			in_frame = False
-			 			command = KISS.CMD_UNKNOWN
-			 			escape = False
-			 		sleep(0.08)
+					if codec.pending() and time_since_last > self.timeout:
+						codec.reset()
 
 		except Exception as e:
 			self.online = False
@@ -1,5 +1,6 @@
 from __future__ import print_function
 from Interface import Interface
+from KISSCodec import KISSCodec
 from time import sleep
 import sys
 import serial
@@ -45,13 +46,6 @@ class KISS():
 	ERROR_TXFAILED	    = chr(0x02)
 	ERROR_EEPROM_LOCKED	= chr(0x03)
 
-	@staticmethod
-	def escape(data):
-		data = data.replace(chr(0xdb), chr(0xdb)+chr(0xdd))
-		data = data.replace(chr(0xc0), chr(0xdb)+chr(0xdc))
-		return data
-	
-
 class RNodeInterface(Interface):
 	MAX_CHUNK = 32768
 
@@ -134,7 +128,7 @@ class RNodeInterface(Interface):
 				stopbits = self.stopbits,
 				xonxoff = False,
 				rtscts = False,
-				timeout = 0,
+				timeout = self.timeout/1000.0,
 				inter_byte_timeout = None,
 				write_timeout = None,
 				dsrdtr = False,
@@ -178,7 +172,7 @@ class RNodeInterface(Interface):
 		c2 = self.frequency >> 16 & 0xFF
 		c3 = self.frequency >> 8 & 0xFF
 		c4 = self.frequency & 0xFF
-		data = KISS.escape(chr(c1)+chr(c2)+chr(c3)+chr(c4))
+		data = KISSCodec.escape(chr(c1)+chr(c2)+chr(c3)+chr(c4))
 
 		kiss_command = KISS.FEND+KISS.CMD_FREQUENCY+data+KISS.FEND
 		written = self.serial.write(kiss_command)
@@ -190,7 +184,7 @@ class RNodeInterface(Interface):
 		c2 = self.bandwidth >> 16 & 0xFF
 		c3 = self.bandwidth >> 8 & 0xFF
 		c4 = self.bandwidth & 0xFF
-		data = KISS.escape(chr(c1)+chr(c2)+chr(c3)+chr(c4))
+		data = KISSCodec.escape(chr(c1)+chr(c2)+chr(c3)+chr(c4))
 
 		kiss_command = KISS.FEND+KISS.CMD_BANDWIDTH+data+KISS.FEND
 		written = self.serial.write(kiss_command)
@@ -264,8 +258,7 @@ class RNodeInterface(Interface):
 				if self.flow_control:
 					self.interface_ready = False
 
-				data = KISS.escape(data)
-				frame = chr(0xc0)+chr(0x00)+data+chr(0xc0)
+				frame = KISSCodec.frame(KISS.CMD_DATA, data)
 				written = self.serial.write(frame)
 				if written != len(frame):
 					raise IOError("Serial interface only wrote "+str(written)+" bytes of "+str(len(data)))
@@ -285,148 +278,85 @@ class RNodeInterface(Interface):
 
 	def readLoop(self):
 		try:
-			in_frame = False
-			escape = False
-			command = KISS.CMD_UNKNOWN
-			data_buffer = ""
-			command_buffer = ""
+			codec = KISSCodec(RNS.Reticulum.MTU)
 			last_read_ms = int(time.time()*1000)
 
 			while self.serial.is_open:
-				if self.serial.in_waiting:
-					byte = self.serial.read(1)
+				data = self.serial.read(max(self.serial.in_waiting, 1))
+				if len(data) > 0:
 					last_read_ms = int(time.time()*1000)
 
-					if (in_frame and byte == KISS.FEND and command == KISS.CMD_DATA):
-						in_frame = False
-						self.processIncoming(data_buffer)
-						data_buffer = ""
-						command_buffer = ""
-					elif (byte == KISS.FEND):
-						in_frame = True
-						command = KISS.CMD_UNKNOWN
-						data_buffer = ""
-						command_buffer = ""
-					elif (in_frame and len(data_buffer) < RNS.Reticulum.MTU):
-						if (len(data_buffer) == 0 and command == KISS.CMD_UNKNOWN):
-							command = byte
-						elif (command == KISS.CMD_DATA):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								data_buffer = data_buffer+byte
-						elif (command == KISS.CMD_FREQUENCY):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								command_buffer = command_buffer+byte
-								if (len(command_buffer) == 4):
-									self.r_frequency = ord(command_buffer[0]) << 24 | ord(command_buffer[1]) << 16 | ord(command_buffer[2]) << 8 | ord(command_buffer[3])
-									RNS.log(str(self)+" Radio reporting frequency is "+str(self.r_frequency/1000000.0)+" MHz", RNS.LOG_DEBUG)
-									self.updateBitrate()
-
-						elif (command == KISS.CMD_BANDWIDTH):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								command_buffer = command_buffer+byte
-								if (len(command_buffer) == 4):
-									self.r_bandwidth = ord(command_buffer[0]) << 24 | ord(command_buffer[1]) << 16 | ord(command_buffer[2]) << 8 | ord(command_buffer[3])
-									RNS.log(str(self)+" Radio reporting bandwidth is "+str(self.r_bandwidth/1000.0)+" KHz", RNS.LOG_DEBUG)
-									self.updateBitrate()
-
-						elif (command == KISS.CMD_TXPOWER):
-							self.r_txpower = ord(byte)
-							RNS.log(str(self)+" Radio reporting TX power is "+str(self.r_txpower)+" dBm", RNS.LOG_DEBUG)
-						elif (command == KISS.CMD_SF):
-							self.r_sf = ord(byte)
-							RNS.log(str(self)+" Radio reporting spreading factor is "+str(self.r_sf), RNS.LOG_DEBUG)
-							self.updateBitrate()
-						elif (command == KISS.CMD_CR):
-							self.r_cr = ord(byte)
-							RNS.log(str(self)+" Radio reporting coding rate is "+str(self.r_cr), RNS.LOG_DEBUG)
-							self.updateBitrate()
-						elif (command == KISS.CMD_RADIO_STATE):
-							self.r_state = ord(byte)
-						elif (command == KISS.CMD_RADIO_LOCK):
-							self.r_lock = ord(byte)
-						elif (command == KISS.CMD_STAT_RX):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								command_buffer = command_buffer+byte
-								if (len(command_buffer) == 4):
-									self.r_stat_rx = ord(command_buffer[0]) << 24 | ord(command_buffer[1]) << 16 | ord(command_buffer[2]) << 8 | ord(command_buffer[3])
-
-						elif (command == KISS.CMD_STAT_TX):
-							if (byte == KISS.FESC):
-								escape = True
-							else:
-								if (escape):
-									if (byte == KISS.TFEND):
-										byte = KISS.FEND
-									if (byte == KISS.TFESC):
-										byte = KISS.FESC
-									escape = False
-								command_buffer = command_buffer+byte
-								if (len(command_buffer) == 4):
-									self.r_stat_tx = ord(command_buffer[0]) << 24 | ord(command_buffer[1]) << 16 | ord(command_buffer[2]) << 8 | ord(command_buffer[3])
-
-						elif (command == KISS.CMD_STAT_RSSI):
-							self.r_stat_rssi = ord(byte)-RNodeInterface.RSSI_OFFSET
-						elif (command == KISS.CMD_RANDOM):
-							self.r_random = ord(byte)
-						elif (command == KISS.CMD_ERROR):
-							if (byte == KISS.ERROR_INITRADIO):
-								RNS.log(str(self)+" hardware initialisation error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
-							elif (byte == KISS.ERROR_INITRADIO):
-								RNS.log(str(self)+" hardware TX error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
-							else:
-								RNS.log(str(self)+" hardware error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
-						elif (command == KISS.CMD_READY):
-							# TODO: add timeout and reset if ready
-							# command never arrives
-							self.process_queue()
-						
+					for command, frame in codec.feed(data):
+						self.processFrame(command, frame)
 				else:
 					time_since_last = int(time.time()*1000) - last_read_ms
-					if len(data_buffer) > 0 and time_since_last > self.timeout:
+					if codec.pending() and time_since_last > self.timeout:
 						RNS.log(str(self)+" serial read timeout", RNS.LOG_DEBUG)
-			 			data_buffer = ""
-			 			in_frame = False
-			 			command = KISS.CMD_UNKNOWN
-			 			escape = False
-			 		sleep(0.08)
+						codec.reset()
 
 		except Exception as e:
 			self.online = False
 			RNS.log("A serial port error occurred, the contained exception was: "+str(e), RNS.LOG_ERROR)
 			RNS.log("The interface "+str(self.name)+" is now offline. Restart Reticulum to attempt reconnection.", RNS.LOG_ERROR)
 
+	# Four byte values are read from the start of the
+	# frame, and single byte values from its end. Data
+	# frames are processed even if empty, while other
+	# commands need at least one byte, as in the per-byte
+	# reader this replaced.
+	def processFrame(self, command, data):
+		if (command == KISS.CMD_DATA):
+			self.processIncoming(data)
+		elif (len(data) == 0):
+			return
+		elif (command == KISS.CMD_FREQUENCY):
+			if (len(data) >= 4):
+				self.r_frequency = ord(data[0]) << 24 | ord(data[1]) << 16 | ord(data[2]) << 8 | ord(data[3])
+				RNS.log(str(self)+" Radio reporting frequency is "+str(self.r_frequency/1000000.0)+" MHz", RNS.LOG_DEBUG)
+				self.updateBitrate()
+		elif (command == KISS.CMD_BANDWIDTH):
+			if (len(data) >= 4):
+				self.r_bandwidth = ord(data[0]) << 24 | ord(data[1]) << 16 | ord(data[2]) << 8 | ord(data[3])
+				RNS.log(str(self)+" Radio reporting bandwidth is "+str(self.r_bandwidth/1000.0)+" KHz", RNS.LOG_DEBUG)
+				self.updateBitrate()
+		elif (command == KISS.CMD_TXPOWER):
+			self.r_txpower = ord(data[-1])
+			RNS.log(str(self)+" Radio reporting TX power is "+str(self.r_txpower)+" dBm", RNS.LOG_DEBUG)
+		elif (command == KISS.CMD_SF):
+			self.r_sf = ord(data[-1])
+			RNS.log(str(self)+" Radio reporting spreading factor is "+str(self.r_sf), RNS.LOG_DEBUG)
+			self.updateBitrate()
+		elif (command == KISS.CMD_CR):
+			self.r_cr = ord(data[-1])
+			RNS.log(str(self)+" Radio reporting coding rate is "+str(self.r_cr), RNS.LOG_DEBUG)
+			self.updateBitrate()
+		elif (command == KISS.CMD_RADIO_STATE):
+			self.r_state = ord(data[-1])
+		elif (command == KISS.CMD_RADIO_LOCK):
+			self.r_lock = ord(data[-1])
+		elif (command == KISS.CMD_STAT_RX):
+			if (len(data) >= 4):
+				self.r_stat_rx = ord(data[0]) << 24 | ord(data[1]) << 16 | ord(data[2]) << 8 | ord(data[3])
+		elif (command == KISS.CMD_STAT_TX):
+			if (len(data) >= 4):
+				self.r_stat_tx = ord(data[0]) << 24 | ord(data[1]) << 16 | ord(data[2]) << 8 | ord(data[3])
+		elif (command == KISS.CMD_STAT_RSSI):
+			self.r_stat_rssi = ord(data[-1])-RNodeInterface.RSSI_OFFSET
+		elif (command == KISS.CMD_RANDOM):
+			self.r_random = ord(data[-1])
+		elif (command == KISS.CMD_ERROR):
+			for byte in data:
+				if (byte == KISS.ERROR_INITRADIO):
+					RNS.log(str(self)+" hardware initialisation error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
+				elif (byte == KISS.ERROR_TXFAILED):
+					RNS.log(str(self)+" hardware TX error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
+				else:
+					RNS.log(str(self)+" hardware error (code "+RNS.hexrep(byte)+")", RNS.LOG_ERROR)
+		elif (command == KISS.CMD_READY):
+			# TODO: add timeout and reset if ready
+			# command never arrives
+			self.process_queue()
+
 	def __str__(self):
 		return "RNodeInterface["+self.name+"]"
 
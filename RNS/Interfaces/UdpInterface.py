@@ -1,62 +1,280 @@
 from Interface import Interface
-import SocketServer
+from collections import deque
+from time import sleep
 import threading
+import select
 import socket
+import errno
 import time
 import sys
+import os
 import RNS
 
 class UdpInterface(Interface):
+    # Maximum number of packets sent per
+    # wakeup of the writer
+    TX_BATCH   = 64
+    # Default token bucket size when a
+    # transmit rate limit is configured
+    TX_BURST   = 16
+    # Default length of the transmit queue
+    # in front of the writer
+    TX_QUEUE   = 1024
+    # A dropped packet is logged once for
+    # every this many drops
+    DROP_LOG_INTERVAL = 100
+    # Maximum number of datagrams read from
+    # the socket per wakeup of the reader
+    RX_BATCH   = 64
+    # Default length of the receive queue
+    # of each worker
+    RX_QUEUE   = 1024
+    RX_WORKERS = 1
 
-    def __init__(self, owner, name, bindip=None, bindport=None, forwardip=None, forwardport=None):
+    def __init__(self, owner, name, bindip=None, bindport=None, forwardip=None, forwardport=None, tx_rate=None, tx_burst=None, tx_queue=None, rx_buffer=None, rx_queue=None, rx_workers=None):
         self.IN  = True
         self.OUT = False
-        self.transmit_delay = 0.001
 
         self.name = name
 
+        # Outgoing packets are paced by a token bucket
+        # holding up to tx_burst packets, refilled at
+        # tx_rate packets per second. A tx_rate of None
+        # disables pacing.
+        self.tx_rate = tx_rate
+        self.tx_burst = tx_burst if tx_burst != None else UdpInterface.TX_BURST
+        self.tx_tokens = float(self.tx_burst)
+        self.tx_last_refill = time.time()
+        # Packets queued beyond tx_queue are dropped
+        # and counted, so a sender faster than the
+        # rate limit cannot grow the queue forever.
+        self.tx_queue = deque()
+        self.tx_queue_size = tx_queue if tx_queue != None else UdpInterface.TX_QUEUE
+        self.tx_queue_drops = 0
+        self.tx_condition = threading.Condition()
+        self.tx_scheduled = False
+
+        self.rx_queues = []
+
         if (bindip != None and bindport != None):
             self.receives = True
             self.bind_ip = bindip
             self.bind_port = bindport
 
-            def handlerFactory(callback):
-                def createHandler(*args, **keys):
-                    return UdpInterfaceHandler(callback, *args, **keys)
-                return createHandler
-
             self.owner = owner
-            address = (self.bind_ip, self.bind_port)
-            self.server = SocketServer.UDPServer(address, handlerFactory(self.processIncoming))
 
-            thread = threading.Thread(target=self.server.serve_forever)
-            thread.setDaemon(True)
-            thread.start()
+            # Received datagrams are drained from the
+            # socket in batches into bounded queues,
+            # and handed to Transport by the workers,
+            # so slow inbound processing does not make
+            # the kernel drop datagrams. Each worker has
+            # its own queue, and datagrams are sharded
+            # over the queues by destination hash, so
+            # packets for one destination or link are
+            # always handled by the same worker, in the
+            # order they arrived.
+            self.rx_queue_size = rx_queue if rx_queue != None else UdpInterface.RX_QUEUE
+            self.rx_workers = rx_workers if rx_workers != None else UdpInterface.RX_WORKERS
+            if self.rx_workers < 1 or RNS.Reticulum.should_use_event_loop():
+                self.rx_workers = 1
+            self.rx_queues = [deque() for i in range(0, self.rx_workers)]
+            self.rx_condition = threading.Condition()
+            self.rx_scheduled = False
+            self.rx_queue_drops = 0
+            self.rx_queue_max_depth = 0
+
+            self.rx_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if rx_buffer != None:
+                self.rx_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rx_buffer)
+            self.rx_socket.bind((self.bind_ip, self.bind_port))
+            self.rx_socket.setblocking(0)
+
+            if RNS.Reticulum.should_use_event_loop():
+                RNS.Transport.registerReader(self.rx_socket, self.readBatch)
+            else:
+                thread = threading.Thread(target=self.readLoop)
+                thread.setDaemon(True)
+                thread.start()
+
+                for i in range(0, self.rx_workers):
+                    thread = threading.Thread(target=self.workerLoop, args=(self.rx_queues[i],))
+                    thread.setDaemon(True)
+                    thread.start()
 
         if (forwardip != None and forwardport != None):
             self.forwards = True
             self.forward_ip = forwardip
             self.forward_port = forwardport
 
+            self.tx_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.tx_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+            if not RNS.Reticulum.should_use_event_loop():
+                thread = threading.Thread(target=self.writeLoop)
+                thread.setDaemon(True)
+                thread.start()
+
 
     def processIncoming(self, data):
         self.owner.inbound(data, self)
 
+    # Returns the receive queue for a datagram, chosen
+    # by the destination hash in its header
+    def rxQueueFor(self, data):
+        if len(self.rx_queues) == 1 or len(data) < 2:
+            return self.rx_queues[0]
+        if (ord(data[0]) & 0b11000000) >> 6 == RNS.Packet.HEADER_2:
+            destination_hash = data[12:22]
+        else:
+            destination_hash = data[2:12]
+        return self.rx_queues[hash(destination_hash) % len(self.rx_queues)]
+
+    # Reads up to RX_BATCH datagrams from the socket
+    # into the receive queue. If the queue is full,
+    # new datagrams are dropped and counted.
+    def readBatch(self):
+        received = 0
+        while received < UdpInterface.RX_BATCH:
+            try:
+                data = self.rx_socket.recv(4096)
+            except socket.error as e:
+                if e.args[0] == errno.EAGAIN or e.args[0] == errno.EWOULDBLOCK or e.args[0] == errno.EINTR:
+                    break
+                raise
+            received += 1
+
+            rx_queue = self.rxQueueFor(data)
+            with self.rx_condition:
+                if len(rx_queue) < self.rx_queue_size:
+                    rx_queue.append(data)
+                    self.rx_queue_max_depth = max(self.rx_queue_max_depth, len(rx_queue))
+                else:
+                    self.rx_queue_drops += 1
+
+        if received > 0:
+            with self.rx_condition:
+                if RNS.Reticulum.should_use_event_loop():
+                    if not self.rx_scheduled:
+                        self.rx_scheduled = True
+                        RNS.Transport.schedule(0, self.processJob)
+                else:
+                    self.rx_condition.notify_all()
+
+    def readLoop(self):
+        try:
+            while True:
+                readable = select.select([self.rx_socket], [], [])[0]
+                if len(readable) > 0:
+                    self.readBatch()
+        except Exception as e:
+            RNS.log("An error occurred while receiving on "+str(self)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+            RNS.log("The interface "+str(self.name)+" is no longer receiving. Restart Reticulum to attempt recovery.", RNS.LOG_ERROR)
+
+    def workerLoop(self, rx_queue):
+        while True:
+            with self.rx_condition:
+                while len(rx_queue) == 0:
+                    self.rx_condition.wait()
+                data = rx_queue.popleft()
+
+            try:
+                self.processIncoming(data)
+            except Exception as e:
+                RNS.log("An error occurred while processing a packet received on "+str(self)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+    def processJob(self):
+        processed = 0
+        while processed < UdpInterface.RX_BATCH:
+            with self.rx_condition:
+                if len(self.rx_queues[0]) == 0:
+                    self.rx_scheduled = False
+                    return
+                data = self.rx_queues[0].popleft()
+
+            try:
+                self.processIncoming(data)
+            except Exception as e:
+                RNS.log("An error occurred while processing a packet received on "+str(self)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+            processed += 1
+
+        RNS.Transport.schedule(0, self.processJob)
+
+    # Returns the number of datagrams the kernel has
+    # dropped for the receive socket, as reported in
+    # /proc/net/udp, or None if this is not available
+    def getKernelDrops(self):
+        try:
+            inode = str(os.fstat(self.rx_socket.fileno()).st_ino)
+            with open("/proc/net/udp", "r") as udp_table:
+                for line in udp_table.readlines()[1:]:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        return int(fields[-1])
+        except Exception as e:
+            pass
+
+        return None
+
+    def getQueueDepth(self):
+        return sum(len(rx_queue) for rx_queue in self.rx_queues)
+
     def processOutgoing(self,data):
-        time.sleep(self.transmit_delay)
-        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        udp_socket.sendto(data, (self.forward_ip, self.forward_port))
+        with self.tx_condition:
+            if len(self.tx_queue) >= self.tx_queue_size:
+                self.tx_queue_drops += 1
+                if self.tx_queue_drops % UdpInterface.DROP_LOG_INTERVAL == 1:
+                    RNS.log("Transmit queue of UdpInterface["+self.name+"] is full, "+str(self.tx_queue_drops)+" outgoing packets dropped so far", RNS.LOG_WARNING)
+                return
 
+            self.tx_queue.append(data)
+            if RNS.Reticulum.should_use_event_loop():
+                if not self.tx_scheduled:
+                    self.tx_scheduled = True
+                    RNS.Transport.schedule(0, self.writeJob)
+            else:
+                self.tx_condition.notify()
 
-    def __str__(self):
-        return "UdpInterface["+self.name+"/"+self.bind_ip+":"+str(self.bind_port)+"]"
+    # Sends up to TX_BATCH queued packets. Returns
+    # the time to wait before more packets may be
+    # sent, or 0 if the writer can continue.
+    def flush(self):
+        sent = 0
+        while len(self.tx_queue) > 0 and sent < UdpInterface.TX_BATCH:
+            if self.tx_rate != None:
+                now = time.time()
+                self.tx_tokens = min(self.tx_tokens + (now-self.tx_last_refill)*self.tx_rate, self.tx_burst)
+                self.tx_last_refill = now
+                if self.tx_tokens < 1:
+                    return (1-self.tx_tokens)/self.tx_rate
+                self.tx_tokens -= 1
+
+            data = self.tx_queue.popleft()
+            try:
+                self.tx_socket.sendto(data, (self.forward_ip, self.forward_port))
+            except Exception as e:
+                RNS.log("Could not transmit on "+str(self)+", the contained exception was: "+str(e), RNS.LOG_ERROR)
+            sent += 1
+
+        return 0
+
+    def writeLoop(self):
+        while True:
+            with self.tx_condition:
+                while len(self.tx_queue) == 0:
+                    self.tx_condition.wait()
 
-class UdpInterfaceHandler(SocketServer.BaseRequestHandler):
-    def __init__(self, callback, *args, **keys):
-        self.callback = callback
-        SocketServer.BaseRequestHandler.__init__(self, *args, **keys)
+            wait_time = self.flush()
+            if wait_time > 0:
+                sleep(wait_time)
 
-    def handle(self):
-        data = self.request[0]
-        self.callback(data)
\ No newline at end of file
+    def writeJob(self):
+        wait_time = self.flush()
+        with self.tx_condition:
+            if len(self.tx_queue) > 0:
+                RNS.Transport.schedule(wait_time, self.writeJob)
+            else:
+                self.tx_scheduled = False
+
+
+    def __str__(self):
+        return "UdpInterface["+self.name+"/"+self.bind_ip+":"+str(self.bind_port)+"]"
\ No newline at end of file
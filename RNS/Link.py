@@ -3,12 +3,17 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
-from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives import hmac
 from time import sleep
+from collections import deque
+from cStringIO import StringIO
 import vendor.umsgpack as umsgpack
 import threading
-import base64
+import struct
 import time
+import os
 import RNS
 
 import traceback
@@ -25,6 +30,12 @@ class Link:
 	CURVE = ec.SECP256R1()
 	ECPUBSIZE = 91
 	BLOCKSIZE = 16
+	# Fernet token version byte, and the token
+	# overhead of version, timestamp, IV and HMAC
+	FERNET_VERSION  = "\x80"
+	FERNET_HEADER   = 1+8+16
+	FERNET_HMAC     = 32
+	FERNET_OVERHEAD = FERNET_HEADER+FERNET_HMAC
 
 	# TODO: This should not be hardcoded,
 	# but calculated from something like 
@@ -33,6 +44,24 @@ class Link:
 	TIMEOUT_FACTOR = 3
 	KEEPALIVE = 120
 
+	# Outgoing resources beyond this number are
+	# queued, and advertised in order as earlier
+	# transfers conclude. Each resource is given
+	# a one-byte id that its parts are sent with.
+	MAX_OUTGOING_RESOURCES = 16
+	RESOURCE_IDS           = 256
+
+	# Capabilities are exchanged when the link is
+	# established. The destination appends them to
+	# the link proof, and the initiator to the RTT
+	# packet, where earlier versions ignore them.
+	# Resources are only sent to and accepted from
+	# peers with resource ids, and repair parts are
+	# only sent to peers with FEC.
+	CAPABILITY_RESOURCE_IDS = 0x01
+	CAPABILITY_RESOURCE_FEC = 0x02
+	CAPABILITIES            = CAPABILITY_RESOURCE_IDS | CAPABILITY_RESOURCE_FEC
+
 	PENDING   = 0x00
 	HANDSHAKE = 0x01
 	ACTIVE    = 0x02
@@ -88,8 +117,17 @@ class Link:
 		self.rtt = None
 		self.callbacks = LinkCallbacks()
 		self.resource_strategy = Link.ACCEPT_NONE
+		self.resource_spooling = False
+		self.resource_resumable = False
+		self.resource_compression = None
+		self.resource_fec = None
 		self.outgoing_resources = []
 		self.incoming_resources = []
+		self.queued_resources = deque()
+		self.incoming_resource_ids = {}
+		self.next_resource_id = 0
+		self.peer_capabilities = 0
+		self.resource_lock = threading.RLock()
 		self.last_inbound = 0
 		self.last_outbound = 0
 		self.tx = 0
@@ -158,11 +196,19 @@ class Link:
 			backend=default_backend()
 		).derive(self.shared_key)
 
+		# The link key is split into signing and
+		# encryption keys once, as Fernet does, and
+		# the HMAC is keyed once, so that tokens
+		# only need a copy of it
+		self.signing_key = self.derived_key[:16]
+		self.encryption_key = self.derived_key[16:]
+		self.token_hmac = hmac.HMAC(self.signing_key, hashes.SHA256(), backend=default_backend())
+
 	def prove(self):
 		signed_data = self.link_id+self.pub_bytes
 		signature = self.owner.identity.sign(signed_data)
 
-		proof_data = self.pub_bytes+signature
+		proof_data = self.pub_bytes+signature+chr(Link.CAPABILITIES)
 		proof = RNS.Packet(self, proof_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.LRPROOF)
 		proof.send()
 
@@ -183,15 +229,17 @@ class Link:
 			peer_pub_bytes = packet.data[:Link.ECPUBSIZE]
 			signed_data = self.link_id+peer_pub_bytes
 			signature = packet.data[Link.ECPUBSIZE:RNS.Identity.KEYSIZE/8+Link.ECPUBSIZE]
+			capabilities = packet.data[RNS.Identity.KEYSIZE/8+Link.ECPUBSIZE:]
 
 			if self.destination.identity.validate(signature, signed_data):
 				self.loadPeer(peer_pub_bytes)
+				self.peer_capabilities = ord(capabilities[0]) if len(capabilities) > 0 else 0
 				self.handshake()
 				self.rtt = time.time() - self.request_time
 				self.attached_interface = packet.receiving_interface
 				RNS.Transport.activateLink(self)
 				RNS.log("Link "+str(self)+" established with "+str(self.destination)+", RTT is "+str(self.rtt), RNS.LOG_VERBOSE)
-				rtt_data = umsgpack.packb(self.rtt)
+				rtt_data = umsgpack.packb(self.rtt)+chr(Link.CAPABILITIES)
 				rtt_packet = RNS.Packet(self, rtt_data, context=RNS.Packet.LRRTT)
 				RNS.log("Sending RTT packet", RNS.LOG_EXTREME);
 				rtt_packet.send()
@@ -214,8 +262,10 @@ class Link:
 			# expectancy for the link. This will have to do
 			# for now though.
 			measured_rtt = time.time() - self.request_time
-			plaintext = self.decrypt(packet.data)
-			rtt = umsgpack.unpackb(plaintext)
+			plaintext = StringIO(self.decrypt(packet.data))
+			rtt = umsgpack.load(plaintext)
+			capabilities = plaintext.read(1)
+			self.peer_capabilities = ord(capabilities) if len(capabilities) > 0 else 0
 			self.rtt = max(measured_rtt, rtt)
 			self.status = Link.ACTIVE
 			
@@ -257,9 +307,10 @@ class Link:
 			pass
 
 	def link_closed(self):
-		for resource in self.incoming_resources:
+		RNS.Transport.deregisterLink(self)
+		for resource in list(self.incoming_resources):
 			resource.cancel()
-		for resource in self.outgoing_resources:
+		for resource in list(self.queued_resources)+self.outgoing_resources:
 			resource.cancel()
 			
 		self.prv = None
@@ -267,66 +318,70 @@ class Link:
 		self.pub_bytes = None
 		self.shared_key = None
 		self.derived_key = None
+		self.signing_key = None
+		self.encryption_key = None
+		self.token_hmac = None
 
 		if self.callbacks.link_closed != None:
 			self.callbacks.link_closed(self)
 
 	def start_watchdog(self):
-		thread = threading.Thread(target=self.__watchdog_job)
-		thread.setDaemon(True)
-		thread.start()
+		RNS.Transport.schedule(0, self.__watchdog_job)
 
 	def __watchdog_job(self):
-		while not self.status == Link.CLOSED:
-			while (self.watchdog_lock):
-				sleep(max(self.rtt, 0.025))
-
-			if not self.status == Link.CLOSED:
-				# Link was initiated, but no response
-				# from destination yet
-				if self.status == Link.PENDING:
-					next_check = self.request_time + self.proof_timeout
-					sleep_time = next_check - time.time()
-					if time.time() >= self.request_time + self.proof_timeout:
-						RNS.log("Link establishment timed out", RNS.LOG_VERBOSE)
-						self.status = Link.CLOSED
-						self.teardown_reason = Link.TIMEOUT
-						self.link_closed()
-						sleep_time = 0.001
-
-				elif self.status == Link.HANDSHAKE:
-					next_check = self.request_time + self.proof_timeout
-					sleep_time = next_check - time.time()
-					if time.time() >= self.request_time + self.proof_timeout:
-						RNS.log("Timeout waiting for RTT packet from link initiator", RNS.LOG_DEBUG)
-						self.status = Link.CLOSED
-						self.teardown_reason = Link.TIMEOUT
-						self.link_closed()
-						sleep_time = 0.001
-
-				elif self.status == Link.ACTIVE:
-					if time.time() >= self.last_inbound + self.keepalive:
-						sleep_time = self.rtt * self.timeout_factor
-						self.status = Link.STALE
-						if self.initiator:
-							self.send_keepalive()
-					else:
-						sleep_time = (self.last_inbound + self.keepalive) - time.time()
-
-				elif self.status == Link.STALE:
-					sleep_time = 0.001
-					self.status = Link.CLOSED
-					self.teardown_reason = Link.TIMEOUT
-					self.link_closed()
-
-
-				if sleep_time == 0:
-					RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_ERROR)
-				if sleep_time == None or sleep_time < 0:
-					RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
-					RNS.panic()
-
-				sleep(sleep_time)
+		if self.status == Link.CLOSED:
+			return
+
+		if self.watchdog_lock:
+			RNS.Transport.schedule(max(self.rtt, 0.025), self.__watchdog_job)
+			return
+
+		# Link was initiated, but no response
+		# from destination yet
+		if self.status == Link.PENDING:
+			next_check = self.request_time + self.proof_timeout
+			sleep_time = next_check - time.time()
+			if time.time() >= self.request_time + self.proof_timeout:
+				RNS.log("Link establishment timed out", RNS.LOG_VERBOSE)
+				self.status = Link.CLOSED
+				self.teardown_reason = Link.TIMEOUT
+				self.link_closed()
+				sleep_time = 0.001
+
+		elif self.status == Link.HANDSHAKE:
+			next_check = self.request_time + self.proof_timeout
+			sleep_time = next_check - time.time()
+			if time.time() >= self.request_time + self.proof_timeout:
+				RNS.log("Timeout waiting for RTT packet from link initiator", RNS.LOG_DEBUG)
+				self.status = Link.CLOSED
+				self.teardown_reason = Link.TIMEOUT
+				self.link_closed()
+				sleep_time = 0.001
+
+		elif self.status == Link.ACTIVE:
+			if time.time() >= self.last_inbound + self.keepalive:
+				sleep_time = self.rtt * self.timeout_factor
+				self.status = Link.STALE
+				if self.initiator:
+					self.send_keepalive()
+			else:
+				sleep_time = (self.last_inbound + self.keepalive) - time.time()
+
+		elif self.status == Link.STALE:
+			sleep_time = 0.001
+			self.status = Link.CLOSED
+			self.teardown_reason = Link.TIMEOUT
+			self.link_closed()
+
+
+		if sleep_time == 0:
+			RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_ERROR)
+		if sleep_time == None or sleep_time < 0:
+			RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
+			RNS.panic()
+
+		if self.status != Link.CLOSED:
+			RNS.Transport.schedule(sleep_time, self.__watchdog_job)
 
 
 	def send_keepalive(self):
@@ -367,7 +422,9 @@ class Link:
 
 					elif packet.context == RNS.Packet.RESOURCE_ADV:
 						packet.plaintext = self.decrypt(packet.data)
-						if self.resource_strategy == Link.ACCEPT_NONE:
+						if RNS.Resource.accept_restart(packet):
+							pass
+						elif self.resource_strategy == Link.ACCEPT_NONE:
 							pass
 						elif self.resource_strategy == Link.ACCEPT_APP:
 							if self.callbacks.resource != None:
@@ -377,10 +434,7 @@ class Link:
 
 					elif packet.context == RNS.Packet.RESOURCE_REQ:
 						plaintext = self.decrypt(packet.data)
-						if ord(plaintext[:1]) == RNS.Resource.HASHMAP_IS_EXHAUSTED:
-							resource_hash = plaintext[1+RNS.Resource.MAPHASH_LEN:RNS.Identity.HASHLENGTH/8+1+RNS.Resource.MAPHASH_LEN]
-						else:
-							resource_hash = plaintext[1:RNS.Identity.HASHLENGTH/8+1]
+						resource_hash = RNS.Resource.requestHash(plaintext)
 						for resource in self.outgoing_resources:
 							if resource.hash == resource_hash:
 								resource.request(plaintext)
@@ -405,13 +459,19 @@ class Link:
 							keepalive_packet.send()
 
 
-					# TODO: find the most efficient way to allow multiple
-					# transfers at the same time, sending resource hash on
-					# each packet is a huge overhead. Probably some kind
-					# of hash -> sequence map
+					# Resource parts start with the id of the
+					# resource they belong to
 					elif packet.context == RNS.Packet.RESOURCE:
-						for resource in self.incoming_resources:
-							resource.receive_part(packet)
+						if len(packet.data) > 0:
+							resource = self.incoming_resource_ids.get(ord(packet.data[0]))
+							if resource != None:
+								resource.receive_part(packet)
+
+					elif packet.context == RNS.Packet.RESOURCE_FEC:
+						if len(packet.data) > 0:
+							resource = self.incoming_resource_ids.get(ord(packet.data[0]))
+							if resource != None:
+								resource.receive_repair(packet)
 
 				elif packet.packet_type == RNS.Packet.PROOF:
 					if packet.context == RNS.Packet.RESOURCE_PRF:
@@ -427,9 +487,10 @@ class Link:
 		if self.__encryption_disabled:
 			return plaintext
 		try:
-			fernet = Fernet(base64.urlsafe_b64encode(self.derived_key))
-			ciphertext = base64.urlsafe_b64decode(fernet.encrypt(plaintext))
-			return ciphertext
+			header, encryptor, padder, h = self.token_encryptor()
+			ciphertext = encryptor.update(padder.update(plaintext) + padder.finalize()) + encryptor.finalize()
+			h.update(ciphertext)
+			return header + ciphertext + h.finalize()
 		except Exception as e:
 			RNS.log("Encryption on link "+str(self)+" failed. The contained exception was: "+str(e), RNS.LOG_ERROR)
 
@@ -438,13 +499,107 @@ class Link:
 		if self.__encryption_disabled:
 			return ciphertext
 		try:
-			fernet = Fernet(base64.urlsafe_b64encode(self.derived_key))
-			plaintext = fernet.decrypt(base64.urlsafe_b64encode(ciphertext))
-			return plaintext
+			if len(ciphertext) < Link.FERNET_OVERHEAD:
+				raise ValueError("Invalid token")
+			h = self.token_hmac.copy()
+			h.update(ciphertext[:-Link.FERNET_HMAC])
+			h.verify(ciphertext[-Link.FERNET_HMAC:])
+
+			decryptor, unpadder = self.token_decryptor(ciphertext[:Link.FERNET_HEADER])
+			plaintext = decryptor.update(ciphertext[Link.FERNET_HEADER:-Link.FERNET_HMAC]) + decryptor.finalize()
+			return unpadder.update(plaintext) + unpadder.finalize()
 		except Exception as e:
 			RNS.log("Decryption failed on link "+str(self)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
 			traceback.print_exc()
 
+	# Link traffic is encrypted as Fernet tokens in
+	# their raw binary form, without the base64 that
+	# the Fernet class would add and remove for every
+	# packet. Packets and streamed resources share
+	# these two functions, which start a token and
+	# return the objects that produce or read it.
+	def token_encryptor(self):
+		iv = os.urandom(16)
+		header = Link.FERNET_VERSION + struct.pack(">Q", int(time.time())) + iv
+		encryptor = Cipher(algorithms.AES(self.encryption_key), modes.CBC(iv), default_backend()).encryptor()
+		padder = padding.PKCS7(algorithms.AES.block_size).padder()
+		h = self.token_hmac.copy()
+		h.update(header)
+		return header, encryptor, padder, h
+
+	def token_decryptor(self, header):
+		if len(header) < Link.FERNET_HEADER or header[0] != Link.FERNET_VERSION:
+			raise ValueError("Invalid token")
+		iv = header[9:Link.FERNET_HEADER]
+		decryptor = Cipher(algorithms.AES(self.encryption_key), modes.CBC(iv), default_backend()).decryptor()
+		unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+		return decryptor, unpadder
+
+	# Encrypts everything read from source into one
+	# token, which is written to destination. The
+	# token is the same as encrypt would produce,
+	# but the data is never held in memory at once.
+	def encrypt_stream(self, source, destination, chunk_size=64*1024):
+		header, encryptor, padder, h = self.token_encryptor()
+		destination.write(header)
+
+		chunk = source.read(chunk_size)
+		while chunk != "":
+			ciphertext = encryptor.update(padder.update(chunk))
+			destination.write(ciphertext)
+			h.update(ciphertext)
+			chunk = source.read(chunk_size)
+
+		ciphertext = encryptor.update(padder.finalize()) + encryptor.finalize()
+		destination.write(ciphertext)
+		h.update(ciphertext)
+		destination.write(h.finalize())
+
+	# Authenticates a token read from source, and
+	# then yields its plaintext in chunks
+	def decrypt_stream(self, source, chunk_size=64*1024):
+		source.seek(0, os.SEEK_END)
+		ciphertext_length = source.tell() - Link.FERNET_OVERHEAD
+		if ciphertext_length < 0:
+			raise ValueError("Invalid token")
+
+		h = self.token_hmac.copy()
+		source.seek(0)
+		remaining = Link.FERNET_HEADER + ciphertext_length
+		while remaining > 0:
+			chunk = source.read(min(chunk_size, remaining))
+			h.update(chunk)
+			remaining -= len(chunk)
+		h.verify(source.read(Link.FERNET_HMAC))
+
+		source.seek(0)
+		decryptor, unpadder = self.token_decryptor(source.read(Link.FERNET_HEADER))
+		remaining = ciphertext_length
+		while remaining > 0:
+			chunk = source.read(min(chunk_size, remaining))
+			remaining -= len(chunk)
+			yield unpadder.update(decryptor.update(chunk))
+
+		yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
+
+	# Yields the plaintext of the cipher blocks in
+	# the first length bytes of a token read
+	# from source. The token can not be authenticated
+	# before it is complete, so this plaintext must be
+	# verified by other means before it is trusted.
+	def decrypt_stream_prefix(self, source, length, chunk_size=64*1024):
+		source.seek(0)
+		header = source.read(Link.FERNET_HEADER)
+		if len(header) < Link.FERNET_HEADER or header[0] != Link.FERNET_VERSION:
+			return
+
+		decryptor, unpadder = self.token_decryptor(header)
+		remaining = max(length-Link.FERNET_HEADER, 0)/16*16
+		while remaining > 0:
+			chunk = source.read(min(chunk_size, remaining))
+			remaining -= len(chunk)
+			yield decryptor.update(chunk)
+
 	def sign(self, message):
 		return self.prv.sign(message, ec.ECDSA(hashes.SHA256()))
 
@@ -473,10 +628,12 @@ class Link:
 		self.callbacks.resource_concluded = callback
 
 	def resource_concluded(self, resource):
-		if resource in self.incoming_resources:
-			self.incoming_resources.remove(resource)
-		if resource in self.outgoing_resources:
-			self.outgoing_resources.remove(resource)
+		with self.resource_lock:
+			if resource in self.incoming_resources:
+				self.remove_incoming_resource(resource)
+			if resource in self.outgoing_resources:
+				self.outgoing_resources.remove(resource)
+		self.advertise_queued_resources()
 
 	def set_resource_strategy(self, resource_strategy):
 		if not resource_strategy in Link.resource_strategies:
@@ -484,26 +641,109 @@ class Link:
 		else:
 			self.resource_strategy = resource_strategy
 
+	# Sets the compression codec for outgoing
+	# resources on this link. None selects the
+	# Resource default.
+	def set_resource_compression(self, compression):
+		if compression != None and compression != RNS.Resource.COMPRESSION_NONE and not compression in RNS.Resource.codecs:
+			raise TypeError("Unsupported compression codec")
+		else:
+			self.resource_compression = compression
+
+	# If spooling is enabled, incoming resources
+	# give their data to the application as a file
+	# object instead of a string
+	def set_resource_spooling(self, spooling):
+		self.resource_spooling = spooling
+
+	# If resources are resumable, outgoing resources
+	# are advertised under a hash derived from their
+	# data, and incoming resources that fail are saved
+	# to the cache, so that a transfer of the same
+	# data on a later link can resume where it failed.
+	# Saved partials expire after Resource.PARTIAL_TIMEOUT,
+	# and are removed when Reticulum starts, when another
+	# partial is saved, or when they would be resumed.
+	def set_resource_resumable(self, resumable):
+		self.resource_resumable = resumable
+
+	# With forward error correction, outgoing resources
+	# send this many repair parts after every block of
+	# Resource.FEC_BLOCK_SIZE parts, so the receiver can
+	# restore lost parts without requesting them again.
+	# None selects the setting of the interface. Peers
+	# without FEC are sent resources without repair
+	# parts.
+	def set_resource_fec(self, repair_parts):
+		if repair_parts != None and (repair_parts < 0 or repair_parts > RNS.Resource.FEC_MAX_REPAIR):
+			raise ValueError("Unsupported number of repair parts")
+		else:
+			self.resource_fec = repair_parts
+
+	def peer_has_capability(self, capability):
+		return (self.peer_capabilities & capability) == capability
+
+	# Queues an outgoing resource for advertisement.
+	# Resources are advertised in the order they were
+	# queued, as soon as the link has room for them.
+	def queue_outgoing_resource(self, resource):
+		with self.resource_lock:
+			self.queued_resources.append(resource)
+		self.advertise_queued_resources()
+
+	def advertise_queued_resources(self):
+		while True:
+			with self.resource_lock:
+				if len(self.queued_resources) == 0 or not self.ready_for_new_resource():
+					return
+				resource = self.queued_resources.popleft()
+				self.register_outgoing_resource(resource)
+			resource.send_advertisement()
+
 	def register_outgoing_resource(self, resource):
-		self.outgoing_resources.append(resource)
+		with self.resource_lock:
+			ids_in_use = [r.id for r in self.outgoing_resources]
+			while self.next_resource_id in ids_in_use:
+				self.next_resource_id = (self.next_resource_id+1) % Link.RESOURCE_IDS
+			resource.id = self.next_resource_id
+			self.next_resource_id = (self.next_resource_id+1) % Link.RESOURCE_IDS
+			self.outgoing_resources.append(resource)
 
 	def register_incoming_resource(self, resource):
-		self.incoming_resources.append(resource)
+		with self.resource_lock:
+			# If the peer reuses the id of a resource we
+			# still hold, it has given up on that transfer
+			stale_resource = self.incoming_resource_ids.get(resource.id)
+			if stale_resource != None:
+				RNS.log("Resource id reused by peer, cancelling "+str(stale_resource), RNS.LOG_DEBUG)
+				stale_resource.cancel()
+			self.incoming_resources.append(resource)
+			self.incoming_resource_ids[resource.id] = resource
+
+	def remove_incoming_resource(self, resource):
+		self.incoming_resources.remove(resource)
+		if self.incoming_resource_ids.get(resource.id) == resource:
+			del self.incoming_resource_ids[resource.id]
 
 	def cancel_outgoing_resource(self, resource):
-		if resource in self.outgoing_resources:
-			self.outgoing_resources.remove(resource)
-		else:
-			RNS.log("Attempt to cancel a non-existing incoming resource", RNS.LOG_ERROR)
+		with self.resource_lock:
+			if resource in self.outgoing_resources:
+				self.outgoing_resources.remove(resource)
+			elif resource in self.queued_resources:
+				self.queued_resources.remove(resource)
+			else:
+				RNS.log("Attempt to cancel a non-existing outgoing resource", RNS.LOG_ERROR)
+		self.advertise_queued_resources()
 
 	def cancel_incoming_resource(self, resource):
-		if resource in self.incoming_resources:
-			self.incoming_resources.remove(resource)
-		else:
-			RNS.log("Attempt to cancel a non-existing incoming resource", RNS.LOG_ERROR)
+		with self.resource_lock:
+			if resource in self.incoming_resources:
+				self.remove_incoming_resource(resource)
+			else:
+				RNS.log("Attempt to cancel a non-existing incoming resource", RNS.LOG_ERROR)
 
 	def ready_for_new_resource(self):
-		if len(self.outgoing_resources) > 0:
+		if len(self.outgoing_resources) >= Link.MAX_OUTGOING_RESOURCES:
 			return False
 		else:
 			return True
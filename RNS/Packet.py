@@ -32,6 +32,7 @@ class Packet:
 	PATH_RESPONSE  = 0x0B	# Packet is a response to a path request
 	COMMAND        = 0x0C	# Packet is a command
 	COMMAND_STATUS = 0x0D	# Packet is a status of an executed command
+	RESOURCE_FEC   = 0x0E	# Packet is a resource repair part
 	KEEPALIVE      = 0xFB	# Packet is a keepalive packet
 	LINKCLOSE      = 0xFC	# Packet is a link close message
 	LINKPROOF      = 0xFD	# Packet is a link packet proof
@@ -110,7 +111,7 @@ class Packet:
 				elif self.packet_type == Packet.PROOF and self.destination.type == RNS.Destination.LINK:
 					# Packet proofs over links are not encrypted
 					self.ciphertext = self.data
-				elif self.context == Packet.RESOURCE:
+				elif self.context == Packet.RESOURCE or self.context == Packet.RESOURCE_FEC:
 					# A resource takes care of symmetric
 					# encryption by itself
 					self.ciphertext = self.data
@@ -259,6 +260,7 @@ class PacketReceipt:
 	# Creates a new packet receipt from a sent packet
 	def __init__(self, packet):
 		self.hash    = packet.getHash()
+		self.truncated_hash = self.hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8]
 		self.sent    = True
 		self.sent_at = time.time()
 		self.timeout = Packet.TIMEOUT
@@ -267,6 +269,7 @@ class PacketReceipt:
 		self.destination = packet.destination
 		self.callbacks   = PacketReceiptCallbacks()
 		self.concluded_at = None
+		self.timer        = None
 
 	# Validate a proof packet
 	def validateProofPacket(self, proof_packet):
@@ -368,6 +371,8 @@ class PacketReceipt:
 	# Set the timeout in seconds
 	def set_timeout(self, timeout):
 		self.timeout = float(timeout)
+		if self.timer != None:
+			RNS.Transport.scheduleReceiptTimeout(self)
 
 	# Set a function that gets called when
 	# a successfull delivery has been proved
@@ -1,27 +1,112 @@
 import RNS
+import os
 import bz2
+import zlib
 import math
+import struct
+import binascii
 import time
 import threading
+import itertools
 import vendor.umsgpack as umsgpack
+from cStringIO import StringIO
+from collections import deque
+from tempfile import SpooledTemporaryFile
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.backends import default_backend
 from time import sleep
 
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
 class Resource:
+	# The receiver adapts its request window between
+	# WINDOW_MIN and WINDOW_MAX parts. Interfaces can
+	# set a lower maximum with resource_window_max.
 	WINDOW_MIN  = 1
-	WINDOW_MAX  = 7
+	WINDOW_MAX  = 64
 	WINDOW      = 4
+	# While the window is doubled, windows must
+	# complete at least this much faster each time,
+	# or the link is assumed to be saturated
+	WINDOW_RATE_GAIN = 1.25
 	MAPHASH_LEN = 4
-	SDU         = RNS.Reticulum.MTU - RNS.Packet.HEADER_MAXSIZE
+	# Each part is sent with a one-byte resource id,
+	# so that several resources can be transferred
+	# over a link at the same time
+	ID_LEN      = 1
+	SDU         = RNS.Reticulum.MTU - RNS.Packet.HEADER_MAXSIZE - ID_LEN
 	RANDOM_HASH_SIZE = 4
 
+	# Resource data is processed in chunks of this
+	# size, and intermediate data is kept in memory
+	# up to SPOOL_SIZE, and spooled to disk beyond it
+	CHUNK_SIZE  = 64*1024
+	SPOOL_SIZE  = 1024*1024
+
 	# TODO: Should be allocated more
 	# intelligently
 	MAX_RETRIES       = 5
 	SENDER_GRACE_TIME = 10
 	RETRY_GRACE_TIME  = 0.25
 
+	# Compression codecs. The codec is recorded in
+	# bits 1 to 3 of the advertisement flags.
+	COMPRESSION_NONE = 0x00
+	COMPRESSION_BZ2  = 0x01
+	COMPRESSION_ZLIB = 0x02
+	COMPRESSION_LZMA = 0x03
+	COMPRESSION      = COMPRESSION_BZ2
+
+	# Data larger than the probe is only compressed if
+	# samples taken across it compress to less than
+	# PROBE_RATIO of their size
+	PROBE_SIZE    = 16*1024
+	PROBE_SAMPLES = 4
+	PROBE_RATIO   = 0.9
+
+	# With more than one compression worker, data
+	# larger than a block is compressed in independent
+	# blocks on the compression pool
+	BLOCK_SIZE       = 1024*1024
+	compression_pool = None
+
 	HASHMAP_IS_NOT_EXHAUSTED = 0x00
 	HASHMAP_IS_EXHAUSTED = 0xFF
+	RESUME_FROM_OFFSET = 0x01
+	# Requests can also give the requested parts as a
+	# bitmap over a range of part indexes, which is
+	# shorter than a list of map hashes for anything
+	# but the smallest windows
+	BITMAP_HASHMAP_IS_NOT_EXHAUSTED = 0x02
+	BITMAP_HASHMAP_IS_EXHAUSTED = 0xFE
+
+	# With forward error correction, parts are coded
+	# in blocks of FEC_BLOCK_SIZE, and up to
+	# FEC_MAX_REPAIR repair parts are sent after each
+	# block, so that the receiver can restore as many
+	# lost parts of the block without requesting them
+	# again. Repair parts carry the block and repair
+	# index after the resource id, so parts are that
+	# much shorter. Block indexes and the advertisement
+	# limit FEC to resources of FEC_MAX_PARTS parts.
+	FEC_BLOCK_SIZE = 16
+	FEC_MAX_REPAIR = 15
+	FEC_HEADER_LEN = 3
+	FEC_MAX_PARTS  = 0xFFFF
+
+	# Partially received resumable resources are kept
+	# in the cache for this long
+	PARTIAL_TIMEOUT = 24*60*60
+	# An encrypted payload can be decrypted up to its
+	# last cipher block and HMAC before the token is
+	# complete
+	TOKEN_TAIL = 16+32
 
 	# Status constants
 	NONE 			= 0x00
@@ -36,49 +121,126 @@ class Resource:
 
 	@staticmethod
 	def accept(advertisement_packet, callback=None, progress_callback = None):
+		if not advertisement_packet.link.peer_has_capability(RNS.Link.CAPABILITY_RESOURCE_IDS):
+			RNS.log("Resource advertisement from a peer without resource ids on "+str(advertisement_packet.link)+", dropping resource", RNS.LOG_NOTICE)
+			return None
+
 		try:
 			adv = ResourceAdvertisement.unpack(advertisement_packet.plaintext)
 
 			resource = Resource(None, advertisement_packet.link)
 			resource.status = Resource.TRANSFERRING
 
-			resource.flags               = adv.f
-			resource.size                = adv.t
-			resource.uncompressed_size   = adv.d
-			resource.hash                = adv.h
-			resource.random_hash         = adv.r
-			resource.hashmap_raw         = adv.m
-			resource.encrypted           = True if resource.flags & 0x01 else False
-			resource.compressed          = True if resource.flags >> 1 & 0x01 else False
+			resource.id                  = adv.i
 			resource.initiator           = False
 			resource.callback		     = callback
 			resource.__progress_callback = progress_callback
-			resource.total_parts	     = int(math.ceil(resource.size/float(Resource.SDU)))
-			resource.received_count      = 0
-			resource.outstanding_parts   = 0
-			resource.parts			     = [None] * resource.total_parts
 			resource.window 		     = Resource.WINDOW
-			resource.last_activity       = time.time()
-
-			resource.hashmap = [None] * resource.total_parts
-			resource.hashmap_height = 0
-			resource.waiting_for_hmu = False
+			resource.window_max          = Resource.WINDOW_MAX
+			resource.window_threshold    = Resource.WINDOW_MAX
+			resource.window_rate         = None
+			resource.partial_length      = 0
+			resource.load_advertisement(adv)
+			resource.partial_name        = RNS.hexrep(resource.hash, delimit=False)
+
+			if adv.s:
+				RNS.log("Resumed resource "+RNS.prettyhexrep(resource.hash)+" is not known, dropping resource", RNS.LOG_DEBUG)
+				return None
+
+			if resource.compressed and not resource.compression in Resource.codecs:
+				RNS.log("Resource "+RNS.prettyhexrep(resource.hash)+" uses an unsupported compression codec, dropping resource", RNS.LOG_ERROR)
+				return None
+
+			interface = resource.link.attached_interface
+			if interface != None and interface.resource_window_max != None:
+				resource.window_max = max(min(interface.resource_window_max, Resource.WINDOW_MAX), Resource.WINDOW_MIN)
+				resource.window_threshold = resource.window_max
+				resource.window = min(resource.window, resource.window_max)
 			
 			resource.link.register_incoming_resource(resource)
 
 			RNS.log("Accepting resource advertisement for "+RNS.prettyhexrep(resource.hash), RNS.LOG_DEBUG)
 			resource.link.callbacks.resource_started(resource)
 
-			resource.hashmap_update(0, resource.hashmap_raw)
+			if not resource.request_resume():
+				resource.hashmap_update(0, resource.hashmap_raw)
 
 			resource.watchdog_job()
 
 			return resource
 		except Exception as e:
-			RNS.log("Could not decode resource advertisement, dropping resource", RNS.LOG_DEBUG)
+			RNS.log("Could not decode resource advertisement, dropping resource. The contained exception was: "+str(e), RNS.LOG_ERROR)
 			return None
 
-	def __init__(self, data, link, advertise=True, auto_compress=True, callback=None, progress_callback=None):
+	# If the sender had to restart a transfer we are
+	# already receiving, the resource is reloaded from
+	# the new advertisement instead of being dropped.
+	# Returns whether the advertisement was handled.
+	@staticmethod
+	def accept_restart(advertisement_packet):
+		try:
+			adv = ResourceAdvertisement.unpack(advertisement_packet.plaintext)
+			if not adv.x:
+				return False
+
+			resource = advertisement_packet.link.incoming_resource_ids.get(adv.i)
+			if resource == None or resource.status != Resource.TRANSFERRING:
+				return False
+
+			RNS.log("Resource "+RNS.prettyhexrep(resource.hash)+" was restarted by the sender as "+RNS.prettyhexrep(adv.h), RNS.LOG_DEBUG)
+			resource.received_data.close()
+			resource.load_advertisement(adv)
+			resource.retries_left = resource.max_retries
+			if adv.s and (resource.payload_offset == 0 or resource.payload_offset > resource.load_partial()):
+				RNS.log("Resource "+RNS.prettyhexrep(resource.hash)+" was resumed after data that is no longer held", RNS.LOG_DEBUG)
+				resource.cancel()
+				return True
+			resource.hashmap_update(0, resource.hashmap_raw)
+			resource.watchdog_job()
+
+			return True
+		except Exception as e:
+			return False
+
+	def load_advertisement(self, adv):
+		self.flags                        = adv.f
+		self.size                         = adv.t
+		self.uncompressed_size            = adv.d
+		self.hash                         = adv.h
+		self.random_hash                  = adv.r
+		self.hashmap_raw                  = adv.m
+		self.encrypted                    = adv.e
+		self.compression                  = adv.z
+		self.compressed                   = adv.c
+		self.chunked                      = adv.b
+		self.resumable                    = adv.p
+		self.payload_offset               = self.partial_length if adv.s else 0
+		self.resuming                     = False
+		self.fec                          = adv.q
+		self.sdu                          = Resource.SDU-Resource.FEC_HEADER_LEN if self.fec > 0 else Resource.SDU
+		self.total_parts                  = int(math.ceil(self.size/float(self.sdu)))
+		self.received_count               = 0
+		self.outstanding_parts            = 0
+		self.part_received                = bytearray(self.total_parts)
+		self.received_data                = SpooledTemporaryFile(Resource.SPOOL_SIZE)
+		self.window_requested             = 0
+		self.last_activity                = time.time()
+
+		self.hashmap                      = [None] * self.total_parts
+		self.hashmap_height               = 0
+		self.consecutive_completed_height = 0
+		self.part_index                   = {}
+		self.part_index_start             = 0
+		self.part_index_end               = 0
+		self.waiting_for_hmu              = False
+		self.request_end                  = None
+
+		self.fec_blocks                   = int(math.ceil(self.total_parts/float(Resource.FEC_BLOCK_SIZE)))
+		self.fec_height                   = 0
+		self.fec_pending                  = []
+		self.fec_repairs                  = {}
+
+	def __init__(self, data, link, advertise=True, auto_compress=True, callback=None, progress_callback=None, compression=None, fec=None):
 		self.status = Resource.NONE
 		self.link = link
 		self.max_retries = Resource.MAX_RETRIES
@@ -90,69 +252,466 @@ class Resource:
 		self.watchdog_lock = False
 		self.__watchdog_job_id = 0
 		self.rtt = None
+		self.id = None
+		self.remapping = False
 
 		if data != None:
-			hashmap_ok = False
-			while not hashmap_ok:
-				self.initiator         = True
-				self.callback          = callback
-				self.progress_callback = progress_callback
-				self.random_hash       = RNS.Identity.getRandomHash()[:Resource.RANDOM_HASH_SIZE]
-				self.uncompressed_data = data
-				self.compressed_data   = bz2.compress(self.uncompressed_data)
-				self.uncompressed_size = len(self.uncompressed_data)
-				self.compressed_size   = len(self.compressed_data)
-
-				self.hash = RNS.Identity.fullHash(data+self.random_hash)
-				self.expected_proof = RNS.Identity.fullHash(data+self.hash)
-
-				if (self.compressed_size < self.uncompressed_size and auto_compress):
-					self.data = self.compressed_data
-					self.compressed = True
-					self.uncompressed_data = None
-				else:
-					self.data = self.uncompressed_data
-					self.compressed = False
-					self.compressed_data = None
+			# Earlier versions would read the resource id
+			# that parts start with as part of the data
+			if not self.link.peer_has_capability(RNS.Link.CAPABILITY_RESOURCE_IDS):
+				raise TypeError("The peer of this link does not support resource ids")
+
+			self.initiator         = True
+			self.callback          = callback
+			self.progress_callback = progress_callback
+
+			# The data can be given as a string, or as a
+			# seekable file-like object, which is read from
+			# its current position to the end. Either way,
+			# the data is processed in chunks, and parts are
+			# read back from the output as they are requested.
+			if hasattr(data, "read"):
+				self.source = data
+			else:
+				self.source = StringIO(data)
+			self.source_start = self.source.tell()
+			self.source.seek(0, os.SEEK_END)
+			source_size = self.source.tell() - self.source_start
+			self.source.seek(self.source_start)
+
+			# The codec can be chosen per resource, or per
+			# link, and is skipped if a probe of the data
+			# shows that it is not worth compressing
+			if compression == None:
+				compression = self.link.resource_compression
+			if compression == None:
+				compression = Resource.COMPRESSION
+			if not compression in Resource.codecs and compression != Resource.COMPRESSION_NONE:
+				raise TypeError("Unsupported compression codec")
+			if not auto_compress or not self.probe_compression(compression, source_size):
+				compression = Resource.COMPRESSION_NONE
+			self.chunked = compression != Resource.COMPRESSION_NONE and Resource.compression_pool != None and source_size > Resource.BLOCK_SIZE
+			self.resumable = self.link.resource_resumable
+
+			# The number of repair parts per block can be
+			# set per resource, per link, or per interface
+			if fec == None:
+				fec = self.link.resource_fec
+			if fec == None and self.link.attached_interface != None:
+				fec = self.link.attached_interface.resource_fec
+			if fec != None and (fec < 0 or fec > Resource.FEC_MAX_REPAIR):
+				raise ValueError("Unsupported number of repair parts")
+			if fec != None and fec > 0 and not self.link.peer_has_capability(RNS.Link.CAPABILITY_RESOURCE_FEC):
+				RNS.log("The peer of "+str(self.link)+" does not support FEC, sending resource without repair parts", RNS.LOG_DEBUG)
+				fec = None
+			self.fec = fec if fec != None else 0
+
+			data_hash = hashes.Hash(hashes.SHA256(), backend=default_backend())
+			compressed_data = SpooledTemporaryFile(Resource.SPOOL_SIZE)
+			self.uncompressed_size = 0
+			if self.chunked:
+				compressor = None
+				self.compress_blocks(compression, compressed_data, data_hash)
+			else:
+				compressor = Resource.codecs[compression].compressor() if compression != Resource.COMPRESSION_NONE else None
+				for chunk in self.read_chunks(self.source):
+					data_hash.update(chunk)
+					if compressor != None:
+						compressed_data.write(compressor.compress(chunk))
+					self.uncompressed_size += len(chunk)
+				if compressor != None:
+					compressed_data.write(compressor.flush())
+			self.compressed_size = compressed_data.tell()
+
+			# The hash state of the source data is kept, so
+			# that hashes of the data with different suffixes
+			# can be found without reading it again
+			self.source_hash = data_hash
+			self.random_hash = None
+			self.random_hash = self.next_random_hash()
+			self.hash = self.hash_source(self.random_hash)
+			self.expected_proof = self.hash_source(self.hash)
+
+			if (self.compressed_size < self.uncompressed_size and compression != Resource.COMPRESSION_NONE):
+				payload = compressed_data
+				payload_start = 0
+				self.compressed = True
+				self.compression = compression
+			else:
+				compressed_data.close()
+				payload = self.source
+				payload_start = self.source_start
+				self.compressed = False
+				self.compression = Resource.COMPRESSION_NONE
+				self.chunked = False
+
+			# Resumable resources keep the payload, since
+			# the receiver can ask for it to be sent again
+			# from an offset
+			self.payload = payload
+			self.payload_start = payload_start
+			self.payload.seek(0, os.SEEK_END)
+			self.payload_size = self.payload.tell() - self.payload_start
+			self.payload_offset = 0
+			self.write_output()
+			if self.encrypted and not self.resumable and self.payload != self.source:
+				self.payload.close()
+
+			self.output_lock = threading.Lock()
+			self.map_lock = threading.RLock()
+			self.map_generation = 0
+			self.hmu_pending = None
+			self.restarted = False
+			self.parts_lost = False
+			self.start_map()
+			while not self.mapOutput(1):
+				RNS.log("Found hash collision in resource map, remapping...", RNS.LOG_VERBOSE)
+				self.remap()
+
+			self.part_index = {}
+			self.part_index_start = 0
+			self.part_index_end = 0
+			self.index_window()
+
+			# The advertisement only needs the first
+			# hashmap segment, so the remaining segments
+			# are mapped while the transfer is running
+			if len(self.hashmap) < self.hashmap_segments:
+				thread = threading.Thread(target=self.__map_job, args=(self.map_generation,))
+				thread.setDaemon(True)
+				thread.start()
+
+			if advertise:
+				self.advertise()
+		else:
+			pass
 
-				if not self.link.encryption_disabled():
-					self.data = self.link.encrypt(self.data)
-					self.encrypted = True
+	# Writes the payload from payload_offset to the
+	# output that parts are read from, encrypting it
+	# unless encryption is disabled on the link
+	def write_output(self):
+		self.payload.seek(self.payload_start+self.payload_offset)
+		if not self.link.encryption_disabled():
+			self.output = SpooledTemporaryFile(Resource.SPOOL_SIZE)
+			self.output_start = 0
+			self.link.encrypt_stream(self.payload, self.output, Resource.CHUNK_SIZE)
+			self.encrypted = True
+		else:
+			self.output = self.payload
+			self.output_start = self.payload_start+self.payload_offset
+			self.encrypted = False
+
+		self.output.seek(0, os.SEEK_END)
+		self.size = self.output.tell() - self.output_start
+		self.sdu = Resource.SDU-Resource.FEC_HEADER_LEN if self.fec > 0 else Resource.SDU
+		self.total_parts = int(math.ceil(self.size/float(self.sdu)))
+		if self.fec > 0 and self.total_parts > Resource.FEC_MAX_PARTS:
+			RNS.log("Resource is too large for forward error correction, sending it without", RNS.LOG_DEBUG)
+			self.fec = 0
+			self.sdu = Resource.SDU
+			self.total_parts = int(math.ceil(self.size/float(self.sdu)))
+		self.sent_parts = 0
+		self.part_sent = bytearray(self.total_parts)
+		self.last_requested_part = 0
+		self.fec_blocks = int(math.ceil(self.total_parts/float(Resource.FEC_BLOCK_SIZE)))
+		self.fec_height = 0
+
+	# Compresses samples from across the source data,
+	# and returns whether they compressed well enough
+	def probe_compression(self, compression, size):
+		if compression == Resource.COMPRESSION_NONE:
+			return False
+
+		if size <= Resource.PROBE_SIZE*Resource.PROBE_SAMPLES:
+			return True
+
+		compressor = Resource.codecs[compression].compressor()
+		sample_size = Resource.PROBE_SIZE
+		sampled = 0
+		compressed = 0
+		for i in range(0, Resource.PROBE_SAMPLES):
+			self.source.seek(self.source_start + i*(size-sample_size)/(Resource.PROBE_SAMPLES-1))
+			sample = self.source.read(sample_size)
+			sampled += len(sample)
+			compressed += len(compressor.compress(sample))
+		compressed += len(compressor.flush())
+		self.source.seek(self.source_start)
+
+		return compressed < sampled*Resource.PROBE_RATIO
+
+	def read_chunks(self, stream, chunk_size=None):
+		if chunk_size == None:
+			chunk_size = Resource.CHUNK_SIZE
+		chunk = stream.read(chunk_size)
+		while chunk != "":
+			yield chunk
+			chunk = stream.read(chunk_size)
+
+	# Compresses the source in blocks on the compression
+	# pool, and writes them to the destination in order.
+	# Each block is preceded by its compressed length,
+	# so the receiver can find the block boundaries.
+	def compress_blocks(self, compression, destination, data_hash):
+		pending = deque()
+		for block in self.read_chunks(self.source, Resource.BLOCK_SIZE):
+			data_hash.update(block)
+			self.uncompressed_size += len(block)
+			pending.append(Resource.compression_pool.apply_async(compressBlock, (compression, block)))
+			if len(pending) > Resource.blocksInFlight():
+				compressed_block = pending.popleft().get()
+				destination.write(struct.pack("!I", len(compressed_block))+compressed_block)
+
+		while len(pending) > 0:
+			compressed_block = pending.popleft().get()
+			destination.write(struct.pack("!I", len(compressed_block))+compressed_block)
+
+	# Splits received data into its compressed blocks,
+	# and yields them decompressed, in order. Blocks are
+	# decompressed on the compression pool if there is
+	# one.
+	def decompress_blocks(self, chunks):
+		pending = deque()
+		buffer = bytearray()
+		for chunk in chunks:
+			buffer.extend(chunk)
+			while len(buffer) >= 4:
+				block_length = struct.unpack("!I", str(buffer[:4]))[0]
+				if len(buffer) < 4+block_length:
+					break
+
+				block = str(buffer[4:4+block_length])
+				del buffer[:4+block_length]
+				if Resource.compression_pool != None:
+					pending.append(Resource.compression_pool.apply_async(decompressBlock, (self.compression, block)))
+					if len(pending) > Resource.blocksInFlight():
+						yield pending.popleft().get()
 				else:
-					self.encrypted = False
+					yield decompressBlock(self.compression, block)
 
-				self.size = len(self.data)
-				
-				self.hashmap = ""
-				self.sent_parts = 0
-				self.parts  = []
-				for i in range(0,int(math.ceil(self.size/float(Resource.SDU)))):
-					data = self.data[i*Resource.SDU:(i+1)*Resource.SDU]
-					part = RNS.Packet(link, data, context=RNS.Packet.RESOURCE)
-					part.pack()
-					part.map_hash = self.getMapHash(data)
-					self.hashmap += part.map_hash
-					self.parts.append(part)
-
-				hashmap_ok = self.checkHashMap()
-				if not hashmap_ok:
-					RNS.log("Found hash collision in resource map, remapping...", RNS.LOG_VERBOSE)
-
-				if advertise:
-					self.advertise()
-		else:
-			pass
+		if len(buffer) > 0:
+			raise ValueError("Truncated compressed block")
 
+		while len(pending) > 0:
+			yield pending.popleft().get()
 
-	def checkHashMap(self):
-		checked_hashes = []
-		for part in self.parts:
-			if part.map_hash in checked_hashes:
-				return False
-			checked_hashes.append(part.map_hash)
+	@staticmethod
+	def blocksInFlight():
+		return 2*RNS.Reticulum.get_compression_workers()
+
+	# Returns the hash of the source data followed
+	# by the suffix, as Identity.fullHash would
+	def hash_source(self, suffix):
+		data_hash = self.source_hash.copy()
+		data_hash.update(suffix)
+		return data_hash.finalize()
+
+	# Resumable resources derive their random hash
+	# from the data, so the same data is advertised
+	# under the same resource hash on any link
+	def next_random_hash(self):
+		if self.resumable:
+			seed = self.random_hash if self.random_hash != None else ""
+			return self.hash_source(seed)[:Resource.RANDOM_HASH_SIZE]
+		else:
+			return RNS.Identity.getRandomHash()[:Resource.RANDOM_HASH_SIZE]
+
+	def start_map(self):
+		self.hashmap = []
+		self.hashmap_segments = int(math.ceil(self.total_parts/float(ResourceAdvertisement.HASHMAP_MAX_LEN)))
+		self.recent_hashes = deque()
+		self.recent_set = set()
+
+	# Starts over with a new random hash, after a map
+	# hash collision
+	def remap(self):
+		self.random_hash = self.next_random_hash()
+		self.hash = self.hash_source(self.random_hash)
+		self.expected_proof = self.hash_source(self.hash)
+		self.start_map()
+
+	# Builds the hashmap of the output data, in segments
+	# of HASHMAP_MAX_LEN parts, until the given number of
+	# segments have been mapped. Map hashes must be unique
+	# within a distance that the sender might have to
+	# search for a requested part, so False is returned
+	# if a collision is found there. If the output has
+	# been replaced since the given map generation,
+	# True is returned and the map is left alone.
+	def mapOutput(self, segments=None, generation=None):
+		if segments == None:
+			segments = self.hashmap_segments
+		if generation == None:
+			generation = self.map_generation
+		guard_distance = 3*ResourceAdvertisement.COLLISION_GUARD_SIZE
+		segment_length = ResourceAdvertisement.HASHMAP_MAX_LEN
+		while len(self.hashmap) < min(segments, self.hashmap_segments):
+			if self.status == Resource.FAILED:
+				return True
+
+			start = len(self.hashmap)*segment_length
+			end = min(start+segment_length, self.total_parts)
+			data = self.get_parts(start, end)
+			segment = StringIO()
+			for i in xrange(0, end-start):
+				map_hash = self.getMapHash(data[i*self.sdu:(i+1)*self.sdu])
+				if map_hash in self.recent_set:
+					return False
+
+				segment.write(map_hash)
+				self.recent_hashes.append(map_hash)
+				self.recent_set.add(map_hash)
+				if len(self.recent_hashes) > guard_distance:
+					self.recent_set.remove(self.recent_hashes.popleft())
+
+			with self.map_lock:
+				if generation != self.map_generation:
+					return True
+				self.hashmap.append(segment.getvalue())
+				hmu_segment = self.hmu_pending
+				if hmu_segment == len(self.hashmap)-1:
+					self.hmu_pending = None
+			if hmu_segment == len(self.hashmap)-1:
+				self.send_hashmap_update(hmu_segment)
 
 		return True
 
+	def __map_job(self, generation):
+		try:
+			while not self.mapOutput(generation=generation):
+				if generation != self.map_generation:
+					return
+
+				# The advertisement is already out, so the
+				# transfer is started over with a new random
+				# hash. The new advertisement is flagged as a
+				# restart, so the receiver can reload the
+				# resource it holds under the same id.
+				RNS.log("Found hash collision in resource map, restarting transfer...", RNS.LOG_VERBOSE)
+				with self.map_lock:
+					self.remapping = True
+				self.remap()
+				while not self.mapOutput(1, generation):
+					self.remap()
+
+				with self.map_lock:
+					if self.status == Resource.FAILED or generation != self.map_generation:
+						return
+					self.restart_transfer()
+		except Exception as e:
+			if self.status != Resource.FAILED and generation == self.map_generation:
+				RNS.log("Error while mapping resource "+RNS.prettyhexrep(self.hash)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+				self.cancel()
+
+	# Called on outgoing resource when the first
+	# segment of a new map is ready, to start the
+	# transfer over with it
+	def restart_transfer(self):
+		self.remapping = False
+		self.sent_parts = 0
+		self.part_sent = bytearray(self.total_parts)
+		self.last_requested_part = 0
+		self.fec_height = 0
+		self.part_index = {}
+		self.part_index_start = 0
+		self.part_index_end = 0
+		self.index_window()
+		self.hmu_pending = None
+		if self.status >= Resource.ADVERTISED:
+			self.restarted = True
+			self.send_advertisement()
+
+	# Called on outgoing resource when the receiver
+	# already holds the payload up to offset from an
+	# earlier transfer. The rest of the payload is
+	# written to a new output, which is mapped and
+	# advertised as a restart of this transfer.
+	def resume(self, offset):
+		if self.resumable and self.payload_offset == 0 and offset > 0 and offset < self.payload_size:
+			RNS.log("Resuming resource "+RNS.prettyhexrep(self.hash)+" from payload offset "+str(offset), RNS.LOG_DEBUG)
+			self.map_generation += 1
+			self.remapping = True
+			thread = threading.Thread(target=self.__resume_job, args=(offset, self.map_generation))
+			thread.setDaemon(True)
+			thread.start()
+
+	def __resume_job(self, offset, generation):
+		try:
+			with self.output_lock:
+				if self.output != self.payload:
+					self.output.close()
+				self.payload_offset = offset
+				self.write_output()
+
+			self.start_map()
+			while not self.mapOutput(1, generation):
+				self.remap()
+
+			with self.map_lock:
+				if self.status == Resource.FAILED or generation != self.map_generation:
+					return
+				self.restart_transfer()
+
+			self.__map_job(generation)
+		except Exception as e:
+			if self.status != Resource.FAILED:
+				RNS.log("Error while resuming resource "+RNS.prettyhexrep(self.hash)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+				self.cancel()
+
+	def get_part(self, index):
+		return self.get_parts(index, index+1)
+
+	def get_parts(self, start, end):
+		with self.output_lock:
+			self.output.seek(self.output_start + start*self.sdu)
+			return self.output.read((end-start)*self.sdu)
+
+	# Finds the index of a requested part. The receiver
+	# only requests parts within a collision guard
+	# window after its first missing part, so given the
+	# last part it requested, the part must be within
+	# the indexed window.
+	def find_part(self, map_hash):
+		return self.part_index.get(map_hash)
+
+	def part_map_hash(self, index):
+		if self.initiator:
+			segment, offset = divmod(index, ResourceAdvertisement.HASHMAP_MAX_LEN)
+			return self.hashmap[segment][offset*Resource.MAPHASH_LEN:(offset+1)*Resource.MAPHASH_LEN]
+		else:
+			return self.hashmap[index]
+
+	# Moves the window of parts that can currently be
+	# requested or received, and updates the index from
+	# map hashes to part indices for the parts entering
+	# and leaving it. Map hashes are unique within the
+	# window, so the index is a plain dict.
+	def index_window(self):
+		guard_size = ResourceAdvertisement.COLLISION_GUARD_SIZE
+		if self.initiator:
+			start = max(self.last_requested_part - guard_size, 0)
+			end = min(self.last_requested_part + 2*guard_size + 1, self.total_parts, len(self.hashmap)*ResourceAdvertisement.HASHMAP_MAX_LEN)
+		else:
+			start = self.consecutive_completed_height
+			end = min(start + guard_size, self.hashmap_height)
+		end = max(start, end)
+
+		old_start = self.part_index_start
+		old_end = self.part_index_end
+		for i in range(old_start, min(old_end, start)) + range(max(old_start, end), old_end):
+			del self.part_index[self.part_map_hash(i)]
+		for i in range(start, min(end, old_start)) + range(max(start, old_end), end):
+			self.part_index[self.part_map_hash(i)] = i
+
+		self.part_index_start = start
+		self.part_index_end = end
+
+	def release_output(self):
+		if self.initiator:
+			if self.output != self.payload:
+				self.output.close()
+			if self.payload != self.source:
+				self.payload.close()
+
 	def hashmap_update_packet(self, plaintext):
 		if not self.status == Resource.FAILED:
 			self.last_activity = time.time()
@@ -172,134 +731,162 @@ class Resource:
 					self.hashmap_height += 1
 				self.hashmap[i+segment*seg_len] = hashmap[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
 
+			self.index_window()
 			self.waiting_for_hmu = False
 			self.request_next()
 
 	def getMapHash(self, data):
 		return RNS.Identity.fullHash(data+self.random_hash)[:Resource.MAPHASH_LEN]
 
+	# Queues the resource on the link, which sends the
+	# advertisement once it has assigned the resource
+	# an id
 	def advertise(self):
-		thread = threading.Thread(target=self.__advertise_job)
-		thread.setDaemon(True)
-		thread.start()
+		self.status = Resource.QUEUED
+		self.link.queue_outgoing_resource(self)
 
-	def __advertise_job(self):
+	def send_advertisement(self):
 		data = ResourceAdvertisement(self).pack()
 		self.advertisement_packet = RNS.Packet(self.link, data, context=RNS.Packet.RESOURCE_ADV)
-		while not self.link.ready_for_new_resource():
-			self.status = Resource.QUEUED
-			sleep(0.25)
-
-		self.advertisement_packet.send()
 		self.last_activity = time.time()
 		self.adv_sent = self.last_activity
 		self.rtt = None
 		self.status = Resource.ADVERTISED
-		self.link.register_outgoing_resource(self)
+		self.advertisement_packet.send()
 
 		self.watchdog_job()
 
 	def watchdog_job(self):
-		thread = threading.Thread(target=self.__watchdog_job)
-		thread.setDaemon(True)
-		thread.start()
-
-	def __watchdog_job(self):
 		self.__watchdog_job_id += 1
 		this_job_id = self.__watchdog_job_id
+		RNS.Transport.schedule(0, lambda: self.__watchdog_job(this_job_id))
 
-		while self.status < Resource.ASSEMBLING and this_job_id == self.__watchdog_job_id:
-			while self.watchdog_lock:
-				sleep(0.025)
+	def __watchdog_job(self, this_job_id):
+		if self.status >= Resource.ASSEMBLING or this_job_id != self.__watchdog_job_id:
+			return
 
-			sleep_time = None
+		if self.watchdog_lock or self.remapping:
+			RNS.Transport.schedule(0.025, lambda: self.__watchdog_job(this_job_id))
+			return
 
-			if self.status == Resource.ADVERTISED:
-				sleep_time = (self.adv_sent+self.default_timeout)-time.time()
-				if sleep_time < 0:
-					if self.retries_left <= 0:
-						RNS.log("Resource transfer timeout after sending advertisement", RNS.LOG_DEBUG)
-						self.cancel()
-						sleep_time = 0.001
-					else:
-						RNS.log("No part requests received, retrying resource advertisement...", RNS.LOG_DEBUG)
-						self.retries_left -= 1
-						self.advertisement_packet.resend()
-						self.last_activity = time.time()
-						self.adv_sent = self.last_activity
-						sleep_time = 0.001
-					
+		sleep_time = None
 
-			elif self.status == Resource.TRANSFERRING:
-				if not self.initiator:
-					rtt = self.link.rtt if self.rtt == None else self.rtt
-					sleep_time = self.last_activity + (rtt*self.timeout_factor) + Resource.RETRY_GRACE_TIME - time.time()
+		if self.status == Resource.ADVERTISED:
+			sleep_time = (self.adv_sent+self.default_timeout)-time.time()
+			if sleep_time < 0:
+				if self.retries_left <= 0:
+					RNS.log("Resource transfer timeout after sending advertisement", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
+				else:
+					RNS.log("No part requests received, retrying resource advertisement...", RNS.LOG_DEBUG)
+					self.retries_left -= 1
+					self.advertisement_packet.resend()
+					self.last_activity = time.time()
+					self.adv_sent = self.last_activity
+					sleep_time = 0.001
+				
 
-					if sleep_time < 0:
-						if self.retries_left > 0:
-							RNS.log("Timeout waiting for parts, requesting retry", RNS.LOG_DEBUG)
-							sleep_time = 0.001
-							self.retries_left -= 1
-							self.waiting_for_hmu = False
-							self.request_next()
-						else:
-							self.cancel()
-							sleep_time = 0.001
+		elif self.status == Resource.TRANSFERRING:
+			if not self.initiator:
+				rtt = self.link.rtt if self.rtt == None else self.rtt
+				if self.resuming:
+					# The sender has to write and map the rest
+					# of the payload before it can respond
+					sleep_time = self.last_activity + self.default_timeout - time.time()
 				else:
-					max_wait = self.rtt * self.timeout_factor * self.max_retries + self.sender_grace_time
-					sleep_time = self.last_activity + max_wait - time.time()
-					if sleep_time < 0:
-						RNS.log("Resource timed out waiting for part requests", RNS.LOG_DEBUG)
-						self.cancel()
-						sleep_time = 0.001
+					sleep_time = self.last_activity + (rtt*self.timeout_factor) + Resource.RETRY_GRACE_TIME - time.time()
 
-			elif self.status == Resource.AWAITING_PROOF:
-				sleep_time = self.last_part_sent + (self.rtt*self.timeout_factor+self.sender_grace_time) - time.time()
 				if sleep_time < 0:
-					if self.retries_left <= 0:
-						RNS.log("Resource timed out waiting for proof", RNS.LOG_DEBUG)
-						self.cancel()
+					if self.retries_left > 0:
+						RNS.log("Timeout waiting for parts, requesting retry", RNS.LOG_DEBUG)
 						sleep_time = 0.001
-					else:
-						RNS.log("All parts sent, but no resource proof received, querying network cache...", RNS.LOG_DEBUG)
 						self.retries_left -= 1
-						expected_data = self.hash + self.expected_proof
-						expected_proof_packet = RNS.Packet(self.link, expected_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.RESOURCE_PRF)
-						expected_proof_packet.pack()
-						RNS.Transport.cache_request(expected_proof_packet.packet_hash)
-						self.last_part_sent = time.time()
+						self.window_timed_out()
+						self.waiting_for_hmu = False
+						self.request_next()
+					else:
+						self.cancel()
 						sleep_time = 0.001
+			else:
+				max_wait = self.rtt * self.timeout_factor * self.max_retries + self.sender_grace_time
+				sleep_time = self.last_activity + max_wait - time.time()
+				if sleep_time < 0:
+					RNS.log("Resource timed out waiting for part requests", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
 
-			if sleep_time == 0:
-				RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_WARNING)
-			if sleep_time == None or sleep_time < 0:
-				# TODO: This should probably not be here forever
-				RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
-				RNS.panic()
-
-			sleep(sleep_time)
+		elif self.status == Resource.AWAITING_PROOF:
+			sleep_time = self.last_part_sent + (self.rtt*self.timeout_factor+self.sender_grace_time) - time.time()
+			if sleep_time < 0:
+				if self.retries_left <= 0:
+					RNS.log("Resource timed out waiting for proof", RNS.LOG_DEBUG)
+					self.cancel()
+					sleep_time = 0.001
+				else:
+					RNS.log("All parts sent, but no resource proof received, querying network cache...", RNS.LOG_DEBUG)
+					self.retries_left -= 1
+					expected_data = self.hash + self.expected_proof
+					expected_proof_packet = RNS.Packet(self.link, expected_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.RESOURCE_PRF)
+					expected_proof_packet.pack()
+					RNS.Transport.cache_request(expected_proof_packet.packet_hash)
+					self.last_part_sent = time.time()
+					sleep_time = 0.001
+
+		if sleep_time == 0:
+			RNS.log("Warning! Link watchdog sleep time of 0!", RNS.LOG_WARNING)
+		if sleep_time == None or sleep_time < 0:
+			# TODO: This should probably not be here forever
+			RNS.log("Timing error! Closing Reticulum now.", RNS.LOG_CRITICAL)
+			RNS.panic()
+
+		RNS.Transport.schedule(sleep_time, lambda: self.__watchdog_job(this_job_id))
 
 	def assemble(self):
 		if not self.status == Resource.FAILED:
 			try:
 				self.status = Resource.ASSEMBLING
-				stream = ""
-				for part in self.parts:
-					stream += part
 
+				# The received data is decrypted, decompressed
+				# and hashed in one pass over the spooled parts.
+				# The hash for the proof is calculated alongside
+				# the hash that verifies the data.
 				if self.encrypted:
-					data = self.link.decrypt(stream)
-				else:
-					data = stream
-
-				if self.compressed:
-					self.data = bz2.decompress(data)
+					chunks = self.link.decrypt_stream(self.received_data, Resource.CHUNK_SIZE)
 				else:
+					self.received_data.seek(0)
+					chunks = self.read_chunks(self.received_data)
+
+				if self.payload_offset > 0:
+					chunks = itertools.chain(self.read_partial(), chunks)
+				if self.chunked:
+					chunks = self.decompress_blocks(chunks)
+				decompressor = Resource.codecs[self.compression].decompressor() if self.compressed and not self.chunked else None
+				data_hash = hashes.Hash(hashes.SHA256(), backend=default_backend())
+				proof_hash = hashes.Hash(hashes.SHA256(), backend=default_backend())
+				data = SpooledTemporaryFile(Resource.SPOOL_SIZE)
+				for chunk in chunks:
+					if decompressor != None:
+						chunk = decompressor.decompress(chunk)
+					data_hash.update(chunk)
+					proof_hash.update(chunk)
+					data.write(chunk)
+				if decompressor != None and hasattr(decompressor, "flush"):
+					data.write(decompressor.flush())
+
+				self.received_data.close()
+				data_hash.update(self.random_hash)
+				proof_hash.update(self.hash)
+				self.proof = proof_hash.finalize()
+
+				data.seek(0)
+				if self.link.resource_spooling:
 					self.data = data
+				else:
+					self.data = data.read()
+					data.close()
 
-				calculated_hash = RNS.Identity.fullHash(self.data+self.random_hash)
-
-				if calculated_hash == self.hash:
+				if data_hash.finalize() == self.hash:
 					self.status = Resource.COMPLETE
 					self.prove()
 				else:
@@ -309,6 +896,10 @@ class Resource:
 				RNS.log("Error while assembling received resource.", RNS.LOG_ERROR)
 				RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
 				self.status = Resource.CORRUPT
+				self.received_data.close()
+
+			if self.resumable:
+				self.remove_partial()
 
 			if self.callback != None:
 				self.link.resource_concluded(self)
@@ -317,8 +908,7 @@ class Resource:
 
 	def prove(self):
 		if not self.status == Resource.FAILED:
-			proof = RNS.Identity.fullHash(self.data+self.hash)
-			proof_data = self.hash+proof
+			proof_data = self.hash+self.proof
 			proof_packet = RNS.Packet(self.link, proof_data, packet_type=RNS.Packet.PROOF, context=RNS.Packet.RESOURCE_PRF)
 			proof_packet.send()
 
@@ -327,6 +917,7 @@ class Resource:
 			if len(proof_data) == RNS.Identity.HASHLENGTH/8*2:
 				if proof_data[RNS.Identity.HASHLENGTH/8:] == self.expected_proof:
 					self.status = Resource.COMPLETE
+					self.release_output()
 					if self.callback != None:
 						self.link.resource_concluded(self)
 						self.callback(self)
@@ -337,6 +928,16 @@ class Resource:
 
 
 	def receive_part(self, packet):
+		# Parts are only requested within the collision
+		# guard window after the first missing part, so
+		# the map hash is looked up in that window only.
+		# Resource parts are not filtered as duplicate
+		# packets, so repeated parts are dropped here.
+		part_data = packet.data[Resource.ID_LEN:]
+		i = self.part_index.get(self.getMapHash(part_data))
+		if i == None or self.part_received[i]:
+			return
+
 		self.last_activity = time.time()
 		self.retries_left = self.max_retries
 
@@ -351,17 +952,7 @@ class Resource:
 
 		if not self.status == Resource.FAILED:
 			self.status = Resource.TRANSFERRING
-			part_data = packet.data
-			part_hash = self.getMapHash(part_data)
-
-			i = 0
-			for map_hash in self.hashmap:
-				if map_hash == part_hash:
-					if self.parts[i] == None:
-						self.parts[i] = part_data
-						self.received_count += 1
-						self.outstanding_parts -= 1
-				i += 1
+			self.store_part(i, part_data)
 
 			if self.__progress_callback != None:
 				self.__progress_callback(self)
@@ -369,51 +960,436 @@ class Resource:
 			if self.outstanding_parts == 0 and self.received_count == self.total_parts:
 				self.assemble()
 			elif self.outstanding_parts == 0:
-				if self.window < Resource.WINDOW_MAX:
-					self.window += 1
+				self.window_completed()
 				self.request_next()
+			elif i == self.request_end and not self.repairs_pending():
+				# Parts are sent in the order they were
+				# requested, so if the last one arrives
+				# while others are missing, those were
+				# lost. They are requested again right
+				# away instead of after a timeout, unless
+				# the repair parts still to come can
+				# restore them.
+				self.request_next()
+
+	def store_part(self, index, part_data):
+		self.received_data.seek(index*self.sdu)
+		self.received_data.write(part_data)
+		self.part_received[index] = 1
+		self.received_count += 1
+		self.outstanding_parts -= 1
+
+		while self.consecutive_completed_height < self.total_parts and self.part_received[self.consecutive_completed_height]:
+			self.consecutive_completed_height += 1
+		self.index_window()
+
+	# Returns the range of part indexes in a block of
+	# the forward error correction
+	def fec_block_range(self, block):
+		start = block*Resource.FEC_BLOCK_SIZE
+		return start, min(start+Resource.FEC_BLOCK_SIZE, self.total_parts)
+
+	# Returns whether the repair parts that follow the
+	# current request can restore all parts of it that
+	# are missing
+	def repairs_pending(self):
+		missing = {}
+		for pn in range(self.consecutive_completed_height, self.request_end+1):
+			if not self.part_received[pn]:
+				block = pn/Resource.FEC_BLOCK_SIZE
+				if not block in self.fec_pending:
+					return False
+				missing[block] = missing.get(block, 0)+1
+
+		return len(missing) > 0 and max(missing.values()) <= self.fec
+
+	# Called on incoming resource when a repair part
+	# arrives. Repair parts are sent after the parts of
+	# the request that completed their blocks, so once
+	# the last one has arrived, any parts still missing
+	# were lost.
+	def receive_repair(self, packet):
+		self.last_activity = time.time()
+		self.retries_left = self.max_retries
+
+		if self.status == Resource.TRANSFERRING and self.fec > 0:
+			header = packet.data[Resource.ID_LEN:Resource.ID_LEN+Resource.FEC_HEADER_LEN]
+			repair = packet.data[Resource.ID_LEN+Resource.FEC_HEADER_LEN:]
+			if len(header) < Resource.FEC_HEADER_LEN or len(repair) != self.sdu:
+				return
+			block, row = struct.unpack("!HB", header)
+			if block >= self.fec_blocks or row >= self.fec:
+				return
+
+			restored = self.restore_block(block, row, repair)
+			if restored and self.__progress_callback != None:
+				self.__progress_callback(self)
+
+			if restored and self.outstanding_parts == 0 and self.received_count == self.total_parts:
+				self.assemble()
+			elif restored and self.outstanding_parts == 0:
+				self.window_completed()
+				self.request_next()
+			elif len(self.fec_pending) > 0 and block == self.fec_pending[-1] and row == self.fec-1:
+				self.fec_pending = []
+				if self.outstanding_parts > 0:
+					self.request_next()
+
+	# Keeps a repair part for a block, and restores the
+	# missing parts of the block once there are as many
+	# repair parts as missing parts. Restored parts are
+	# checked against the hashmap like received parts.
+	# Returns whether parts were restored.
+	def restore_block(self, block, row, repair):
+		start, end = self.fec_block_range(block)
+		missing = [pn for pn in range(start, end) if not self.part_received[pn]]
+		if len(missing) == 0:
+			self.fec_repairs.pop(block, None)
+			return False
+
+		repairs = self.fec_repairs.setdefault(block, {})
+		repairs[row] = repair
+		if len(repairs) < len(missing) or None in [self.hashmap[pn] for pn in missing]:
+			return False
+
+		self.received_data.seek(start*self.sdu)
+		data = self.received_data.read((end-start)*self.sdu)
+		parts = {}
+		for pn in range(start, end):
+			if self.part_received[pn]:
+				offset = (pn-start)*self.sdu
+				parts[pn-start] = data[offset:offset+self.sdu].ljust(self.sdu, "\x00")
+
+		restored = ErasureCode.decode(parts, repairs, [pn-start for pn in missing])
+		del self.fec_repairs[block]
+
+		restored_parts = []
+		for pn in missing:
+			part_data = restored[pn-start][:self.size-pn*self.sdu]
+			if self.getMapHash(part_data) != self.hashmap[pn]:
+				RNS.log("Restored part "+str(pn)+" of resource "+RNS.prettyhexrep(self.hash)+" does not match the hashmap", RNS.LOG_DEBUG)
+				return False
+			restored_parts.append((pn, part_data))
+
+		for pn, part_data in restored_parts:
+			self.store_part(pn, part_data)
+
+		return True
+
+	# Called on incoming resource when all parts of a
+	# request have arrived. Like TCP slow start, the
+	# window doubles until windows stop completing
+	# faster, and grows by one part per window after
+	# that. Windows are timed from the request, so the
+	# rate includes the round trip time.
+	def window_completed(self):
+		rate = self.window_requested / max(time.time()-self.req_sent, 0.001)
+		if self.window_requested >= self.window:
+			if self.window < self.window_threshold:
+				if self.window_rate == None or rate >= self.window_rate*Resource.WINDOW_RATE_GAIN:
+					self.window = min(self.window*2, self.window_threshold)
+				else:
+					self.window_threshold = self.window
+			elif self.window < self.window_max:
+				self.window += 1
+
+		self.window_rate = rate
+
+	# Called on incoming resource when parts are lost.
+	# The window is halved, and grows linearly again
+	# from there.
+	def window_timed_out(self):
+		self.window = max(self.window/2, Resource.WINDOW_MIN)
+		self.window_threshold = self.window
+		self.window_rate = None
 
 	# Called on incoming resource to send a request for more data
 	def request_next(self):
 		if not self.status == Resource.FAILED:
-			if not self.waiting_for_hmu:
-				self.outstanding_parts = 0
-				hashmap_exhausted = Resource.HASHMAP_IS_NOT_EXHAUSTED
-				requested_hashes = ""
-
-				i = 0; pn = 0
-				for part in self.parts:
-					
-					if part == None:
-						part_hash = self.hashmap[pn]
-						if part_hash != None:
-							requested_hashes += part_hash
-							self.outstanding_parts += 1
-							i += 1
+			if self.resuming:
+				if self.retries_left < self.max_retries-1:
+					# The sender did not resume the transfer,
+					# so it is started from the beginning
+					self.resuming = False
+					self.remove_partial()
+					self.hashmap_update(0, self.hashmap_raw)
+				else:
+					self.send_resume_request()
+			elif not self.waiting_for_hmu:
+				hashmap_exhausted = False
+				requested_parts = []
+
+				guard_end = min(self.consecutive_completed_height+ResourceAdvertisement.COLLISION_GUARD_SIZE, self.total_parts)
+				for pn in range(self.consecutive_completed_height, guard_end):
+					if not self.part_received[pn]:
+						if self.hashmap[pn] != None:
+							requested_parts.append(pn)
 						else:
-							hashmap_exhausted = Resource.HASHMAP_IS_EXHAUSTED
+							hashmap_exhausted = True
 
-					pn += 1
-					if i >= self.window or hashmap_exhausted == Resource.HASHMAP_IS_EXHAUSTED:
+					if len(requested_parts) >= self.window or hashmap_exhausted:
 						break
 
-				hmu_part = chr(hashmap_exhausted)
-				if hashmap_exhausted == Resource.HASHMAP_IS_EXHAUSTED:
+				if self.fec > 0 and not hashmap_exhausted and len(requested_parts) > 0:
+					requested_parts = self.align_request(requested_parts, guard_end)
+
+				self.outstanding_parts = len(requested_parts)
+				self.request_end = requested_parts[-1] if len(requested_parts) > 0 else None
+
+				# The sender follows the parts with repair
+				# parts for the blocks this request completes
+				# for the first time
+				self.fec_pending = []
+				while self.fec > 0 and self.request_end != None and self.fec_height < self.fec_blocks:
+					if self.fec_block_range(self.fec_height)[1]-1 > self.request_end:
+						break
+					self.fec_pending.append(self.fec_height)
+					self.fec_height += 1
+
+				if len(requested_parts) > 0 and 4+(self.request_end-requested_parts[0])/8+1 < len(requested_parts)*Resource.MAPHASH_LEN:
+					request_flag = Resource.BITMAP_HASHMAP_IS_EXHAUSTED if hashmap_exhausted else Resource.BITMAP_HASHMAP_IS_NOT_EXHAUSTED
+					requested = Resource.packBitmap(requested_parts)
+				else:
+					request_flag = Resource.HASHMAP_IS_EXHAUSTED if hashmap_exhausted else Resource.HASHMAP_IS_NOT_EXHAUSTED
+					requested = "".join([self.hashmap[pn] for pn in requested_parts])
+
+				hmu_part = chr(request_flag)
+				if hashmap_exhausted:
 					last_map_hash = self.hashmap[self.hashmap_height-1]
 					hmu_part += last_map_hash
 					self.waiting_for_hmu = True
 
-				request_data = hmu_part + self.hash + requested_hashes
+				request_data = hmu_part + self.hash + requested
 				request_packet = RNS.Packet(self.link, request_data, context = RNS.Packet.RESOURCE_REQ)
 
 				request_packet.send()
 				self.last_activity = time.time()
 				self.req_sent = self.last_activity
 				self.req_resp = None
+				self.window_requested = self.outstanding_parts
+
+	# With forward error correction, requests are made
+	# to end with a block where possible, so that the
+	# repair parts for it follow right after the parts.
+	# The request is shortened or extended to the
+	# nearest block boundary, by at most half a block.
+	def align_request(self, requested_parts, guard_end):
+		end = requested_parts[-1]+1
+		boundary = end-end%Resource.FEC_BLOCK_SIZE
+		if end == boundary or end == self.total_parts:
+			return requested_parts
+
+		if end-boundary < Resource.FEC_BLOCK_SIZE/2 and requested_parts[0] < boundary:
+			return [pn for pn in requested_parts if pn < boundary]
+
+		limit = min(boundary+Resource.FEC_BLOCK_SIZE, self.total_parts)
+		if limit <= guard_end and not None in self.hashmap[end:limit]:
+			return requested_parts+[pn for pn in range(end, limit) if not self.part_received[pn]]
+
+		return requested_parts
+
+	# Called on incoming resource. If the payload of
+	# this resource was partially received on an
+	# earlier link, the sender is asked to resume the
+	# transfer after it.
+	def request_resume(self):
+		if self.resumable and self.link.resource_resumable:
+			partial_length = self.load_partial()
+			if partial_length > 0:
+				RNS.log("Requesting resume of resource "+RNS.prettyhexrep(self.hash)+" from payload offset "+str(partial_length), RNS.LOG_DEBUG)
+				self.partial_length = partial_length
+				self.resuming = True
+				self.send_resume_request()
+				return True
+
+		return False
+
+	def send_resume_request(self):
+		request_data = chr(Resource.RESUME_FROM_OFFSET) + self.hash + struct.pack("!Q", self.partial_length)
+		request_packet = RNS.Packet(self.link, request_data, context = RNS.Packet.RESOURCE_REQ)
+
+		request_packet.send()
+		self.last_activity = time.time()
+		self.req_sent = self.last_activity
+		self.req_resp = None
+
+	@staticmethod
+	def partialPath(name):
+		return RNS.Reticulum.cachepath+"/resources/"+name
+
+	# Returns the length of the saved payload of this
+	# resource, or 0 if there is none that matches it.
+	# Partials older than PARTIAL_TIMEOUT are removed
+	# instead of resumed.
+	def load_partial(self):
+		try:
+			path = Resource.partialPath(self.partial_name)
+			if os.path.isfile(path) and os.path.getmtime(path) < time.time() - Resource.PARTIAL_TIMEOUT:
+				RNS.log("Partial resource "+RNS.prettyhexrep(self.hash)+" has expired", RNS.LOG_DEBUG)
+				self.remove_partial()
+			elif os.path.isfile(path) and os.path.isfile(path+".meta"):
+				file = open(path+".meta", "rb")
+				meta = umsgpack.unpackb(file.read())
+				file.close()
+
+				if meta["d"] == self.uncompressed_size and meta["z"] == self.compression and meta["b"] == self.chunked:
+					if os.path.getsize(path) >= meta["l"]:
+						return meta["l"]
+		except Exception as e:
+			RNS.log("Could not load partial resource "+RNS.prettyhexrep(self.hash)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+		return 0
+
+	# Called on incoming resource when a resumable
+	# transfer fails. The payload received in order so
+	# far is saved to the cache, so a later transfer of
+	# the same resource can resume after it.
+	def save_partial(self):
+		if not self.resumable or not self.link.resource_resumable:
+			return
+
+		try:
+			received_length = min(self.consecutive_completed_height*self.sdu, self.size)
+			if self.encrypted:
+				# The last cipher block holds the padding,
+				# and is only decrypted at assembly
+				received_length = min(received_length, self.size-Resource.TOKEN_TAIL)
+				chunks = self.link.decrypt_stream_prefix(self.received_data, received_length, Resource.CHUNK_SIZE)
+			else:
+				self.received_data.seek(0)
+				chunks = self.read_prefix(self.received_data, received_length)
+
+			path = Resource.partialPath(self.partial_name)
+			if not os.path.isdir(os.path.dirname(path)):
+				os.makedirs(os.path.dirname(path))
+
+			partial = open(path+".tmp", "wb")
+			for chunk in itertools.chain(self.read_partial() if self.payload_offset > 0 else [], chunks):
+				partial.write(chunk)
+			partial_length = partial.tell()
+			partial.close()
+
+			if partial_length > self.payload_offset:
+				meta = {"d": self.uncompressed_size, "z": self.compression, "b": self.chunked, "l": partial_length}
+				file = open(path+".meta", "wb")
+				file.write(umsgpack.packb(meta))
+				file.close()
+				os.rename(path+".tmp", path)
+				RNS.log("Saved "+str(partial_length)+" bytes of partial resource "+RNS.prettyhexrep(self.hash), RNS.LOG_DEBUG)
+			else:
+				os.unlink(path+".tmp")
+		except Exception as e:
+			RNS.log("Could not save partial resource "+RNS.prettyhexrep(self.hash)+". The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+		Resource.cleanPartials()
+
+	def read_partial(self):
+		partial = open(Resource.partialPath(self.partial_name), "rb")
+		try:
+			for chunk in self.read_prefix(partial, self.payload_offset):
+				yield chunk
+		finally:
+			partial.close()
+
+	# Reads length bytes from the current position of
+	# the stream in chunks
+	def read_prefix(self, stream, length):
+		remaining = length
+		while remaining > 0:
+			chunk = stream.read(min(Resource.CHUNK_SIZE, remaining))
+			if chunk == "":
+				raise ValueError("Stream ended before the expected length")
+			remaining -= len(chunk)
+			yield chunk
+
+	def remove_partial(self):
+		path = Resource.partialPath(self.partial_name)
+		for file in [path, path+".meta"]:
+			if os.path.isfile(file):
+				os.unlink(file)
+
+	# Removes partial resources that have not been
+	# resumed within PARTIAL_TIMEOUT
+	@staticmethod
+	def cleanPartials():
+		try:
+			partial_dir = os.path.dirname(Resource.partialPath(""))
+			if os.path.isdir(partial_dir):
+				expiry = time.time() - Resource.PARTIAL_TIMEOUT
+				for name in os.listdir(partial_dir):
+					path = partial_dir+"/"+name
+					if os.path.getmtime(path) < expiry:
+						os.unlink(path)
+		except Exception as e:
+			RNS.log("Error while cleaning partial resources. The contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def requestExhausted(request_flag):
+		return request_flag == Resource.HASHMAP_IS_EXHAUSTED or request_flag == Resource.BITMAP_HASHMAP_IS_EXHAUSTED
+
+	# Returns the hash of the resource that a request
+	# is for
+	@staticmethod
+	def requestHash(request_data):
+		pad = 1+Resource.MAPHASH_LEN if Resource.requestExhausted(ord(request_data[0])) else 1
+		return request_data[pad:pad+RNS.Identity.HASHLENGTH/8]
+
+	# Packs a sorted list of part indexes as the first
+	# index, followed by a bitmap of the parts from it
+	@staticmethod
+	def packBitmap(part_indexes):
+		start = part_indexes[0]
+		bitmap = bytearray((part_indexes[-1]-start)/8+1)
+		for pn in part_indexes:
+			offset = pn-start
+			bitmap[offset >> 3] |= 0x80 >> (offset & 0x07)
+		return struct.pack("!I", start)+str(bitmap)
+
+	@staticmethod
+	def unpackBitmap(data):
+		start = struct.unpack("!I", data[:4])[0]
+		bitmap = bytearray(data[4:])
+		part_indexes = []
+		for i in xrange(0, len(bitmap)):
+			if bitmap[i]:
+				for bit in xrange(0, 8):
+					if bitmap[i] & (0x80 >> bit):
+						part_indexes.append(start+i*8+bit)
+		return part_indexes
+
+	# Called on outgoing resource after answering a
+	# request. Repair parts are sent for every block up
+	# to the last requested part that has not had them
+	# yet. Returns the last packet sent.
+	def send_repair_parts(self, last_part):
+		packet = None
+		while self.fec_height < self.fec_blocks:
+			start, end = self.fec_block_range(self.fec_height)
+			if end-1 > last_part:
+				break
+
+			data = self.get_parts(start, end)
+			parts = [data[i*self.sdu:(i+1)*self.sdu].ljust(self.sdu, "\x00") for i in range(end-start)]
+			for row, repair in enumerate(ErasureCode.encode(parts, self.fec)):
+				header = chr(self.id)+struct.pack("!HB", self.fec_height, row)
+				packet = RNS.Packet(self.link, header+repair, context=RNS.Packet.RESOURCE_FEC)
+				packet.send()
+			self.fec_height += 1
+
+		return packet
 
 	# Called on outgoing resource to make it send more data
 	def request(self, request_data):
-		if not self.status == Resource.FAILED:
+		with self.map_lock:
+			self.__request(request_data)
+
+	def __request(self, request_data):
+		if not self.status == Resource.FAILED and not self.remapping:
+			if ord(request_data[0]) == Resource.RESUME_FROM_OFFSET:
+				offset_start = 1+RNS.Identity.HASHLENGTH/8
+				self.resume(struct.unpack("!Q", request_data[offset_start:offset_start+8])[0])
+				return
+
 			rtt = time.time() - self.adv_sent
 			if self.rtt == None:
 				self.rtt = rtt
@@ -424,68 +1400,103 @@ class Resource:
 
 			self.retries_left = self.max_retries
 
-			wants_more_hashmap = True if ord(request_data[0]) == Resource.HASHMAP_IS_EXHAUSTED else False
+			request_flag = ord(request_data[0])
+			wants_more_hashmap = Resource.requestExhausted(request_flag)
 			pad = 1+Resource.MAPHASH_LEN if wants_more_hashmap else 1
 
-			requested_hashes = request_data[pad+RNS.Identity.HASHLENGTH/8:]
+			requested = request_data[pad+RNS.Identity.HASHLENGTH/8:]
 
-			for i in range(0,len(requested_hashes)/Resource.MAPHASH_LEN):
-				requested_hash = requested_hashes[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
-				
-				pi = 0
-				for part in self.parts:
-					if part.map_hash == requested_hash:
-						if not part.sent:
-							part.send()
-							self.sent_parts += 1
-						else:
-							part.resend()
-						self.last_activity = time.time()
-						self.last_part_sent = self.last_activity
-						break
-					pi += 1
+			# Segments mapped since the last request are
+			# added to the index
+			self.index_window()
 
+			if request_flag == Resource.BITMAP_HASHMAP_IS_EXHAUSTED or request_flag == Resource.BITMAP_HASHMAP_IS_NOT_EXHAUSTED:
+				mapped_parts = min(len(self.hashmap)*ResourceAdvertisement.HASHMAP_MAX_LEN, self.total_parts)
+				requested_parts = [pn for pn in Resource.unpackBitmap(requested) if pn < mapped_parts]
+			else:
+				requested_parts = []
+				for i in range(0,len(requested)/Resource.MAPHASH_LEN):
+					requested_hash = requested[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
+					part_index = self.find_part(requested_hash)
+					if part_index != None:
+						requested_parts.append(part_index)
+
+			# The last map hash must be looked up before
+			# the search window moves on
 			if wants_more_hashmap:
 				last_map_hash = request_data[1:Resource.MAPHASH_LEN+1]
-				
-				part_index = 0
-				for part in self.parts:
-					part_index += 1
-					if part.map_hash == last_map_hash:
-						break
+				last_part_index = self.find_part(last_map_hash)
+
+			part = None
+			for part_index in requested_parts:
+				part = RNS.Packet(self.link, chr(self.id)+self.get_part(part_index), context=RNS.Packet.RESOURCE)
+				part.send()
+				if not self.part_sent[part_index]:
+					self.part_sent[part_index] = 1
+					self.sent_parts += 1
+				else:
+					self.parts_lost = True
+				self.last_activity = time.time()
+				self.last_part_sent = self.last_activity
+
+			if self.fec > 0 and len(requested_parts) > 0:
+				repair = self.send_repair_parts(max(requested_parts))
+				if repair != None:
+					part = repair
 
-				if part_index % ResourceAdvertisement.HASHMAP_MAX_LEN != 0:
+			# The receiver only finds lost parts early if
+			# the last packet of the response arrives, so
+			# once parts are being lost, or when the
+			# resource is sent with forward error
+			# correction, it is sent twice
+			if (self.parts_lost or self.fec > 0) and part != None:
+				part.resend()
+
+			if len(requested_parts) > 0:
+				self.last_requested_part = max(requested_parts)
+				self.index_window()
+
+			if wants_more_hashmap:
+				if last_part_index == None or (last_part_index+1) % ResourceAdvertisement.HASHMAP_MAX_LEN != 0:
 					RNS.log("Resource sequencing error, cancelling transfer!", RNS.LOG_ERROR)
 					self.cancel()
+					return
 				else:
-					segment = part_index / ResourceAdvertisement.HASHMAP_MAX_LEN
+					segment = (last_part_index+1) / ResourceAdvertisement.HASHMAP_MAX_LEN
 
-				
-				hashmap_start = segment*ResourceAdvertisement.HASHMAP_MAX_LEN
-				hashmap_end   = min((segment+1)*ResourceAdvertisement.HASHMAP_MAX_LEN, len(self.parts))
+				self.send_hashmap_update(segment)
 
-				hashmap = ""
-				for i in range(hashmap_start,hashmap_end):
-					hashmap += self.hashmap[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
+			if self.sent_parts == self.total_parts:
+				self.status = Resource.AWAITING_PROOF
 
-				hmu = self.hash+umsgpack.packb([segment, hashmap])
-				hmu_packet = RNS.Packet(self.link, hmu, context = RNS.Packet.RESOURCE_HMU)
+	# Sends a hashmap segment to the receiver. If the
+	# segment has not been mapped yet, it is sent as
+	# soon as it is.
+	def send_hashmap_update(self, segment):
+		with self.map_lock:
+			if segment >= len(self.hashmap):
+				self.hmu_pending = segment
+				return
 
-				hmu_packet.send()
-				self.last_activity = time.time()
+			hmu = self.hash+umsgpack.packb([segment, self.hashmap[segment]])
+			hmu_packet = RNS.Packet(self.link, hmu, context = RNS.Packet.RESOURCE_HMU)
 
-			if self.sent_parts == len(self.parts):
-				self.status = Resource.AWAITING_PROOF
+			hmu_packet.send()
+			self.last_activity = time.time()
 
 	def cancel(self):
 		if self.status < Resource.COMPLETE:
+			if not self.initiator and self.status == Resource.TRANSFERRING:
+				self.save_partial()
 			self.status = Resource.FAILED
 			if self.initiator:
+				self.release_output()
 				if self.link.status == RNS.Link.ACTIVE:
 					cancel_packet = RNS.Packet(self.link, self.hash, context=RNS.Packet.RESOURCE_ICL)
 					cancel_packet.send()
 				self.link.cancel_outgoing_resource(self)
 			else:
+				self.received_data.close()
 				self.link.cancel_incoming_resource(self)
 			
 			if self.callback != None:
@@ -507,31 +1518,40 @@ class ResourceAdvertisement:
 	# TODO: Can this be allocated dynamically? Keep in mind hashmap_update inference
 	HASHMAP_MAX_LEN = 84
 
+	# The receiver only requests and accepts parts in
+	# a window of this many parts after its first
+	# missing part, so map hashes need only be unique
+	# within a few multiples of this distance
+	COLLISION_GUARD_SIZE = 2*Resource.WINDOW_MAX+HASHMAP_MAX_LEN
+
 	def __init__(self, resource=None):
 		if resource != None:
 			self.t = resource.size 				  # Transfer size
 			self.d = resource.uncompressed_size   # Data size
-			self.n = len(resource.parts) 		  # Number of parts
+			self.n = resource.total_parts 		  # Number of parts
 			self.h = resource.hash 				  # Resource hash
+			self.i = resource.id 				  # Resource id on the link
 			self.r = resource.random_hash		  # Resource random hash
-			self.m = resource.hashmap			  # Resource hashmap
+			self.m = resource.hashmap			  # Resource hashmap segments
 			self.c = resource.compressed   		  # Compression flag
+			self.z = resource.compression  		  # Compression codec
+			self.b = resource.chunked      		  # Compressed in blocks
+			self.x = resource.restarted    		  # Restarted transfer
+			self.p = resource.resumable    		  # Resumable flag
+			self.s = resource.payload_offset > 0  # Resumed after the requested offset
 			self.e = resource.encrypted    		  # Encryption flag
-			self.f  = 0x00 | self.c << 1 | self.e # Flags
+			self.q = resource.fec          		  # Repair parts per FEC block
+			self.f  = 0x00 | self.q << 8 | self.s << 7 | self.p << 6 | self.x << 5 | self.b << 4 | self.z << 1 | self.e # Flags
 
 	def pack(self, segment=0):
-		hashmap_start = segment*ResourceAdvertisement.HASHMAP_MAX_LEN
-		hashmap_end   = min((segment+1)*ResourceAdvertisement.HASHMAP_MAX_LEN, self.n)
-
-		hashmap = ""
-		for i in range(hashmap_start,hashmap_end):
-			hashmap += self.m[i*Resource.MAPHASH_LEN:(i+1)*Resource.MAPHASH_LEN]
+		hashmap = self.m[segment]
 
 		dictionary = {
 			u"t": self.t,
 			u"d": self.d,
 			u"n": self.n,
 			u"h": self.h,
+			u"i": self.i,
 			u"r": self.r,
 			u"f": self.f,
 			u"m": hashmap
@@ -548,10 +1568,180 @@ class ResourceAdvertisement:
 		adv.d = dictionary["d"]
 		adv.n = dictionary["n"]
 		adv.h = dictionary["h"]
+		adv.i = dictionary["i"]
 		adv.r = dictionary["r"]
 		adv.m = dictionary["m"]
 		adv.f = dictionary["f"]
 		adv.e = True if (adv.f & 0x01) == 0x01 else False
-		adv.c = True if ((adv.f >> 1) & 0x01) == 0x01 else False
+		adv.z = (adv.f >> 1) & 0x07
+		adv.c = True if adv.z != Resource.COMPRESSION_NONE else False
+		adv.b = True if ((adv.f >> 4) & 0x01) == 0x01 else False
+		adv.x = True if ((adv.f >> 5) & 0x01) == 0x01 else False
+		adv.p = True if ((adv.f >> 6) & 0x01) == 0x01 else False
+		adv.s = True if ((adv.f >> 7) & 0x01) == 0x01 else False
+		adv.q = (adv.f >> 8) & 0x0F
 
 		return adv
+
+
+# Compress and decompress single blocks of chunked
+# resources. These are module-level functions so that
+# they can be handed to the compression pool.
+def compressBlock(compression, data):
+	compressor = Resource.codecs[compression].compressor()
+	return compressor.compress(data)+compressor.flush()
+
+def decompressBlock(compression, data):
+	decompressor = Resource.codecs[compression].decompressor()
+	data = decompressor.decompress(data)
+	if hasattr(decompressor, "flush"):
+		data += decompressor.flush()
+	return data
+
+class Bz2Codec:
+	@staticmethod
+	def compressor():
+		return bz2.BZ2Compressor()
+
+	@staticmethod
+	def decompressor():
+		return bz2.BZ2Decompressor()
+
+class ZlibCodec:
+	@staticmethod
+	def compressor():
+		return zlib.compressobj()
+
+	@staticmethod
+	def decompressor():
+		return zlib.decompressobj()
+
+class LzmaCodec:
+	@staticmethod
+	def compressor():
+		return lzma.LZMACompressor()
+
+	@staticmethod
+	def decompressor():
+		return lzma.LZMADecompressor()
+
+Resource.codecs = {
+	Resource.COMPRESSION_BZ2: Bz2Codec,
+	Resource.COMPRESSION_ZLIB: ZlibCodec,
+}
+
+if lzma != None:
+	Resource.codecs[Resource.COMPRESSION_LZMA] = LzmaCodec
+
+# Systematic erasure code over GF(2^8) for the forward
+# error correction of resources. Repair parts are the
+# rows of a Cauchy matrix applied to the parts of a
+# block, so the missing parts of a block can be
+# restored from any repair parts, as long as there
+# are as many of them as there are missing parts.
+class ErasureCode:
+	exp    = [0]*512
+	log    = [0]*256
+	tables = {}
+
+	@staticmethod
+	def mul(a, b):
+		if a == 0 or b == 0:
+			return 0
+		return ErasureCode.exp[ErasureCode.log[a]+ErasureCode.log[b]]
+
+	@staticmethod
+	def inverse(a):
+		return ErasureCode.exp[255-ErasureCode.log[a]]
+
+	@staticmethod
+	def coefficient(row, column):
+		return ErasureCode.inverse((Resource.FEC_BLOCK_SIZE+row) ^ column)
+
+	# Returns the data with every byte multiplied by
+	# the coefficient, as an integer, so that parts can
+	# be added with a single xor
+	@staticmethod
+	def scaled(coefficient, data):
+		table = ErasureCode.tables.get(coefficient)
+		if table == None:
+			table = "".join([chr(ErasureCode.mul(coefficient, b)) for b in range(256)])
+			ErasureCode.tables[coefficient] = table
+		return int(binascii.hexlify(data.translate(table)), 16)
+
+	@staticmethod
+	def toPart(value, length):
+		return binascii.unhexlify("%0*x" % (2*length, value))
+
+	# Returns the given number of repair parts for a
+	# block of parts of equal length
+	@staticmethod
+	def encode(parts, repairs):
+		length = len(parts[0])
+		encoded = []
+		for row in range(repairs):
+			value = 0
+			for column in range(len(parts)):
+				value ^= ErasureCode.scaled(ErasureCode.coefficient(row, column), parts[column])
+			encoded.append(ErasureCode.toPart(value, length))
+		return encoded
+
+	# Restores the missing parts of a block from the
+	# parts and repair parts that were received, given
+	# as dicts by index. Returns the restored parts by
+	# index.
+	@staticmethod
+	def decode(parts, repairs, missing):
+		rows = sorted(repairs.keys())[:len(missing)]
+		length = len(repairs[rows[0]])
+		remainders = []
+		for row in rows:
+			value = int(binascii.hexlify(repairs[row]), 16)
+			for column, part in parts.iteritems():
+				value ^= ErasureCode.scaled(ErasureCode.coefficient(row, column), part)
+			remainders.append(ErasureCode.toPart(value, length))
+
+		matrix = ErasureCode.invert([[ErasureCode.coefficient(row, column) for column in missing] for row in rows])
+		restored = {}
+		for i in range(len(missing)):
+			value = 0
+			for j in range(len(rows)):
+				value ^= ErasureCode.scaled(matrix[i][j], remainders[j])
+			restored[missing[i]] = ErasureCode.toPart(value, length)
+		return restored
+
+	# Inverts a square matrix by Gauss-Jordan
+	# elimination. Square submatrices of a Cauchy matrix
+	# are always invertible.
+	@staticmethod
+	def invert(matrix):
+		n = len(matrix)
+		rows = [matrix[i][:]+[1 if i == j else 0 for j in range(n)] for i in range(n)]
+		for column in range(n):
+			pivot = column
+			while rows[pivot][column] == 0:
+				pivot += 1
+			rows[column], rows[pivot] = rows[pivot], rows[column]
+			factor = ErasureCode.inverse(rows[column][column])
+			rows[column] = [ErasureCode.mul(factor, v) for v in rows[column]]
+			for r in range(n):
+				factor = rows[r][column]
+				if r != column and factor != 0:
+					rows[r] = [v ^ ErasureCode.mul(factor, p) for v, p in zip(rows[r], rows[column])]
+		return [row[n:] for row in rows]
+
+	# Builds the exponent and logarithm tables for the
+	# field, with the generator polynomial 0x11D
+	@staticmethod
+	def buildTables():
+		value = 1
+		for i in range(255):
+			ErasureCode.exp[i] = value
+			ErasureCode.log[value] = i
+			value <<= 1
+			if value & 0x100:
+				value ^= 0x11D
+		for i in range(255, 512):
+			ErasureCode.exp[i] = ErasureCode.exp[i-255]
+
+ErasureCode.buildTables()
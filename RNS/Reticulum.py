@@ -41,6 +41,9 @@ class Reticulum:
 
 		Reticulum.__allow_unencrypted = False
 		Reticulum.__use_implicit_proof = True
+		Reticulum.__use_event_loop = False
+		Reticulum.__announce_workers = 1
+		Reticulum.__compression_workers = 1
 
 		if not os.path.isdir(Reticulum.storagepath):
 			os.makedirs(Reticulum.storagepath)
@@ -85,6 +88,21 @@ class Reticulum:
 						Reticulum.__use_implicit_proof = True
 					if value == "false":
 						Reticulum.__use_implicit_proof = False
+				if option == "use_event_loop":
+					if value == "true":
+						Reticulum.__use_event_loop = True
+					if value == "false":
+						Reticulum.__use_event_loop = False
+				if option == "identity_cache_size":
+					RNS.Identity.identity_cache_size = max(int(value), 1)
+				if option == "known_destinations_max":
+					RNS.Identity.known_destinations_max = max(int(value), 1)
+				if option == "known_destinations_max_age":
+					RNS.Identity.known_destinations_max_age = int(value)
+				if option == "announce_workers":
+					Reticulum.__announce_workers = max(int(value), 1)
+				if option == "compression_workers":
+					Reticulum.__compression_workers = max(int(value), 1)
 				if option == "allow_unencrypted":
 					if value == "true":
 						RNS.log("", RNS.LOG_CRITICAL)
@@ -99,18 +117,33 @@ class Reticulum:
 						RNS.log("", RNS.LOG_CRITICAL)
 						Reticulum.__allow_unencrypted = True
 
+		RNS.Transport.startWorkers()
 
 		for name in self.config["interfaces"]:
 			c = self.config["interfaces"][name]
+			interface = None
 			try:
 				if c["type"] == "UdpInterface":
+					tx_rate = float(c["tx_rate"]) if "tx_rate" in c else None
+					tx_burst = int(c["tx_burst"]) if "tx_burst" in c else None
+					tx_queue = int(c["tx_queue"]) if "tx_queue" in c else None
+					rx_buffer = int(c["rx_buffer"]) if "rx_buffer" in c else None
+					rx_queue = int(c["rx_queue"]) if "rx_queue" in c else None
+					rx_workers = int(c["rx_workers"]) if "rx_workers" in c else None
+
 					interface = UdpInterface.UdpInterface(
 						RNS.Transport,
 						name,
 						c["listen_ip"],
 						int(c["listen_port"]),
 						c["forward_ip"],
-						int(c["forward_port"])
+						int(c["forward_port"]),
+						tx_rate,
+						tx_burst,
+						tx_queue,
+						rx_buffer,
+						rx_queue,
+						rx_workers
 					)
 
 					if "outgoing" in c and c["outgoing"].lower() == "true":
@@ -256,6 +289,12 @@ class Reticulum:
 
 					RNS.Transport.interfaces.append(interface)
 
+				if interface != None and "resource_window_max" in c:
+					interface.resource_window_max = int(c["resource_window_max"])
+
+				if interface != None and "resource_fec" in c:
+					interface.resource_fec = max(min(int(c["resource_fec"]), RNS.Resource.FEC_MAX_REPAIR), 0)
+
 			except Exception as e:
 				RNS.log("The interface \""+name+"\" could not be created. Check your configuration file for errors!", RNS.LOG_ERROR)
 				RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
@@ -287,4 +326,16 @@ class Reticulum:
 
 	@staticmethod
 	def should_use_implicit_proof():
-		return Reticulum.__use_implicit_proof
\ No newline at end of file
+		return Reticulum.__use_implicit_proof
+
+	@staticmethod
+	def should_use_event_loop():
+		return Reticulum.__use_event_loop
+
+	@staticmethod
+	def get_announce_workers():
+		return Reticulum.__announce_workers
+
+	@staticmethod
+	def get_compression_workers():
+		return Reticulum.__compression_workers
\ No newline at end of file
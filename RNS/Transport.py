@@ -1,13 +1,52 @@
 import os
 import RNS
 import time
+import errno
+import select
 import math
+import heapq
 import struct
 import threading
 import traceback
+import multiprocessing
 from time import sleep
+from collections import deque
 import vendor.umsgpack as umsgpack
 
+# A bounded set of packet hashes used for duplicate
+# detection. Hashes are kept in two generations, and
+# when the current generation fills up, the oldest
+# one is dropped as a whole. This gives constant time
+# lookups and evictions, while always remembering at
+# least the newest maxsize/2 hashes.
+class PacketHashlist:
+	def __init__(self, maxsize):
+		self.maxsize = maxsize
+		self.current = set()
+		self.previous = set()
+
+	def __contains__(self, packet_hash):
+		return packet_hash in self.current or packet_hash in self.previous
+
+	def __len__(self):
+		return len(self.current) + len(self.previous)
+
+	def add(self, packet_hash):
+		self.current.add(packet_hash)
+		if len(self.current) >= max(self.maxsize/2, 1):
+			self.previous = self.current
+			self.current = set()
+
+	def load(self, packet_hashes):
+		for packet_hash in packet_hashes:
+			self.add(packet_hash)
+
+	# Returns the hashes as a list, with the older
+	# generation first, so that loading the list
+	# again preserves the eviction order
+	def tolist(self):
+		return list(self.previous) + list(self.current)
+
 class Transport:
 	# Constants
 	BROADCAST    = 0x00;
@@ -43,28 +82,61 @@ class Transport:
 	DESTINATION_TIMEOUT = 60*60*24*7 # Destination table entries are removed if unused for one week
 
 	interfaces	 	    = []		 # All active interfaces
-	destinations        = []		 # All active destinations
-	pending_links       = []		 # Links that are being established
-	active_links	    = []		 # Links that are active
-	packet_hashlist     = []		 # A list of packet hashes for duplicate detection
-	receipts		    = []		 # Receipts of all outgoing packets for proof processing
+	destinations        = {}		 # All active destinations, keyed by destination hash
+	pending_links       = {}		 # Links that are being established, keyed by link ID
+	active_links	    = {}		 # Links that are active, keyed by link ID
+	receipt_table       = {}		 # Outstanding receipts, keyed by truncated packet hash
 
 	announce_table      = {}		 # A table for storing announces currently waiting to be retransmitted
 	destination_table   = {}		 # A lookup table containing the next hop to a given destination
 	reverse_table	    = {}		 # A lookup table for storing packet hashes used to return proofs and replies
 	link_table          = {}		 # A lookup table containing hops for links
 
-	jobs_locked = False
-	jobs_running = False
+	table_lock   = threading.RLock() # Protects the routing tables above
 	job_interval = 0.250
-	receipts_last_checked    = 0.0
-	receipts_check_interval  = 1.0
 	announces_last_checked   = 0.0
 	announces_check_interval = 1.0
 	hashlist_maxsize         = 1000000
+	packet_hashlist          = PacketHashlist(hashlist_maxsize) # Packet hashes for duplicate detection
 	tables_last_culled       = 0.0
 	tables_cull_interval	 = 5.0
 
+	# Pending timers are kept in a heap of
+	# (deadline, sequence, timer) tuples, and
+	# fired in order by a single timer thread
+	timers          = []
+	timer_sequence  = 0
+	timer_condition = threading.Condition()
+
+	# Used only when the event loop runtime is
+	# enabled in the configuration
+	readers         = {}		 # Callbacks for readable file descriptors
+	wakeup_pipe     = None
+	loop_thread     = None
+
+	# Received announces wait here, in arrival order,
+	# for their signatures to be verified. With more
+	# than one announce worker configured, signatures
+	# are verified in parallel by a process pool.
+	# Otherwise they are verified by the announce
+	# thread, also when the event loop is used, so
+	# that the loop never blocks on verification.
+	announce_queue      = deque()
+	announce_queue_size = 1024
+	announce_condition  = threading.Condition()
+	announce_pool       = None
+	announce_scheduled  = False
+	announce_drops      = 0
+	ANNOUNCE_BATCH      = 32
+	# An announce whose signature has not been
+	# verified by the pool within this time is
+	# dropped, so it cannot block the queue
+	ANNOUNCE_TIMEOUT    = 10.0
+	# How often the event loop checks the head
+	# of the queue while its verification is
+	# still pending in the pool
+	ANNOUNCE_POLL       = 0.05
+
 	identity = None
 
 	@staticmethod
@@ -85,7 +157,8 @@ class Transport:
 		if os.path.isfile(packet_hashlist_path):
 			try:
 				file = open(packet_hashlist_path, "r")
-				Transport.packet_hashlist = umsgpack.unpackb(file.read())
+				Transport.packet_hashlist = PacketHashlist(Transport.hashlist_maxsize)
+				Transport.packet_hashlist.load(umsgpack.unpackb(file.read()))
 				file.close()
 			except Exception as e:
 				RNS.log("Could not load packet hashlist from disk, the contained exception was: "+str(e), RNS.LOG_ERROR)
@@ -93,126 +166,273 @@ class Transport:
 		# Create transport-specific destinations
 		path_request_destination = RNS.Destination(None, RNS.Destination.IN, RNS.Destination.PLAIN, Transport.APP_NAME, "path", "request")
 		path_request_destination.packet_callback(Transport.pathRequestHandler)
+
+		RNS.Resource.cleanPartials()
 		
-		thread = threading.Thread(target=Transport.jobloop)
-		thread.setDaemon(True)
-		thread.start()
+		if RNS.Reticulum.should_use_event_loop():
+			# In event loop mode, UDP interface I/O,
+			# timers and transport jobs all run on one
+			# thread. Some work keeps threads of its own:
+			# the Serial, KISS, AX.25 KISS and RNode
+			# interfaces block on their ports in read
+			# loops, announces are verified by the
+			# announce thread when there is no process
+			# pool, and resources map and resume their
+			# data in background threads, since that
+			# could hold up the loop for seconds.
+			Transport.wakeup_pipe = os.pipe()
+			Transport.registerReader(Transport.wakeup_pipe[0], Transport.wakeupHandler)
+			Transport.schedule(0, Transport.jobtimer)
+
+			thread = threading.Thread(target=Transport.eventloop)
+			thread.setDaemon(True)
+			thread.start()
+
+			if Transport.announce_pool == None:
+				thread = threading.Thread(target=Transport.announceloop)
+				thread.setDaemon(True)
+				thread.start()
+		else:
+			thread = threading.Thread(target=Transport.jobloop)
+			thread.setDaemon(True)
+			thread.start()
+
+			thread = threading.Thread(target=Transport.timerloop)
+			thread.setDaemon(True)
+			thread.start()
+
+			thread = threading.Thread(target=Transport.announceloop)
+			thread.setDaemon(True)
+			thread.start()
 
 		RNS.log("Transport instance "+str(Transport.identity)+" started")
 
+	# Starts the worker process pools. Must be called
+	# before any interfaces, threads or open files
+	# exist, since the workers are forked from this
+	# process and would inherit them.
+	@staticmethod
+	def startWorkers():
+		if RNS.Reticulum.get_announce_workers() > 1 and Transport.announce_pool == None:
+			Transport.announce_pool = multiprocessing.Pool(RNS.Reticulum.get_announce_workers())
+
+		if RNS.Reticulum.get_compression_workers() > 1 and RNS.Resource.compression_pool == None:
+			RNS.Resource.compression_pool = multiprocessing.Pool(RNS.Reticulum.get_compression_workers())
+
 	@staticmethod
 	def jobloop():
 		while (True):
 			Transport.jobs()
 			sleep(Transport.job_interval)
 
+	@staticmethod
+	def jobtimer():
+		Transport.jobs()
+		Transport.schedule(Transport.job_interval, Transport.jobtimer)
+
+	# Schedules a callback to be run by the timer
+	# thread after delay seconds. The returned timer
+	# can be passed to cancelTimer.
+	@staticmethod
+	def schedule(delay, callback):
+		# Entry format is
+		timer = [time.time()+delay,	# 0: Deadline
+				 callback,			# 1: Callback
+				 True]				# 2: Active
+
+		with Transport.timer_condition:
+			Transport.timer_sequence += 1
+			heapq.heappush(Transport.timers, (timer[0], Transport.timer_sequence, timer))
+			Transport.timer_condition.notify()
+			is_next = Transport.timers[0][2] is timer
+
+		# If the event loop is waiting in select, and this
+		# timer is now the first to expire, wake it up
+		if is_next and Transport.wakeup_pipe != None and threading.current_thread() != Transport.loop_thread:
+			os.write(Transport.wakeup_pipe[1], "\x00")
+
+		return timer
+
+	@staticmethod
+	def cancelTimer(timer):
+		# Cancelled timers are left in the heap,
+		# and are simply skipped when they expire
+		timer[2] = False
+
+	# Must be called while holding the timer condition
+	@staticmethod
+	def popExpiredTimers(now):
+		expired = []
+		while len(Transport.timers) > 0 and Transport.timers[0][0] <= now:
+			expired.append(heapq.heappop(Transport.timers)[2])
+		return expired
+
+	# Must be called while holding the timer condition
+	@staticmethod
+	def nextTimerWait(now):
+		if len(Transport.timers) > 0:
+			return max(min(Transport.timers[0][0]-now, Transport.job_interval), 0)
+		else:
+			return Transport.job_interval
+
+	@staticmethod
+	def fireTimers(expired):
+		for timer in expired:
+			if timer[2]:
+				try:
+					timer[1]()
+				except Exception as e:
+					RNS.log("An exception occurred while running a scheduled timer.", RNS.LOG_ERROR)
+					RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
+					traceback.print_exc()
+
+	@staticmethod
+	def timerloop():
+		while (True):
+			with Transport.timer_condition:
+				now = time.time()
+				expired = Transport.popExpiredTimers(now)
+				if len(expired) == 0:
+					Transport.timer_condition.wait(Transport.nextTimerWait(now))
+
+			Transport.fireTimers(expired)
+
+	# Registers a file descriptor or an object with a
+	# fileno method to be watched by the event loop.
+	# The callback is run every time it is readable.
+	@staticmethod
+	def registerReader(fileobj, callback):
+		fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+		Transport.readers[fd] = callback
+
+	@staticmethod
+	def deregisterReader(fileobj):
+		fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+		Transport.readers.pop(fd, None)
+
+	@staticmethod
+	def wakeupHandler():
+		os.read(Transport.wakeup_pipe[0], 4096)
+
+	@staticmethod
+	def eventloop():
+		Transport.loop_thread = threading.current_thread()
+		while (True):
+			with Transport.timer_condition:
+				now = time.time()
+				expired = Transport.popExpiredTimers(now)
+				wait_time = 0 if len(expired) > 0 else Transport.nextTimerWait(now)
+
+			Transport.fireTimers(expired)
+
+			try:
+				readable = select.select(list(Transport.readers.keys()), [], [], wait_time)[0]
+			except select.error as e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+
+			for fd in readable:
+				callback = Transport.readers.get(fd)
+				if callback != None:
+					try:
+						callback()
+					except Exception as e:
+						RNS.log("An exception occurred while handling I/O in the event loop.", RNS.LOG_ERROR)
+						RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
+						traceback.print_exc()
+
 	@staticmethod
 	def jobs():
+		rebroadcasts = []
 		outgoing = []
-		Transport.jobs_running = True
 		try:
-			if not Transport.jobs_locked:
-				# Process receipts list for timed-out packets
-				if time.time() > Transport.receipts_last_checked+Transport.receipts_check_interval:
-					for receipt in Transport.receipts:
-						thread = threading.Thread(target=receipt.check_timeout)
-						thread.setDaemon(True)
-						thread.start()
-						if receipt.status != RNS.PacketReceipt.SENT:
-							Transport.receipts.remove(receipt)
-
-					Transport.receipts_last_checked = time.time()
-
+			with Transport.table_lock:
 				# Process announces needing retransmission
 				if time.time() > Transport.announces_last_checked+Transport.announces_check_interval:
-					for destination_hash in Transport.announce_table:
-						announce_entry = Transport.announce_table[destination_hash]
+					for destination_hash, announce_entry in list(Transport.announce_table.items()):
 						if announce_entry[2] > Transport.PATHFINDER_R:
 							RNS.log("Dropping announce for "+RNS.prettyhexrep(destination_hash)+", retries exceeded", RNS.LOG_DEBUG)
-							Transport.announce_table.pop(destination_hash)
-							break
+							Transport.announce_table.pop(destination_hash, None)
 						else:
 							if time.time() > announce_entry[1]:
 								announce_entry[1] = time.time() + math.pow(Transport.PATHFINDER_C, announce_entry[4]) + Transport.PATHFINDER_T + Transport.PATHFINDER_RW
 								announce_entry[2] += 1
-								packet = announce_entry[5]
-								block_rebroadcasts = announce_entry[7]
-								announce_context = RNS.Packet.NONE
-								if block_rebroadcasts:
-									announce_context = RNS.Packet.PATH_RESPONSE
-								announce_data = packet.data
-								announce_identity = RNS.Identity.recall(packet.destination_hash)
-								announce_destination = RNS.Destination(announce_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, "unknown", "unknown");
-								announce_destination.hash = packet.destination_hash
-								announce_destination.hexhash = announce_destination.hash.encode("hex_codec")
-								new_packet = RNS.Packet(announce_destination, announce_data, RNS.Packet.ANNOUNCE, context = announce_context, header_type = RNS.Packet.HEADER_2, transport_type = Transport.TRANSPORT, transport_id = Transport.identity.hash)
-								new_packet.hops = announce_entry[4]
-								RNS.log("Rebroadcasting announce for "+RNS.prettyhexrep(announce_destination.hash)+" with hop count "+str(new_packet.hops), RNS.LOG_DEBUG)
-								outgoing.append(new_packet)
+								rebroadcasts.append((announce_entry[5], announce_entry[4], announce_entry[7]))
 
 					Transport.announces_last_checked = time.time()
 
 
-				# Cull the packet hashlist if it has reached max size
-				while (len(Transport.packet_hashlist) > Transport.hashlist_maxsize):
-					Transport.packet_hashlist.pop(0)
-
 				if time.time() > Transport.tables_last_culled + Transport.tables_cull_interval:
 					# Cull the reverse table according to timeout
-					for truncated_packet_hash in Transport.reverse_table:
-						reverse_entry = Transport.reverse_table[truncated_packet_hash]
+					for truncated_packet_hash, reverse_entry in list(Transport.reverse_table.items()):
 						if time.time() > reverse_entry[2] + Transport.REVERSE_TIMEOUT:
-							Transport.reverse_table.pop(truncated_packet_hash)
+							Transport.reverse_table.pop(truncated_packet_hash, None)
 
 					# Cull the link table according to timeout
-					for link_id in Transport.link_table:
-						link_entry = Transport.link_table[link_id]
+					for link_id, link_entry in list(Transport.link_table.items()):
 						if time.time() > link_entry[0] + Transport.LINK_TIMEOUT:
-							Transport.link_table.pop(link_id)
+							Transport.link_table.pop(link_id, None)
 
 					# Cull the destination table in some way
-					for destination_hash in Transport.destination_table:
-						destination_entry = Transport.destination_table[destination_hash]
+					for destination_hash, destination_entry in list(Transport.destination_table.items()):
 						if time.time() > destination_entry[0] + Transport.DESTINATION_TIMEOUT:
-							Transport.destination_table.pop(destination_hash)
+							Transport.destination_table.pop(destination_hash, None)
 
 					Transport.tables_last_culled = time.time()
 
+			# Identities are recalled once the table lock is
+			# released, since recalling one can read from and
+			# write to the known destinations store
+			for packet, hops, block_rebroadcasts in rebroadcasts:
+				announce_context = RNS.Packet.NONE
+				if block_rebroadcasts:
+					announce_context = RNS.Packet.PATH_RESPONSE
+				announce_data = packet.data
+				announce_identity = RNS.Identity.recall(packet.destination_hash)
+				announce_destination = RNS.Destination(announce_identity, RNS.Destination.OUT, RNS.Destination.SINGLE, "unknown", "unknown");
+				announce_destination.hash = packet.destination_hash
+				announce_destination.hexhash = announce_destination.hash.encode("hex_codec")
+				new_packet = RNS.Packet(announce_destination, announce_data, RNS.Packet.ANNOUNCE, context = announce_context, header_type = RNS.Packet.HEADER_2, transport_type = Transport.TRANSPORT, transport_id = Transport.identity.hash)
+				new_packet.hops = hops
+				RNS.log("Rebroadcasting announce for "+RNS.prettyhexrep(announce_destination.hash)+" with hop count "+str(new_packet.hops), RNS.LOG_DEBUG)
+				outgoing.append(new_packet)
+
 		except Exception as e:
 			RNS.log("An exception occurred while running Transport jobs.", RNS.LOG_ERROR)
 			RNS.log("The contained exception was: "+str(e), RNS.LOG_ERROR)
 			traceback.print_exc()
 
-		Transport.jobs_running = False
-
 		for packet in outgoing:
 			packet.send()
 
 	@staticmethod
 	def outbound(packet):
-		while (Transport.jobs_running):
-			sleep(0.01)
-
-		Transport.jobs_locked = True
 		# TODO: This updateHash call might be redundant
 		packet.updateHash()
 		sent = False
 
 		# Check if we have a known path for the destination
 		# in the destination table
-		if packet.packet_type != RNS.Packet.ANNOUNCE and packet.destination_hash in Transport.destination_table:
-			outbound_interface = Transport.destination_table[packet.destination_hash][5]
+		destination_entry = None
+		if packet.packet_type != RNS.Packet.ANNOUNCE:
+			with Transport.table_lock:
+				destination_entry = Transport.destination_table.get(packet.destination_hash)
+
+		if destination_entry != None:
+			outbound_interface = destination_entry[5]
 
-			if Transport.destination_table[packet.destination_hash][2] > 1:
+			if destination_entry[2] > 1:
 				# Insert packet into transport
 				new_flags = (RNS.Packet.HEADER_2) << 6 | (Transport.TRANSPORT) << 4 | (packet.flags & 0b00001111)
 				new_raw = struct.pack("!B", new_flags)
 				new_raw += packet.raw[1:2]
-				new_raw += Transport.destination_table[packet.destination_hash][1]
+				new_raw += destination_entry[1]
 				new_raw += packet.raw[2:]
-				RNS.log("Packet was inserted into transport via "+RNS.prettyhexrep(Transport.destination_table[packet.destination_hash][1])+" on: "+str(outbound_interface), RNS.LOG_DEBUG)
+				RNS.log("Packet was inserted into transport via "+RNS.prettyhexrep(destination_entry[1])+" on: "+str(outbound_interface), RNS.LOG_DEBUG)
 				outbound_interface.processOutgoing(new_raw)
-				Transport.destination_table[packet.destination_hash][0] = time.time()
+				with Transport.table_lock:
+					destination_entry[0] = time.time()
 				sent = True
 			else:
 				# Destination is directly reachable, and we know on
@@ -247,13 +467,14 @@ class Transport:
 			packet.sent = True
 			packet.sent_at = time.time()
 
-			if (packet.packet_type == RNS.Packet.DATA and packet.destination.type != RNS.Destination.PLAIN):
+			# Resource parts are not given receipts, since
+			# they are proven by the resource proof
+			if (packet.packet_type == RNS.Packet.DATA and packet.destination.type != RNS.Destination.PLAIN and packet.context != RNS.Packet.RESOURCE and packet.context != RNS.Packet.RESOURCE_FEC):
 				packet.receipt = RNS.PacketReceipt(packet)
-				Transport.receipts.append(packet.receipt)
+				Transport.addReceipt(packet.receipt)
 			
 			Transport.cache(packet)
 
-		Transport.jobs_locked = False
 		return sent
 
 	@staticmethod
@@ -265,6 +486,11 @@ class Transport:
 			return True
 		if packet.context == RNS.Packet.RESOURCE_PRF:
 			return True
+		# A transfer restarted under a new map sends the
+		# same parts again, and the resource drops any
+		# parts it already holds
+		if packet.context == RNS.Packet.RESOURCE or packet.context == RNS.Packet.RESOURCE_FEC:
+			return True
 		if not packet.packet_hash in Transport.packet_hashlist:
 			return True
 		else:
@@ -276,11 +502,6 @@ class Transport:
 
 	@staticmethod
 	def inbound(raw, interface=None):
-		while (Transport.jobs_running):
-			sleep(0.1)
-			
-		Transport.jobs_locked = True
-		
 		packet = RNS.Packet(None, raw)
 		packet.unpack()
 		packet.receiving_interface = interface
@@ -288,229 +509,160 @@ class Transport:
 
 		RNS.log(str(interface)+" received packet with hash "+RNS.prettyhexrep(packet.packet_hash), RNS.LOG_EXTREME)
 
-		if Transport.packet_filter(packet):
-			Transport.packet_hashlist.append(packet.packet_hash)
+		with Transport.table_lock:
+			accepted = Transport.packet_filter(packet)
+			if accepted:
+				Transport.packet_hashlist.add(packet.packet_hash)
+
+		if accepted:
 			Transport.cache(packet)
 			
-			# General transport handling. Takes care of directing
-			# packets according to transport tables and recording
-			# entries in reverse and link tables.
-			if packet.transport_id != None and packet.packet_type != RNS.Packet.ANNOUNCE:
-				if packet.transport_id == Transport.identity.hash:
-					RNS.log("Received packet in transport for "+RNS.prettyhexrep(packet.destination_hash)+" with matching transport ID, transporting it...", RNS.LOG_DEBUG)
-					if packet.destination_hash in Transport.destination_table:
-						next_hop = Transport.destination_table[packet.destination_hash][1]
-						remaining_hops = Transport.destination_table[packet.destination_hash][2]
-						RNS.log("Next hop to destination is "+RNS.prettyhexrep(next_hop)+" with "+str(remaining_hops)+" hops remaining, transporting it.", RNS.LOG_DEBUG)
-						if remaining_hops > 1:
-							# Just increase hop count and transmit
-							new_raw = packet.raw[0:1]
-							new_raw += struct.pack("!B", packet.hops)
-							new_raw += next_hop
-							new_raw += packet.raw[12:]
-						else:
-							# Strip transport headers and transmit
-							new_flags = (RNS.Packet.HEADER_1) << 6 | (Transport.BROADCAST) << 4 | (packet.flags & 0b00001111)
-							new_raw = struct.pack("!B", new_flags)
-							new_raw += struct.pack("!B", packet.hops)
-							new_raw += packet.raw[12:]
-
-						outbound_interface = Transport.destination_table[packet.destination_hash][5]
-						outbound_interface.processOutgoing(new_raw)
-						Transport.destination_table[packet.destination_hash][0] = time.time()
+			transmissions = []
+			with Transport.table_lock:
+				# General transport handling. Takes care of directing
+				# packets according to transport tables and recording
+				# entries in reverse and link tables.
+				if packet.transport_id != None and packet.packet_type != RNS.Packet.ANNOUNCE:
+					if packet.transport_id == Transport.identity.hash:
+						RNS.log("Received packet in transport for "+RNS.prettyhexrep(packet.destination_hash)+" with matching transport ID, transporting it...", RNS.LOG_DEBUG)
+						if packet.destination_hash in Transport.destination_table:
+							next_hop = Transport.destination_table[packet.destination_hash][1]
+							remaining_hops = Transport.destination_table[packet.destination_hash][2]
+							RNS.log("Next hop to destination is "+RNS.prettyhexrep(next_hop)+" with "+str(remaining_hops)+" hops remaining, transporting it.", RNS.LOG_DEBUG)
+							if remaining_hops > 1:
+								# Just increase hop count and transmit
+								new_raw = packet.raw[0:1]
+								new_raw += struct.pack("!B", packet.hops)
+								new_raw += next_hop
+								new_raw += packet.raw[12:]
+							else:
+								# Strip transport headers and transmit
+								new_flags = (RNS.Packet.HEADER_1) << 6 | (Transport.BROADCAST) << 4 | (packet.flags & 0b00001111)
+								new_raw = struct.pack("!B", new_flags)
+								new_raw += struct.pack("!B", packet.hops)
+								new_raw += packet.raw[12:]
+
+							outbound_interface = Transport.destination_table[packet.destination_hash][5]
+							transmissions.append((outbound_interface, new_raw))
+							Transport.destination_table[packet.destination_hash][0] = time.time()
+
+							if packet.packet_type == RNS.Packet.LINKREQUEST:
+								# Entry format is
+								link_entry = [	time.time(),					# 0: Timestamp,
+												next_hop,						# 1: Next-hop transport ID
+												outbound_interface,				# 2: Next-hop interface
+												remaining_hops,					# 3: Remaining hops
+												packet.receiving_interface,		# 4: Received on interface
+												packet.hops,					# 5: Taken hops
+												packet.destination_hash,		# 6: Original destination hash
+												False]							# 7: Validated
+
+								Transport.link_table[packet.getTruncatedHash()] = link_entry
 
-						if packet.packet_type == RNS.Packet.LINKREQUEST:
-							# Entry format is
-							link_entry = [	time.time(),					# 0: Timestamp,
-											next_hop,						# 1: Next-hop transport ID
-											outbound_interface,				# 2: Next-hop interface
-											remaining_hops,					# 3: Remaining hops
-											packet.receiving_interface,		# 4: Received on interface
-											packet.hops,					# 5: Taken hops
-											packet.destination_hash,		# 6: Original destination hash
-											False]							# 7: Validated
+							else:
+								# Entry format is
+								reverse_entry = [	packet.receiving_interface,	# 0: Received on interface
+													outbound_interface,			# 1: Outbound interface
+													time.time()]				# 2: Timestamp
 
-							Transport.link_table[packet.getTruncatedHash()] = link_entry
+								Transport.reverse_table[packet.getTruncatedHash()] = reverse_entry
 
 						else:
-							# Entry format is
-							reverse_entry = [	packet.receiving_interface,	# 0: Received on interface
-												outbound_interface,			# 1: Outbound interface
-												time.time()]				# 2: Timestamp
-
-							Transport.reverse_table[packet.getTruncatedHash()] = reverse_entry
-
-					else:
-						# TODO: There should probably be some kind of REJECT
-						# mechanism here, to signal to the source that their
-						# expected path failed
-						RNS.log("Got packet in transport, but no known path to final destination. Dropping packet.", RNS.LOG_DEBUG)
-				else:
-					pass
-
-			# Link transport handling. Directs packetes according
-			# to entries in the link tables
-			if packet.packet_type != RNS.Packet.ANNOUNCE and packet.packet_type != RNS.Packet.LINKREQUEST:
-				if packet.destination_hash in Transport.link_table:
-					link_entry = Transport.link_table[packet.destination_hash]
-					# If receiving and outbound interface is
-					# the same for this link, direction doesn't
-					# matter, and we simply send the packet on.
-					outbound_interface = None
-					if link_entry[2] == link_entry[4]:
-						# But check that taken hops matches one
-						# of the expectede values.
-						if packet.hops == link_entry[3] or packet.hops == link_entry[5]:
-							outbound_interface = link_entry[2]
+							# TODO: There should probably be some kind of REJECT
+							# mechanism here, to signal to the source that their
+							# expected path failed
+							RNS.log("Got packet in transport, but no known path to final destination. Dropping packet.", RNS.LOG_DEBUG)
 					else:
-						# If interfaces differ, we transmit on
-						# the opposite interface of what the
-						# packet was received on.
-						if packet.receiving_interface == link_entry[2]:
-							# Also check that expected hop count matches
-							if packet.hops == link_entry[3]:
-								outbound_interface = link_entry[4]
-						elif packet.receiving_interface == link_entry[4]:
-							# Also check that expected hop count matches
-							if packet.hops == link_entry[5]:
+						pass
+
+				# Link transport handling. Directs packetes according
+				# to entries in the link tables
+				if packet.packet_type != RNS.Packet.ANNOUNCE and packet.packet_type != RNS.Packet.LINKREQUEST:
+					if packet.destination_hash in Transport.link_table:
+						link_entry = Transport.link_table[packet.destination_hash]
+						# If receiving and outbound interface is
+						# the same for this link, direction doesn't
+						# matter, and we simply send the packet on.
+						outbound_interface = None
+						if link_entry[2] == link_entry[4]:
+							# But check that taken hops matches one
+							# of the expectede values.
+							if packet.hops == link_entry[3] or packet.hops == link_entry[5]:
 								outbound_interface = link_entry[2]
+						else:
+							# If interfaces differ, we transmit on
+							# the opposite interface of what the
+							# packet was received on.
+							if packet.receiving_interface == link_entry[2]:
+								# Also check that expected hop count matches
+								if packet.hops == link_entry[3]:
+									outbound_interface = link_entry[4]
+							elif packet.receiving_interface == link_entry[4]:
+								# Also check that expected hop count matches
+								if packet.hops == link_entry[5]:
+									outbound_interface = link_entry[2]
 						
-					if outbound_interface != None:
-						new_raw = packet.raw[0:1]
-						new_raw += struct.pack("!B", packet.hops)
-						new_raw += packet.raw[2:]
-						outbound_interface.processOutgoing(new_raw)
-						Transport.link_table[packet.destination_hash][0] = time.time()
-					else:
-						pass
+						if outbound_interface != None:
+							new_raw = packet.raw[0:1]
+							new_raw += struct.pack("!B", packet.hops)
+							new_raw += packet.raw[2:]
+							transmissions.append((outbound_interface, new_raw))
+							Transport.link_table[packet.destination_hash][0] = time.time()
+						else:
+							pass
 
+			# Transmissions are made after the table lock is
+			# released, so slow interfaces do not hold it up
+			for interface, new_raw in transmissions:
+				interface.processOutgoing(new_raw)
 
 			# Announce handling. Handles logic related to incoming
 			# announces, queueing rebroadcasts of these, and removal
 			# of queued announce rebroadcasts once handed to the next node.
 			if packet.packet_type == RNS.Packet.ANNOUNCE:
-				local_destination = next((d for d in Transport.destinations if d.hash == packet.destination_hash), None)
-				if local_destination == None and RNS.Identity.validateAnnounce(packet):
-					if packet.transport_id != None:
-						received_from = packet.transport_id
-						
-						# Check if this is a next retransmission from
-						# another node. If it is, we're removing the
-						# announce in question from our pending table
-						if packet.destination_hash in Transport.announce_table:
-							announce_entry = Transport.announce_table[packet.destination_hash]
-							
-							if packet.hops-1 == announce_entry[4]:
-								RNS.log("Heard a local rebroadcast of announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
-								announce_entry[6] += 1
-								if announce_entry[6] >= Transport.LOCAL_REBROADCASTS_MAX:
-									RNS.log("Max local rebroadcasts of announce for "+RNS.prettyhexrep(packet.destination_hash)+" reached, dropping announce from our table", RNS.LOG_DEBUG)
-									Transport.announce_table.pop(packet.destination_hash)
-
-							if packet.hops-1 == announce_entry[4]+1 and announce_entry[2] > 0:
-								now = time.time()
-								if now < announce_entry[1]:
-									RNS.log("Rebroadcasted announce for "+RNS.prettyhexrep(packet.destination_hash)+" has been passed on to next node, no further tries needed", RNS.LOG_DEBUG)
-									Transport.announce_table.pop(packet.destination_hash)
-
-					else:
-						received_from = packet.destination_hash
+				# Announces are validated by the announce
+				# workers, and then processed in the order
+				# they arrived in by processAnnounce
+				if not packet.destination_hash in Transport.destinations:
+					Transport.queueAnnounce(packet)
 
-					# Check if this announce should be inserted into
-					# announce and destination tables
-					should_add = False
-
-					# First, check that the announce is not for a destination
-					# local to this system, and that hops are less than the max
-					if (not any(packet.destination_hash == d.hash for d in Transport.destinations) and packet.hops < Transport.PATHFINDER_M+1):
-						random_blob = packet.data[RNS.Identity.DERKEYSIZE/8+10:RNS.Identity.DERKEYSIZE/8+20]
-						random_blobs = []
-						if packet.destination_hash in Transport.destination_table:
-							random_blobs = Transport.destination_table[packet.destination_hash][4]
-
-							# If we already have a path to the announced
-							# destination, but the hop count is equal or
-							# less, we'll update our tables.
-							if packet.hops <= Transport.destination_table[packet.destination_hash][2]:
-								# Make sure we haven't heard the random
-								# blob before, so announces can't be
-								# replayed to forge paths.
-								# TODO: Check whether this approach works
-								# under all circumstances
-								if not random_blob in random_blobs:
-									should_add = True
-								else:
-									should_add = False
-							else:
-								# If an announce arrives with a larger hop
-								# count than we already have in the table,
-								# ignore it, unless the path is expired
-								if (time.time() > Transport.destination_table[packet.destination_hash][3]):
-									# We also check that the announce hash is
-									# different from ones we've already heard,
-									# to avoid loops in the network
-									if not random_blob in random_blobs:
-										# TODO: Check that this ^ approach actually
-										# works under all circumstances
-										RNS.log("Replacing destination table entry for "+str(RNS.prettyhexrep(packet.destination_hash))+" with new announce due to expired path", RNS.LOG_DEBUG)
-										should_add = True
-									else:
-										should_add = False
-								else:
-									should_add = False
-						else:
-							# If this destination is unknown in our table
-							# we should add it
-							should_add = True
-
-						if should_add:
-							now = time.time()
-							retries = 0
-							expires = now + Transport.PATHFINDER_E
-							local_rebroadcasts = 0
-							block_rebroadcasts = False
-							random_blobs.append(random_blob)
-							retransmit_timeout = now + math.pow(Transport.PATHFINDER_C, packet.hops) + (RNS.rand() * Transport.PATHFINDER_RW)
-
-							if packet.context != RNS.Packet.PATH_RESPONSE:
-								Transport.announce_table[packet.destination_hash] = [now, retransmit_timeout, retries, received_from, packet.hops, packet, local_rebroadcasts, block_rebroadcasts]
-
-							Transport.destination_table[packet.destination_hash] = [now, received_from, packet.hops, expires, random_blobs, packet.receiving_interface, packet]
-							RNS.log("Path to "+RNS.prettyhexrep(packet.destination_hash)+" is now "+str(packet.hops)+" hops away via "+RNS.prettyhexrep(received_from)+" on "+str(packet.receiving_interface), RNS.LOG_DEBUG)
-			
 			elif packet.packet_type == RNS.Packet.LINKREQUEST:
-				for destination in Transport.destinations:
-					if destination.hash == packet.destination_hash and destination.type == packet.destination_type:
-						packet.destination = destination
-						destination.receive(packet)
+				destination = Transport.destinations.get(packet.destination_hash)
+				if destination != None and destination.type == packet.destination_type:
+					packet.destination = destination
+					destination.receive(packet)
 			
 			elif packet.packet_type == RNS.Packet.DATA:
 				if packet.destination_type == RNS.Destination.LINK:
-					for link in Transport.active_links:
-						if link.link_id == packet.destination_hash:
-							packet.link = link
-							link.receive(packet)
+					link = Transport.active_links.get(packet.destination_hash)
+					if link != None:
+						packet.link = link
+						link.receive(packet)
 				else:
-					for destination in Transport.destinations:
-						if destination.hash == packet.destination_hash and destination.type == packet.destination_type:
-							packet.destination = destination
-							destination.receive(packet)
+					destination = Transport.destinations.get(packet.destination_hash)
+					if destination != None and destination.type == packet.destination_type:
+						packet.destination = destination
+						destination.receive(packet)
 
-							if destination.proof_strategy == RNS.Destination.PROVE_ALL:
-								packet.prove()
+						if destination.proof_strategy == RNS.Destination.PROVE_ALL:
+							packet.prove()
 
-							elif destination.proof_strategy == RNS.Destination.PROVE_APP:
-								if destination.callbacks.proof_requested:
-									if destination.callbacks.proof_requested(packet):
-										packet.prove()
+						elif destination.proof_strategy == RNS.Destination.PROVE_APP:
+							if destination.callbacks.proof_requested:
+								if destination.callbacks.proof_requested(packet):
+									packet.prove()
 
 			elif packet.packet_type == RNS.Packet.PROOF:
 				if packet.context == RNS.Packet.LRPROOF:
 					# This is a link request proof, check if it
 					# needs to be transported
 
-					if packet.destination_hash in Transport.link_table:
-						link_entry = Transport.link_table[packet.destination_hash]
+					with Transport.table_lock:
+						link_entry = Transport.link_table.get(packet.destination_hash)
+						if link_entry != None and packet.receiving_interface == link_entry[2]:
+							link_entry[7] = True
+
+					if link_entry != None:
 						if packet.receiving_interface == link_entry[2]:
 							# TODO: Should we validate the LR proof at each transport
 							# step before transporting it?
@@ -518,27 +670,26 @@ class Transport:
 							new_raw = packet.raw[0:1]
 							new_raw += struct.pack("!B", packet.hops)
 							new_raw += packet.raw[2:]
-							Transport.link_table[packet.destination_hash][7] = True
 							link_entry[4].processOutgoing(new_raw)
 						else:
 							RNS.log("Link request proof received on wrong interface, not transporting it.", RNS.LOG_DEBUG)
 					else:
 						# Check if we can deliver it to a local
 						# pending link
-						for link in Transport.pending_links:
-							if link.link_id == packet.destination_hash:
-								link.validateProof(packet)
+						link = Transport.pending_links.get(packet.destination_hash)
+						if link != None:
+							link.validateProof(packet)
 
 				elif packet.context == RNS.Packet.RESOURCE_PRF:
-					for link in Transport.active_links:
-						if link.link_id == packet.destination_hash:
-							link.receive(packet)
+					link = Transport.active_links.get(packet.destination_hash)
+					if link != None:
+						link.receive(packet)
 				else:
 					if packet.destination_type == RNS.Destination.LINK:
-						for link in Transport.active_links:
-							if link.link_id == packet.destination_hash:
-								packet.link = link
-								# plaintext = link.decrypt(packet.data)
+						link = Transport.active_links.get(packet.destination_hash)
+						if link != None:
+							packet.link = link
+							# plaintext = link.decrypt(packet.data)
 								
 					if len(packet.data) == RNS.PacketReceipt.EXPL_LENGTH:
 						proof_hash = packet.data[:RNS.Identity.HASHLENGTH/8]
@@ -546,8 +697,9 @@ class Transport:
 						proof_hash = None
 
 					# Check if this proof neds to be transported
-					if packet.destination_hash in Transport.reverse_table:
-						reverse_entry = Transport.reverse_table.pop(packet.destination_hash)
+					with Transport.table_lock:
+						reverse_entry = Transport.reverse_table.pop(packet.destination_hash, None)
+					if reverse_entry != None:
 						if packet.receiving_interface == reverse_entry[1]:
 							RNS.log("Proof received on correct interface, transporting it via "+str(reverse_entry[0]), RNS.LOG_DEBUG)
 							new_raw = packet.raw[0:1]
@@ -557,46 +709,100 @@ class Transport:
 						else:
 							RNS.log("Proof received on wrong interface, not transporting it.", RNS.LOG_DEBUG)
 
-					for receipt in Transport.receipts:
+					with Transport.table_lock:
+						if proof_hash != None:
+							candidates = list(Transport.receipt_table.get(proof_hash[:RNS.Identity.TRUNCATED_HASHLENGTH/8], []))
+						else:
+							# An implicit proof is addressed to the truncated
+							# hash of the packet it proves, so only receipts
+							# with a matching hash need to be checked
+							candidates = list(Transport.receipt_table.get(packet.destination_hash, []))
+
+					for receipt in candidates:
 						receipt_validated = False
 						if proof_hash != None:
 							# Only test validation if hash matches
 							if receipt.hash == proof_hash:
 								receipt_validated = receipt.validateProofPacket(packet)
 						else:
-							# In case of an implicit proof, we have
-							# to check every single outstanding receipt
 							receipt_validated = receipt.validateProofPacket(packet)
 
 						if receipt_validated:
-							Transport.receipts.remove(receipt)
+							Transport.removeReceipt(receipt)
+
+	@staticmethod
+	def addReceipt(receipt):
+		with Transport.table_lock:
+			if not receipt.truncated_hash in Transport.receipt_table:
+				Transport.receipt_table[receipt.truncated_hash] = []
+			Transport.receipt_table[receipt.truncated_hash].append(receipt)
+		Transport.scheduleReceiptTimeout(receipt)
+
+	@staticmethod
+	def scheduleReceiptTimeout(receipt):
+		if receipt.timer != None:
+			Transport.cancelTimer(receipt.timer)
+		delay = max(receipt.sent_at+receipt.timeout-time.time(), 0)
+		receipt.timer = Transport.schedule(delay, lambda: Transport.receiptTimeout(receipt))
 
-		Transport.jobs_locked = False
+	@staticmethod
+	def receiptTimeout(receipt):
+		receipt.timer = None
+		if receipt.status == RNS.PacketReceipt.SENT:
+			receipt.check_timeout()
+
+		if receipt.status != RNS.PacketReceipt.SENT:
+			Transport.removeReceipt(receipt)
+		else:
+			Transport.scheduleReceiptTimeout(receipt)
+
+	@staticmethod
+	def removeReceipt(receipt):
+		if receipt.timer != None:
+			Transport.cancelTimer(receipt.timer)
+			receipt.timer = None
+		with Transport.table_lock:
+			entries = Transport.receipt_table.get(receipt.truncated_hash)
+			if entries != None and receipt in entries:
+				entries.remove(receipt)
+				if len(entries) == 0:
+					Transport.receipt_table.pop(receipt.truncated_hash)
 
 	@staticmethod
 	def registerDestination(destination):
 		destination.MTU = RNS.Reticulum.MTU
 		if destination.direction == RNS.Destination.IN:
-			Transport.destinations.append(destination)
+			with Transport.table_lock:
+				Transport.destinations[destination.hash] = destination
 
 	@staticmethod
 	def registerLink(link):
 		RNS.log("Registering link "+str(link), RNS.LOG_DEBUG)
-		if link.initiator:
-			Transport.pending_links.append(link)
-		else:
-			Transport.active_links.append(link)
+		with Transport.table_lock:
+			if link.initiator:
+				Transport.pending_links[link.link_id] = link
+			else:
+				Transport.active_links[link.link_id] = link
 
 	@staticmethod
 	def activateLink(link):
 		RNS.log("Activating link "+str(link), RNS.LOG_DEBUG)
-		if link in Transport.pending_links:
-			Transport.pending_links.remove(link)
-			Transport.active_links.append(link)
-			link.status = RNS.Link.ACTIVE
-		else:
+		with Transport.table_lock:
+			activated = Transport.pending_links.pop(link.link_id, None) != None
+			if activated:
+				Transport.active_links[link.link_id] = link
+				link.status = RNS.Link.ACTIVE
+
+		if not activated:
 			RNS.log("Attempted to activate a link that was not in the pending table", RNS.LOG_ERROR)
 
+	@staticmethod
+	def deregisterLink(link):
+		RNS.log("Deregistering link "+str(link), RNS.LOG_DEBUG)
+		with Transport.table_lock:
+			Transport.pending_links.pop(link.link_id, None)
+			Transport.active_links.pop(link.link_id, None)
+
 
 	@staticmethod
 	def shouldCache(packet):
@@ -607,6 +813,198 @@ class Transport:
 
 		return False
 
+	@staticmethod
+	def queueAnnounce(packet):
+		with Transport.announce_condition:
+			if len(Transport.announce_queue) >= Transport.announce_queue_size:
+				Transport.announce_drops += 1
+				RNS.log("Announce queue is full, dropping announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
+				return
+
+			if Transport.announce_pool != None:
+				public_key, signature, signed_data = RNS.Identity.unpackAnnounce(packet)
+				result = Transport.announce_pool.apply_async(RNS.Identity.verifySignature, (public_key, signature, signed_data), callback=Transport.announceVerified)
+			else:
+				result = None
+
+			Transport.announce_queue.append((packet, result, time.time()))
+			Transport.announce_condition.notify()
+
+		if RNS.Reticulum.should_use_event_loop() and Transport.announce_pool != None:
+			Transport.scheduleAnnounceJob()
+
+	# Called from the process pool when the signature
+	# of an announce has been verified. The result is
+	# not marked ready until after this returns, so
+	# announceJob polls the head of the queue until
+	# it is.
+	@staticmethod
+	def announceVerified(signature_valid):
+		if RNS.Reticulum.should_use_event_loop():
+			Transport.scheduleAnnounceJob()
+
+	@staticmethod
+	def validateQueuedAnnounce(packet, result, queued_at):
+		RNS.log("Validating announce from "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
+		if result == None:
+			signature_valid = RNS.Identity.verifyAnnounce(packet)
+		else:
+			try:
+				signature_valid = result.get(max(queued_at+Transport.ANNOUNCE_TIMEOUT-time.time(), 0))
+			except multiprocessing.TimeoutError:
+				RNS.log("Signature verification timed out, dropping announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_ERROR)
+				return
+
+		if RNS.Identity.acceptAnnounce(packet, signature_valid):
+			Transport.processAnnounce(packet)
+
+	@staticmethod
+	def announceloop():
+		while True:
+			with Transport.announce_condition:
+				while len(Transport.announce_queue) == 0:
+					Transport.announce_condition.wait()
+				packet, result, queued_at = Transport.announce_queue.popleft()
+
+			try:
+				Transport.validateQueuedAnnounce(packet, result, queued_at)
+			except Exception as e:
+				RNS.log("Error while processing announce, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+	@staticmethod
+	def scheduleAnnounceJob():
+		with Transport.announce_condition:
+			if Transport.announce_scheduled:
+				return
+			Transport.announce_scheduled = True
+
+		Transport.schedule(0, Transport.announceJob)
+
+	# Processes announces at the head of the queue
+	# whose signatures have been verified. Used by
+	# the event loop runtime with a process pool,
+	# since the loop cannot block on the pool. While the head is still being
+	# verified, the job checks back every ANNOUNCE_POLL
+	# seconds, and drops the head once it has waited
+	# for ANNOUNCE_TIMEOUT.
+	@staticmethod
+	def announceJob():
+		for i in range(0, Transport.ANNOUNCE_BATCH):
+			with Transport.announce_condition:
+				if len(Transport.announce_queue) == 0:
+					Transport.announce_scheduled = False
+					return
+
+				packet, result, queued_at = Transport.announce_queue[0]
+				if result != None and not result.ready():
+					if time.time() < queued_at+Transport.ANNOUNCE_TIMEOUT:
+						Transport.schedule(Transport.ANNOUNCE_POLL, Transport.announceJob)
+						return
+					RNS.log("Signature verification timed out, dropping announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_ERROR)
+					Transport.announce_queue.popleft()
+					continue
+
+				Transport.announce_queue.popleft()
+
+			try:
+				Transport.validateQueuedAnnounce(packet, result, queued_at)
+			except Exception as e:
+				RNS.log("Error while processing announce, the contained exception was: "+str(e), RNS.LOG_ERROR)
+
+		Transport.schedule(0, Transport.announceJob)
+
+	# Applies a validated announce to the announce
+	# and destination tables
+	@staticmethod
+	def processAnnounce(packet):
+		with Transport.table_lock:
+			if packet.transport_id != None:
+				received_from = packet.transport_id
+			
+				# Check if this is a next retransmission from
+				# another node. If it is, we're removing the
+				# announce in question from our pending table
+				if packet.destination_hash in Transport.announce_table:
+					announce_entry = Transport.announce_table[packet.destination_hash]
+				
+					if packet.hops-1 == announce_entry[4]:
+						RNS.log("Heard a local rebroadcast of announce for "+RNS.prettyhexrep(packet.destination_hash), RNS.LOG_DEBUG)
+						announce_entry[6] += 1
+						if announce_entry[6] >= Transport.LOCAL_REBROADCASTS_MAX:
+							RNS.log("Max local rebroadcasts of announce for "+RNS.prettyhexrep(packet.destination_hash)+" reached, dropping announce from our table", RNS.LOG_DEBUG)
+							Transport.announce_table.pop(packet.destination_hash, None)
+
+					if packet.hops-1 == announce_entry[4]+1 and announce_entry[2] > 0:
+						now = time.time()
+						if now < announce_entry[1]:
+							RNS.log("Rebroadcasted announce for "+RNS.prettyhexrep(packet.destination_hash)+" has been passed on to next node, no further tries needed", RNS.LOG_DEBUG)
+							Transport.announce_table.pop(packet.destination_hash, None)
+
+			else:
+				received_from = packet.destination_hash
+
+			# Check if this announce should be inserted into
+			# announce and destination tables
+			should_add = False
+
+			# First, check that the announce is not for a destination
+			# local to this system, and that hops are less than the max
+			if (not packet.destination_hash in Transport.destinations and packet.hops < Transport.PATHFINDER_M+1):
+				random_blob = packet.data[RNS.Identity.DERKEYSIZE/8+10:RNS.Identity.DERKEYSIZE/8+20]
+				random_blobs = []
+				if packet.destination_hash in Transport.destination_table:
+					random_blobs = Transport.destination_table[packet.destination_hash][4]
+
+					# If we already have a path to the announced
+					# destination, but the hop count is equal or
+					# less, we'll update our tables.
+					if packet.hops <= Transport.destination_table[packet.destination_hash][2]:
+						# Make sure we haven't heard the random
+						# blob before, so announces can't be
+						# replayed to forge paths.
+						# TODO: Check whether this approach works
+						# under all circumstances
+						if not random_blob in random_blobs:
+							should_add = True
+						else:
+							should_add = False
+					else:
+						# If an announce arrives with a larger hop
+						# count than we already have in the table,
+						# ignore it, unless the path is expired
+						if (time.time() > Transport.destination_table[packet.destination_hash][3]):
+							# We also check that the announce hash is
+							# different from ones we've already heard,
+							# to avoid loops in the network
+							if not random_blob in random_blobs:
+								# TODO: Check that this ^ approach actually
+								# works under all circumstances
+								RNS.log("Replacing destination table entry for "+str(RNS.prettyhexrep(packet.destination_hash))+" with new announce due to expired path", RNS.LOG_DEBUG)
+								should_add = True
+							else:
+								should_add = False
+						else:
+							should_add = False
+				else:
+					# If this destination is unknown in our table
+					# we should add it
+					should_add = True
+
+				if should_add:
+					now = time.time()
+					retries = 0
+					expires = now + Transport.PATHFINDER_E
+					local_rebroadcasts = 0
+					block_rebroadcasts = False
+					random_blobs.append(random_blob)
+					retransmit_timeout = now + math.pow(Transport.PATHFINDER_C, packet.hops) + (RNS.rand() * Transport.PATHFINDER_RW)
+
+					if packet.context != RNS.Packet.PATH_RESPONSE:
+						Transport.announce_table[packet.destination_hash] = [now, retransmit_timeout, retries, received_from, packet.hops, packet, local_rebroadcasts, block_rebroadcasts]
+
+					Transport.destination_table[packet.destination_hash] = [now, received_from, packet.hops, expires, random_blobs, packet.receiving_interface, packet]
+					RNS.log("Path to "+RNS.prettyhexrep(packet.destination_hash)+" is now "+str(packet.hops)+" hops away via "+RNS.prettyhexrep(received_from)+" on "+str(packet.receiving_interface), RNS.LOG_DEBUG)
+
 	@staticmethod
 	def cache(packet):
 		if RNS.Transport.shouldCache(packet):
@@ -672,26 +1070,30 @@ class Transport:
 	def pathRequest(destination_hash):
 		RNS.log("Path request for "+RNS.prettyhexrep(destination_hash), RNS.LOG_DEBUG)
 		
-		local_destination = next((d for d in Transport.destinations if d.hash == destination_hash), None)
+		local_destination = Transport.destinations.get(destination_hash)
 		if local_destination != None:
 			RNS.log("Destination is local to this system, announcing", RNS.LOG_DEBUG)
 			local_destination.announce(path_response=True)
 
-		elif destination_hash in Transport.destination_table:
-			RNS.log("Path found, inserting announce for transmission", RNS.LOG_DEBUG)
-			packet = Transport.destination_table[destination_hash][6]
-			received_from = Transport.destination_table[destination_hash][5]
-
-			now = time.time()
-			retries = Transport.PATHFINDER_R
-			local_rebroadcasts = 0
-			block_rebroadcasts = True
-			retransmit_timeout = now + Transport.PATH_REQUEST_GRACE # + (RNS.rand() * Transport.PATHFINDER_RW)
-
-			Transport.announce_table[packet.destination_hash] = [now, retransmit_timeout, retries, received_from, packet.hops, packet, local_rebroadcasts, block_rebroadcasts]
-
 		else:
-			RNS.log("No known path to requested destination, ignoring request", RNS.LOG_DEBUG)
+			with Transport.table_lock:
+				destination_entry = Transport.destination_table.get(destination_hash)
+				if destination_entry != None:
+					packet = destination_entry[6]
+					received_from = destination_entry[5]
+
+					now = time.time()
+					retries = Transport.PATHFINDER_R
+					local_rebroadcasts = 0
+					block_rebroadcasts = True
+					retransmit_timeout = now + Transport.PATH_REQUEST_GRACE # + (RNS.rand() * Transport.PATHFINDER_RW)
+
+					Transport.announce_table[packet.destination_hash] = [now, retransmit_timeout, retries, received_from, packet.hops, packet, local_rebroadcasts, block_rebroadcasts]
+
+			if destination_entry != None:
+				RNS.log("Path found, inserting announce for transmission", RNS.LOG_DEBUG)
+			else:
+				RNS.log("No known path to requested destination, ignoring request", RNS.LOG_DEBUG)
 
 	# TODO: Currently only used for cache requests.
 	# Needs rethink.
@@ -705,7 +1107,7 @@ class Transport:
 		try:
 			packet_hashlist_path = RNS.Reticulum.configdir+"/packet_hashlist"
 			file = open(packet_hashlist_path, "w")
-			file.write(umsgpack.packb(Transport.packet_hashlist))
+			file.write(umsgpack.packb(Transport.packet_hashlist.tolist()))
 			file.close()
 		except Exception as e:
 			RNS.log("Could not save packet hashlist to disk, the contained exception was: "+str(e), RNS.LOG_ERROR)
@@ -0,0 +1,98 @@
+# Compares the threaded runtime with the event loop
+# runtime. Each runs in its own process with a number of
+# UDP interfaces, which receive packets at a fixed rate
+# from forked senders. Prints the number of threads, the
+# peak RSS, the CPU time used while receiving, and the
+# latency from a packet being sent until the destination
+# packet callback runs.
+#
+# usage: python bench_event_loop.py [interfaces] [packets/s per interface] [seconds]
+import os
+import sys
+import time
+import atexit
+import shutil
+import socket
+import struct
+import resource
+import tempfile
+import threading
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+BASE_PORT = 4980
+
+def percentile(values, fraction):
+	return values[min(int(len(values)*fraction), len(values)-1)]
+
+def sender(port, header, rate, duration):
+	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	interval = 1.0/rate
+	start = time.time()
+	sequence = 0
+	while time.time() < start+duration:
+		s.sendto(header+struct.pack("!dI", time.time(), sequence)+"x"*64, ("127.0.0.1", port))
+		sequence += 1
+		time.sleep(max(start+sequence*interval-time.time(), 0))
+	os._exit(0)
+
+def run(event_loop, interfaces, rate, duration):
+	# Removed after Reticulum has saved its state at exit
+	configdir = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, configdir)
+	config = "[reticulum]\nuse_event_loop = %s\n[logging]\nloglevel = 1\n[interfaces]\n" % ("true" if event_loop else "false")
+	for i in range(interfaces):
+		config += "[[UDP %d]]\ntype = UdpInterface\nlisten_ip = 127.0.0.1\nlisten_port = %d\nforward_ip = 127.0.0.1\nforward_port = %d\noutgoing = true\n" % (i, BASE_PORT+i, BASE_PORT+100)
+	open(configdir+"/config", "w").write(config)
+
+	RNS.Reticulum(configdir)
+
+	latencies = []
+	lock = threading.Lock()
+	def received(data, packet):
+		latency = time.time()-struct.unpack("!d", data[:8])[0]
+		with lock:
+			latencies.append(latency)
+
+	destination = RNS.Destination(None, RNS.Destination.IN, RNS.Destination.PLAIN, "bench", "loop")
+	destination.packet_callback(received)
+	template = RNS.Packet(RNS.Destination(None, RNS.Destination.OUT, RNS.Destination.PLAIN, "bench", "loop"), "x")
+	template.pack()
+	header = template.raw[:-1]
+
+	time.sleep(1)
+	threads = threading.active_count()
+	cpu_started = sum(os.times()[:2])
+
+	children = []
+	for i in range(interfaces):
+		pid = os.fork()
+		if pid == 0:
+			sender(BASE_PORT+i, header, rate, duration)
+		children.append(pid)
+	for pid in children:
+		os.waitpid(pid, 0)
+	time.sleep(1)
+
+	cpu = sum(os.times()[:2])-cpu_started
+	sent = int(interfaces*rate*duration)
+	latencies.sort()
+	print("%-10s %3d threads, RSS %5.1f MB, CPU %5.2fs, received %d of %d, latency p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+		"event loop" if event_loop else "threads", threads, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0, cpu,
+		len(latencies), sent, percentile(latencies, 0.5)*1000, percentile(latencies, 0.99)*1000, latencies[-1]*1000))
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] in ["threads", "loop"]:
+		run(sys.argv[1] == "loop", int(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4]))
+		return
+
+	interfaces = sys.argv[1] if len(sys.argv) > 1 else "8"
+	rate       = sys.argv[2] if len(sys.argv) > 2 else "100"
+	duration   = sys.argv[3] if len(sys.argv) > 3 else "10"
+	for mode in ["threads", "loop"]:
+		if subprocess.call([sys.executable, os.path.abspath(__file__), mode, interfaces, rate, duration]) != 0:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,88 @@
+# Measures the time from a packet being sent on a UDP
+# interface until the destination packet callback runs,
+# while several interfaces receive traffic at the same
+# time and the job loop culls a populated destination
+# table.
+#
+# usage: python bench_inbound_latency.py [interfaces] [packets/s per interface] [seconds] [table entries]
+import os
+import sys
+import atexit
+import time
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+BASE_PORT = 4950
+
+def percentile(values, fraction):
+	return values[min(int(len(values)*fraction), len(values)-1)]
+
+def sender(port, header, rate, duration):
+	s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	interval = 1.0/rate
+	start = time.time()
+	sequence = 0
+	while time.time() < start+duration:
+		s.sendto(header+struct.pack("!dI", time.time(), sequence)+"x"*64, ("127.0.0.1", port))
+		sequence += 1
+		time.sleep(max(start+sequence*interval-time.time(), 0))
+	os._exit(0)
+
+def main():
+	interfaces = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+	rate       = float(sys.argv[2]) if len(sys.argv) > 2 else 200
+	duration   = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+	entries    = int(sys.argv[4]) if len(sys.argv) > 4 else 10000
+
+	# Removed after Reticulum has saved its state at exit
+	configdir = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, configdir)
+	config = "[reticulum]\n[logging]\nloglevel = 1\n[interfaces]\n"
+	for i in range(interfaces):
+		config += "[[UDP %d]]\ntype = UdpInterface\nlisten_ip = 127.0.0.1\nlisten_port = %d\nforward_ip = 127.0.0.1\nforward_port = %d\noutgoing = false\n" % (i, BASE_PORT+i, BASE_PORT+100)
+	open(configdir+"/config", "w").write(config)
+
+	RNS.Reticulum(configdir)
+
+	# Populate the destination table with entries that
+	# are scanned, but not culled, by the job loop
+	for i in range(entries):
+		RNS.Transport.destination_table[os.urandom(10)] = [time.time(), None, 1, time.time()+3600, [], None, None]
+	RNS.Transport.tables_cull_interval = 0.5
+
+	latencies = []
+	lock = threading.Lock()
+	def received(data, packet):
+		latency = time.time()-struct.unpack("!d", data[:8])[0]
+		with lock:
+			latencies.append(latency)
+
+	destination = RNS.Destination(None, RNS.Destination.IN, RNS.Destination.PLAIN, "bench", "latency")
+	destination.packet_callback(received)
+	template = RNS.Packet(RNS.Destination(None, RNS.Destination.OUT, RNS.Destination.PLAIN, "bench", "latency"), "x")
+	template.pack()
+	header = template.raw[:-1]
+
+	children = []
+	for i in range(interfaces):
+		pid = os.fork()
+		if pid == 0:
+			sender(BASE_PORT+i, header, rate, duration)
+		children.append(pid)
+	for pid in children:
+		os.waitpid(pid, 0)
+	time.sleep(2)
+
+	sent = int(interfaces*rate*duration)
+	latencies.sort()
+	print("%d interfaces at %d packets/s each, %d table entries: received %d of %d, p50 %.2f ms, p99 %.2f ms, max %.2f ms" % (
+		interfaces, rate, entries, len(latencies), sent,
+		percentile(latencies, 0.5)*1000, percentile(latencies, 0.99)*1000, latencies[-1]*1000))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,99 @@
+# Measures the time Transport.inbound spends finding the
+# link or destination a packet is for, with a number of
+# active links and destinations registered. The tables
+# are looked up by hash, and for comparison scanned as
+# lists, as Transport used to do. Also prints the time
+# for Transport.inbound to deliver a link packet.
+#
+# usage: python bench_link_lookup.py [links ...]
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+LOOKUPS = 2000
+PACKETS = 500
+
+# The lookups of Transport.inbound before the tables were
+# indexed, which did not stop at the first match
+def scan_links(links, link_id):
+	found = None
+	for link in links:
+		if link.link_id == link_id:
+			found = link
+	return found
+
+def scan_destinations(destinations, destination_hash, destination_type):
+	found = None
+	for destination in destinations:
+		if destination.hash == destination_hash and destination.type == destination_type:
+			found = destination
+	return found
+
+def timed(lookup, keys):
+	started = time.time()
+	for key in keys:
+		if lookup(key) == None:
+			raise ValueError("Lookup found nothing")
+	return (time.time()-started)/len(keys)
+
+def bench(count):
+	for link in list(RNS.Transport.active_links.values()):
+		RNS.Transport.deregisterLink(link)
+	RNS.Transport.destinations.clear()
+
+	links = []
+	destinations = []
+	for i in range(count):
+		link = RNS.Link()
+		link.link_id = link.hash = os.urandom(10)
+		RNS.Transport.registerLink(link)
+		links.append(link)
+		destinations.append(RNS.Destination(None, RNS.Destination.IN, RNS.Destination.PLAIN, "bench", "lookup", str(i)))
+
+	link_ids = [random.choice(links).link_id for i in range(LOOKUPS)]
+	destination_hashes = [random.choice(destinations).hash for i in range(LOOKUPS)]
+	plain = RNS.Destination.PLAIN
+
+	link_scan = timed(lambda key: scan_links(links, key), link_ids)
+	link_index = timed(lambda key: RNS.Transport.active_links.get(key), link_ids)
+	destination_scan = timed(lambda key: scan_destinations(destinations, key, plain), destination_hashes)
+	destination_index = timed(lambda key: RNS.Transport.destinations.get(key), destination_hashes)
+
+	# A handshaken link among the others, receiving
+	# packets through Transport.inbound
+	sender = RNS.Link()
+	receiver = RNS.Link(peer_pub_bytes=sender.pub_bytes)
+	receiver.destination = destinations[0]
+	sender.loadPeer(receiver.pub_bytes)
+	sender.link_id = sender.hash = receiver.link_id = receiver.hash = os.urandom(10)
+	sender.handshake()
+	receiver.handshake()
+	RNS.Transport.registerLink(receiver)
+	received = [0]
+	def packet_received(message, packet):
+		received[0] += 1
+	receiver.packet_callback(packet_received)
+
+	raws = []
+	for i in range(PACKETS):
+		packet = RNS.Packet(sender, os.urandom(32))
+		packet.pack()
+		raws.append(packet.raw)
+	started = time.time()
+	for raw in raws:
+		RNS.Transport.inbound(raw, None)
+	inbound = (time.time()-started)/PACKETS
+	if received[0] != PACKETS:
+		raise ValueError("Only %d of %d link packets were delivered" % (received[0], PACKETS))
+
+	print("%6d links   link lookup: scan %8.2f us, index %4.2f us   destination lookup: scan %8.2f us, index %4.2f us   inbound link packet %5.1f us" % (
+		count, link_scan*1e6, link_index*1e6, destination_scan*1e6, destination_index*1e6, inbound*1e6))
+
+if __name__ == "__main__":
+	RNS.loglevel = RNS.LOG_ERROR
+	sizes = [int(arg) for arg in sys.argv[1:]] or [10, 1000, 10000]
+	for count in sizes:
+		bench(count)
@@ -0,0 +1,36 @@
+# Compares duplicate detection in a flat list, as
+# Transport used to do it, with PacketHashlist.
+#
+# usage: python bench_packet_hashlist.py [entries ...]
+import os
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from RNS.Transport import PacketHashlist
+
+def bench(entries):
+	hashes = [os.urandom(32) for i in range(entries)]
+	misses = [os.urandom(32) for i in range(100)]
+
+	hashlist = list(hashes)
+	setlist  = PacketHashlist(entries*2)
+	setlist.load(hashes)
+
+	rounds = max(1, 100000/entries)
+	list_miss = min(timeit.repeat(lambda: [h in hashlist for h in misses], number=rounds, repeat=3))/(rounds*len(misses))
+	set_miss  = min(timeit.repeat(lambda: [h in setlist for h in misses], number=rounds*100, repeat=3))/(rounds*100*len(misses))
+
+	def list_add():
+		hashlist.append(misses[0])
+		hashlist.pop(0)
+	list_add_time = min(timeit.repeat(list_add, number=1000, repeat=3))/1000
+	fresh = iter([os.urandom(32) for i in range(30000)])
+	set_add_time  = min(timeit.repeat(lambda: setlist.add(next(fresh)), number=10000, repeat=3))/10000
+
+	print("%8d entries   lookup: list %9.2f us, set %5.2f us   insert+cull: list %8.2f us, set %5.2f us" % (
+		entries, list_miss*1e6, set_miss*1e6, list_add_time*1e6, set_add_time*1e6))
+
+if __name__ == "__main__":
+	sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000, 1000000]
+	for entries in sizes:
+		bench(entries)
@@ -0,0 +1,85 @@
+# Measures the signature validations and time spent per
+# received implicit proof, as sent for every packet by a
+# destination with PROVE_ALL, with a number of receipts
+# outstanding. Proofs are passed to Transport.inbound,
+# which looks receipts up by truncated packet hash, and
+# for comparison checked against every receipt in a list,
+# as Transport used to do.
+#
+# usage: python bench_proof_validation.py [outstanding receipts ...]
+import os
+import sys
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+PROOFS = 20
+
+# The proof handling of Transport.inbound before the
+# receipt index, for implicit proofs
+def scan(receipts, packet):
+	for receipt in receipts:
+		if receipt.validateProofPacket(packet):
+			receipts.remove(receipt)
+			return True
+	return False
+
+def bench(identity, outstanding):
+	destination = RNS.Destination(identity, RNS.Destination.OUT, RNS.Destination.SINGLE, "bench", "proofs")
+	receipts = []
+	proofs = []
+	for i in range(outstanding):
+		packet = RNS.Packet(destination, os.urandom(16))
+		packet.pack()
+		receipt = RNS.PacketReceipt(packet)
+		receipts.append(receipt)
+
+		proof = RNS.Packet(packet.generateProofDestination(), identity.sign(receipt.hash), RNS.Packet.PROOF)
+		proof.pack()
+		proofs.append(proof.raw)
+
+	proven = random.sample(range(outstanding), min(PROOFS, outstanding))
+
+	validations = [0]
+	validate = RNS.Identity.validate
+	def counting_validate(self, signature, message):
+		validations[0] += 1
+		return validate(self, signature, message)
+	RNS.Identity.validate = counting_validate
+
+	try:
+		receipt_list = list(receipts)
+		started = time.time()
+		for i in proven:
+			packet = RNS.Packet(None, proofs[i])
+			packet.unpack()
+			if not scan(receipt_list, packet):
+				raise ValueError("Proof was not validated by the list scan")
+		list_time = (time.time()-started)/len(proven)
+		list_validations = validations[0]/float(len(proven))
+
+		for receipt in receipts:
+			RNS.Transport.addReceipt(receipt)
+		validations[0] = 0
+		started = time.time()
+		for i in proven:
+			RNS.Transport.inbound(proofs[i], None)
+		index_time = (time.time()-started)/len(proven)
+		index_validations = validations[0]/float(len(proven))
+		if len([i for i in proven if receipts[i].status != RNS.PacketReceipt.DELIVERED]) > 0:
+			raise ValueError("Proof was not validated by Transport")
+	finally:
+		RNS.Identity.validate = validate
+		for receipt in receipts:
+			RNS.Transport.removeReceipt(receipt)
+
+	print("%6d outstanding   list scan: %7.1f validations, %8.2f ms per proof   index: %4.1f validations, %5.2f ms per proof" % (
+		outstanding, list_validations, list_time*1000, index_validations, index_time*1000))
+
+if __name__ == "__main__":
+	RNS.loglevel = RNS.LOG_ERROR
+	identity = RNS.Identity()
+	sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000]
+	for outstanding in sizes:
+		bench(identity, outstanding)
@@ -0,0 +1,95 @@
+# Measures the threads and CPU time used to time out a
+# number of outstanding packet receipts. The receipts are
+# timed out by the Transport timer thread, and for
+# comparison by starting a thread per receipt every
+# second to check it, as Transport used to do. Each runs
+# in its own process. Also prints how late after their
+# deadline the receipts timed out.
+#
+# usage: python bench_receipt_timers.py [receipts] [timeout]
+import os
+import sys
+import time
+import threading
+import subprocess
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+CHECK_INTERVAL = 1.0
+
+def percentile(values, fraction):
+	return values[min(int(len(values)*fraction), len(values)-1)]
+
+# The receipt check of Transport.jobs before the timer
+# thread, without the rest of the jobs
+def check_loop(receipts, started, stopped):
+	while len(receipts) > 0 and not stopped.is_set():
+		for receipt in list(receipts):
+			if stopped.is_set():
+				return
+			thread = threading.Thread(target=receipt.check_timeout)
+			thread.setDaemon(True)
+			thread.start()
+			started[0] += 1
+			if receipt.status != RNS.PacketReceipt.SENT:
+				receipts.remove(receipt)
+		time.sleep(CHECK_INTERVAL)
+
+def run(timers, count, timeout):
+	RNS.loglevel = RNS.LOG_ERROR
+	destination = RNS.Destination(None, RNS.Destination.OUT, RNS.Destination.PLAIN, "bench", "receipts")
+	# Checks started a second apart can both find the
+	# same receipt timed out, so it is counted once
+	lateness = {}
+	def timed_out(receipt):
+		lateness[id(receipt)] = receipt.concluded_at-receipt.sent_at-receipt.timeout
+
+	receipts = []
+	for i in range(count):
+		packet = RNS.Packet(destination, os.urandom(16))
+		packet.pack()
+		receipt = RNS.PacketReceipt(packet)
+		receipt.set_timeout(timeout)
+		receipt.timeout_callback(timed_out)
+		receipts.append(receipt)
+
+	cpu_started = sum(os.times()[:2])
+	started = time.time()
+	threads_started = [1]
+	stopped = threading.Event()
+	if timers:
+		thread = threading.Thread(target=RNS.Transport.timerloop)
+		thread.setDaemon(True)
+		thread.start()
+		for receipt in receipts:
+			RNS.Transport.addReceipt(receipt)
+	else:
+		thread = threading.Thread(target=check_loop, args=(receipts, threads_started, stopped))
+		thread.setDaemon(True)
+		thread.start()
+
+	peak_threads = 0
+	while len(lateness) < count and time.time() < started+timeout*3:
+		peak_threads = max(peak_threads, threading.active_count())
+		time.sleep(0.01)
+	stopped.set()
+
+	cpu = sum(os.times()[:2])-cpu_started
+	values = sorted(lateness.values())
+	print("%-16s %d receipts: %6d threads started, peak %3d alive, CPU %5.2fs, %d timed out, late by p50 %.0f ms, max %.0f ms" % (
+		"timer thread" if timers else "thread per check", count, threads_started[0], peak_threads, cpu,
+		len(values), percentile(values, 0.5)*1000, values[-1]*1000))
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] in ["timers", "threads"]:
+		run(sys.argv[1] == "timers", int(sys.argv[2]), float(sys.argv[3]))
+		return
+
+	count   = sys.argv[1] if len(sys.argv) > 1 else "10000"
+	timeout = sys.argv[2] if len(sys.argv) > 2 else "10"
+	for mode in ["threads", "timers"]:
+		if subprocess.call([sys.executable, os.path.abspath(__file__), mode, count, timeout]) != 0:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
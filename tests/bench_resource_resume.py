@@ -0,0 +1,141 @@
+# Transfers a resumable resource between two Reticulum
+# instances over UDP on the loopback interface, tears the
+# link down once a fraction of the parts have arrived,
+# and transfers the same data again on a new link. Prints
+# how many bytes of parts were received on each link,
+# which for the second link should be about the remainder.
+# With "expired", the saved partial is aged past
+# Resource.PARTIAL_TIMEOUT before the second link, which
+# should then receive the whole resource again. Exits
+# with status 1 if the data does not match, or if the
+# second link received more than expected.
+#
+# usage: python bench_resource_resume.py [size] [cut] [expired]
+import os
+import sys
+import atexit
+import time
+import shutil
+import tempfile
+import subprocess
+import threading
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+BASE_PORT = 4970
+TIMEOUT   = 120
+
+# Fraction of the data size that the second link may
+# receive beyond the remainder, for encryption overhead
+# and parts that were in flight at the cut
+TOLERANCE = 0.05
+
+def configure(configdir, listen_port, forward_port):
+	os.makedirs(configdir)
+	config  = "[reticulum]\n[logging]\nloglevel = 1\n[interfaces]\n"
+	config += "[[UDP]]\ntype = UdpInterface\nlisten_ip = 127.0.0.1\nlisten_port = %d\nforward_ip = 127.0.0.1\nforward_port = %d\noutgoing = true\n" % (listen_port, forward_port)
+	open(configdir+"/config", "w").write(config)
+
+def sender(configdir, data_path, hash_path):
+	RNS.Reticulum(configdir)
+	destination = RNS.Destination(RNS.Identity(), RNS.Destination.IN, RNS.Destination.SINGLE, "bench", "resume")
+	def established(link):
+		link.set_resource_resumable(True)
+		threading.Thread(target=RNS.Resource, args=(open(data_path, "rb"), link)).start()
+	destination.link_established_callback(established)
+	open(hash_path+".tmp", "w").write(destination.hash)
+	os.rename(hash_path+".tmp", hash_path)
+	time.sleep(600)
+
+def main():
+	if len(sys.argv) > 1 and sys.argv[1] == "sender":
+		sender(*sys.argv[2:5])
+		return True
+
+	size    = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	cut     = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+	expired = len(sys.argv) > 3 and sys.argv[3] == "expired"
+
+	# Removed after Reticulum has saved its state at exit
+	workdir = tempfile.mkdtemp()
+	atexit.register(shutil.rmtree, workdir)
+	data = os.urandom(size)
+	open(workdir+"/data", "wb").write(data)
+	hash_path = workdir+"/hash"
+	configure(workdir+"/sender", BASE_PORT, BASE_PORT+1)
+	configure(workdir+"/receiver", BASE_PORT+1, BASE_PORT)
+
+	process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "sender", workdir+"/sender", workdir+"/data", hash_path])
+
+	try:
+		RNS.Reticulum(workdir+"/receiver")
+		started = time.time()
+		while not os.path.isfile(hash_path):
+			if process.poll() != None:
+				raise IOError("Sender exited with status "+str(process.returncode))
+			if time.time() > started+TIMEOUT:
+				raise IOError("Sender did not start")
+			time.sleep(0.1)
+		destination_hash = open(hash_path).read()
+		while not RNS.Transport.hasPath(destination_hash):
+			if time.time() > started+TIMEOUT:
+				raise IOError("No path to sender")
+			RNS.Transport.requestPath(destination_hash)
+			time.sleep(0.5)
+		destination = RNS.Destination(RNS.Identity.recall(destination_hash), RNS.Destination.OUT, RNS.Destination.SINGLE, "bench", "resume")
+
+		state = {"bytes": 0, "cut": cut, "resource": None}
+		receive_part = RNS.Resource.receive_part
+		def counting_receive_part(resource, packet):
+			state["bytes"] += len(packet.data)
+			receive_part(resource, packet)
+			if state["cut"] != None and resource.received_count >= state["cut"]*resource.total_parts:
+				state["cut"] = None
+				resource.link.teardown()
+		RNS.Resource.receive_part = counting_receive_part
+
+		def transfer():
+			state["bytes"] = 0
+			state["resource"] = None
+			link = RNS.Link(destination)
+			link.set_resource_strategy(RNS.Link.ACCEPT_ALL)
+			link.set_resource_resumable(True)
+			link.resource_concluded_callback(lambda resource: state.update(resource=resource))
+			link.resource_started_callback(lambda resource: None)
+			started = time.time()
+			while state["resource"] == None:
+				if time.time() > started+TIMEOUT:
+					raise IOError("Transfer timed out")
+				time.sleep(0.1)
+			return state["resource"], state["bytes"], time.time()-started
+
+		resource, received, duration = transfer()
+		partials = os.listdir(RNS.Reticulum.cachepath+"/resources")
+		print("First link: status %d after %.2fs, %d bytes of parts received, %d files saved" % (
+			resource.status, duration, received, len(partials)))
+
+		if expired:
+			aged = time.time()-RNS.Resource.PARTIAL_TIMEOUT-60
+			for name in partials:
+				os.utime(RNS.Reticulum.cachepath+"/resources/"+name, (aged, aged))
+
+		time.sleep(1)
+		resource, received, duration = transfer()
+		print("Second link: status %d after %.2fs, %d bytes of parts received, %.1f%% of the data size" % (
+			resource.status, duration, received, received*100.0/size))
+
+		if resource.status != RNS.Resource.COMPLETE or resource.data != data:
+			print("Data does not match")
+			return False
+		expected = 1.0 if expired else 1.0-cut
+		if received > (expected+TOLERANCE)*size or (expired and received < size):
+			print("Expected about %.1f%% of the data size on the second link" % (expected*100))
+			return False
+		print("Data matches")
+		return True
+	finally:
+		process.kill()
+
+if __name__ == "__main__":
+	if not main():
+		sys.exit(1)
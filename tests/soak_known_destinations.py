@@ -0,0 +1,88 @@
+# Feeds synthetic announces to Identity.remember, with
+# every announced destination also holding a path in
+# the destination table, as on a busy transport node.
+# Prints the number of destinations held in memory,
+# the process RSS and the cost per announce as it goes,
+# which should all stay flat once the maximum is reached.
+#
+# usage: python soak_known_destinations.py [announces] [known_destinations_max] [paths] [links]
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import threading
+from collections import OrderedDict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import RNS
+
+class FakeLink:
+	def __init__(self, destination_hash):
+		self.destination = FakeDestination(destination_hash)
+
+class FakeDestination:
+	def __init__(self, destination_hash):
+		self.hash = destination_hash
+
+def rss_mb():
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def main():
+	announces = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+	maximum   = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+	paths     = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+	links     = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+
+	storagepath = tempfile.mkdtemp()
+	RNS.loglevel = RNS.LOG_ERROR
+	RNS.Reticulum.storagepath = storagepath
+	RNS.Identity.known_destinations_max = maximum
+	RNS.Identity.loadKnownDestinations()
+
+	# Remembered destinations are committed in
+	# batches by timers
+	thread = threading.Thread(target=RNS.Transport.timerloop)
+	thread.setDaemon(True)
+	thread.start()
+
+	try:
+		# Paths expire in arrival order, so the destination
+		# table holds the most recently announced ones
+		path_table = OrderedDict()
+		RNS.Transport.destination_table = path_table
+		public_key = RNS.Identity().getPublicKey()
+		linked = []
+
+		interval = max(announces/10, 1)
+		started = time.time()
+		batch_started = started
+		for i in range(announces):
+			destination_hash = os.urandom(10)
+			RNS.Identity.remember(os.urandom(32), destination_hash, public_key)
+
+			path_table[destination_hash] = [time.time(), None, 1, time.time()+3600, [], None, None]
+			if len(path_table) > paths:
+				path_table.popitem(last=False)
+
+			if len(linked) < links:
+				linked.append(destination_hash)
+				RNS.Transport.active_links[destination_hash] = FakeLink(destination_hash)
+
+			if (i+1) % interval == 0:
+				now = time.time()
+				print("%8d announces: %6d in memory, %7d evicted, RSS %5.1f MB, %6.1f us per announce" % (
+					i+1, len(RNS.Identity.known_destinations), RNS.Identity.known_destinations_evicted,
+					rss_mb(), (now-batch_started)*1e6/interval))
+				batch_started = now
+
+		missing = [h for h in linked if not h in RNS.Identity.known_destinations]
+		recalled = sum(1 for h in path_table.keys()[:1000] if RNS.Identity.recall(h) != None)
+		print("%d of %d linked destinations in memory, %d of 1000 evicted paths recalled from storage, %.1fs in total" % (
+			links-len(missing), links, recalled, time.time()-started))
+	finally:
+		RNS.Identity.saveKnownDestinations()
+		shutil.rmtree(storagepath)
+
+if __name__ == "__main__":
+	main()
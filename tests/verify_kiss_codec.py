@@ -0,0 +1,159 @@
+# Checks KISSCodec against the per-byte read loop that the
+# KISS, AX.25 KISS and RNode interfaces used before it.
+# Random streams of data and command frames are fed to both
+# in random read sizes, including frames that share a FEND,
+# bytes between frames, FEND and FESC heavy payloads and
+# oversized frames, and the frames they yield must match.
+#
+# usage: python verify_kiss_codec.py [streams]
+import os
+import sys
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RNS", "Interfaces"))
+from KISSCodec import KISSCodec
+
+FEND  = chr(0xC0)
+FESC  = chr(0xDB)
+TFEND = chr(0xDC)
+TFESC = chr(0xDD)
+
+CMD_UNKNOWN = chr(0xFE)
+CMD_DATA    = chr(0x00)
+CMD_READY   = chr(0x0F)
+CMD_FREQ    = chr(0x01)
+CMD_ERROR   = chr(0x90)
+
+MTU = 500
+
+# The read loop of KISSInterface before KISSCodec, reading
+# from a string instead of the port. The KISS interfaces
+# mask the port nibble off the command, RNode does not.
+# CMD_READY called process_queue for every byte after the
+# command, which is recorded once per frame here.
+def per_byte(stream, command_mask):
+	frames = []
+	in_frame = False
+	escape = False
+	ready = False
+	command = CMD_UNKNOWN
+	data_buffer = ""
+	for byte in stream:
+		if (in_frame and byte == FEND and command == CMD_DATA):
+			in_frame = False
+			frames.append(("data", data_buffer))
+		elif (byte == FEND):
+			in_frame = True
+			ready = False
+			command = CMD_UNKNOWN
+			data_buffer = ""
+		elif (in_frame and len(data_buffer) < MTU):
+			if (len(data_buffer) == 0 and command == CMD_UNKNOWN):
+				byte = chr(ord(byte) & command_mask)
+				command = byte
+			elif (command == CMD_DATA):
+				if (byte == FESC):
+					escape = True
+				else:
+					if (escape):
+						if (byte == TFEND):
+							byte = FEND
+						if (byte == TFESC):
+							byte = FESC
+						escape = False
+					data_buffer = data_buffer+byte
+			elif (command == CMD_READY and not ready):
+				ready = True
+				frames.append(("ready", None))
+	return frames
+
+def bulk(stream, reads, command_mask):
+	codec = KISSCodec(MTU, command_mask=command_mask)
+	frames = []
+	position = 0
+	for end in reads+[len(stream)]:
+		for command, data in codec.feed(stream[position:end]):
+			if command == CMD_DATA:
+				frames.append(("data", data))
+			elif command == CMD_READY and len(data) > 0:
+				frames.append(("ready", None))
+		position = end
+	return frames
+
+def random_bytes(length):
+	return "".join(chr(random.randint(0, 255)) for _ in range(length))
+
+def payload():
+	length = random.choice([0, 1, 2, 10, 100, MTU-1, MTU, MTU+1, 700])
+	special = [FEND, FESC, TFEND, TFESC, CMD_DATA, CMD_READY]
+	return "".join(random.choice(special) if random.random() < 0.3 else chr(random.randint(0, 255)) for _ in range(length))
+
+# Bytes outside of frames, such as line noise. FESC is left
+# out, since the per-byte reader carried an escape over
+# from one frame to the next, which KISSCodec does not.
+def noise():
+	return random_bytes(random.randint(1, 5)).replace(FEND, "x").replace(FESC, "x")
+
+def stream(commands, ports):
+	frames = []
+	for i in range(random.randint(1, 6)):
+		command = random.choice(commands)
+		if command == CMD_DATA:
+			data = payload()
+			assert KISSCodec.unescape(KISSCodec.escape(data)) == data
+			frames.append(chr(ord(command) | random.choice(ports))+KISSCodec.escape(data))
+		else:
+			frames.append(command+KISSCodec.escape(random_bytes(random.choice([0, 1, 4]))))
+
+	stream = noise() if random.random() < 0.3 else ""
+	for frame in frames:
+		if stream.endswith(FEND) and random.random() < 0.3:
+			stream += frame+FEND
+		else:
+			stream += FEND+frame+FEND
+		if random.random() < 0.2:
+			stream += noise()
+	return stream+FEND+CMD_DATA+FEND
+
+def main():
+	streams = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+	random.seed(7)
+
+	# Data frames for the KISS interfaces are sent on
+	# several ports. CMD_ERROR is only sent by RNodes, and
+	# would read as data on port 9 to the KISS interfaces.
+	modes = [
+		("KISS", 0x0F, [CMD_DATA, CMD_DATA, CMD_READY], [0x00, 0x10, 0x20]),
+		("RNode", 0xFF, [CMD_DATA, CMD_DATA, CMD_READY, CMD_FREQ, CMD_ERROR], [0x00]),
+	]
+	for name, command_mask, commands, ports in modes:
+		frames = 0
+		for i in range(streams):
+			data = stream(commands, ports)
+			reads = sorted(random.sample(range(len(data)+1), min(len(data)+1, random.randint(0, 8))))
+			expected = per_byte(data, command_mask)
+			received = bulk(data, reads, command_mask)
+			if received != expected:
+				print("%s stream %d differs: %d frames from the per-byte reader, %d from KISSCodec" % (name, i, len(expected), len(received)))
+				sys.exit(1)
+			frames += len(expected)
+		print("%s: %d frames in %d streams match the per-byte reader" % (name, frames, streams))
+
+	for data in [FESC+"a", FESC+FESC+TFEND, "a"+FESC, FESC+TFESC+TFEND, FESC+chr(0)+FESC+TFESC]:
+		frame = FEND+CMD_DATA+data+FEND
+		if per_byte(frame, 0x0F) != bulk(frame, [], 0x0F):
+			print("Invalid escape %r differs" % data)
+			sys.exit(1)
+	print("Invalid escapes match the per-byte reader")
+
+	# Empty frames, which are data frames without data,
+	# command frames without arguments, and FENDs with
+	# nothing between them
+	for data in [FEND+CMD_DATA+FEND, FEND+CMD_READY+FEND, FEND+FEND, FEND+FEND+CMD_DATA+FEND+FEND, FEND+CMD_READY+FEND+CMD_DATA+FEND]:
+		for command_mask in [0x0F, 0xFF]:
+			if per_byte(data, command_mask) != bulk(data, [], command_mask):
+				print("Empty frames %r differ" % data)
+				sys.exit(1)
+	print("Empty frames match the per-byte reader")
+
+if __name__ == "__main__":
+	main()